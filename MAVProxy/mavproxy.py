@@ -8,10 +8,11 @@ Released under the GNU GPL version 3 or later
 '''
 
 import sys, os, struct, math, time, socket
-import fnmatch, errno, threading
-import serial, Queue, select
+# for --profile-startup
+startup_time = time.time()
+import fnmatch, errno, threading, re, functools, atexit
+import serial, Queue
 import traceback
-import select
 
 # allow running without installing
 #sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
@@ -21,13 +22,25 @@ from MAVProxy.modules.lib import textconsole
 from MAVProxy.modules.lib import rline
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import dumpstacks
+from MAVProxy.modules.lib import mp_select
+from MAVProxy.modules.lib import mp_output
+from MAVProxy.modules.lib import mp_scheduler
+from MAVProxy.modules.lib import mp_vehicles
+from MAVProxy.modules.lib import mp_perf
+from MAVProxy.modules.lib import mp_latency
+from MAVProxy.modules.lib import mp_rates
+from MAVProxy.modules.lib import mp_dedupe
 
 class MPStatus(object):
     '''hold status information about the mavproxy'''
     def __init__(self):
         self.gps	 = None
+        # last message and count of each type, from all vehicles
+        # combined. mpstate.vehicles keeps them per vehicle
         self.msgs = {}
         self.msg_count = {}
+        # arrival rate of each message type, per link and system
+        self.rates = mp_rates.RateTracker()
         self.counters = {'MasterIn' : [], 'MasterOut' : 0, 'FGearIn' : 0, 'FGearOut' : 0, 'Slave' : 0}
         self.setup_mode = opts.setup
         self.mav_error = 0
@@ -50,24 +63,50 @@ class MPStatus(object):
         self.lost_gps_lock = False
         self.last_gps_lock = 0
         self.watch = None
+        self.watch_re = None
+        self.watch_types = {}
         self.last_streamrate1 = -1
         self.last_streamrate2 = -1
         self.last_seq = 0
         self.armed = False
-
-    def show(self, f, pattern=None):
-        '''write status to status.txt'''
+        # main loop wakeups, for checking how often we poll
+        self.wakeups = 0
+        self.wakeup_rate = 0.0
+        self.last_wakeups = 0
+        self.last_wakeup_check = time.time()
+
+    def update_wakeup_rate(self):
+        '''update the main loop wakeups per second'''
+        now = time.time()
+        if now > self.last_wakeup_check:
+            self.wakeup_rate = (self.wakeups - self.last_wakeups) / (now - self.last_wakeup_check)
+        self.last_wakeups = self.wakeups
+        self.last_wakeup_check = now
+
+    def show(self, f, pattern=None, vehicles=None):
+        '''write status to status.txt. With more than one vehicle in
+        vehicles the messages of each are shown separately'''
         if pattern is None:
             f.write('Counters: ')
             for c in self.counters:
                 f.write('%s:%s ' % (c, self.counters[c]))
             f.write('\n')
             f.write('MAV Errors: %u\n' % self.mav_error)
+            f.write('Wakeups: %.1f/s\n' % self.wakeup_rate)
             f.write(str(self.gps)+'\n')
-        for m in sorted(self.msgs.keys()):
+        if vehicles is not None and len(vehicles) > 1:
+            for v in sorted(vehicles, key=lambda v: (v.sysid, v.compid)):
+                f.write('Vehicle %u:%u\n' % (v.sysid, v.compid))
+                self.show_msgs(f, v.msgs, v.msg_count, pattern)
+        else:
+            self.show_msgs(f, self.msgs, self.msg_count, pattern)
+
+    def show_msgs(self, f, msgs, msg_count, pattern):
+        '''write the last message of each type matching a pattern'''
+        for m in sorted(msgs.keys()):
             if pattern is not None and not fnmatch.fnmatch(str(m).upper(), pattern.upper()):
                 continue
-            f.write("%u: %s\n" % (self.msg_count[m], str(self.msgs[m])))
+            f.write("%u: %s\n" % (msg_count[m], str(msgs[m])))
 
     def write(self):
         '''write status to status.txt'''
@@ -89,6 +128,7 @@ def add_input(cmd, immediate=False):
         process_stdin(cmd)
     else:
         mpstate.input_queue.put(cmd)
+        mpstate.wakeup.wake()
 
 class MAVFunctions(object):
     '''core functions available in modules'''
@@ -114,6 +154,9 @@ class MPState(object):
               MPSetting('heartbeat', int, 1, 'Heartbeat rate', range=(0,5), increment=1),
               MPSetting('mavfwd', bool, True, 'Allow forwarded control'),
               MPSetting('mavfwd_rate', bool, False, 'Allow forwarded rate control'),
+              MPSetting('passthrough', bool, True, 'Forward raw link data to outputs'),
+              MPSetting('dedupe', bool, True, 'Process packets from redundant links once'),
+              MPSetting('dedupewindow', float, 0.5, 'Seconds to look for duplicate packets', range=(0.05,5), increment=0.05),
               MPSetting('shownoise', bool, True, 'Show non-MAVLink data'),
 
               MPSetting('altreadout', int, 10, 'Altitude Readout',
@@ -121,7 +164,13 @@ class MPState(object):
               MPSetting('distreadout', int, 200, 'Distance Readout', range=(0,10000), increment=1),
 
               MPSetting('moddebug', int, 0, 'Module Debug Level', range=(0,3), increment=1, tab='Debug'),
-              MPSetting('flushlogs', bool, False, 'Flush logs on every packet'),
+              MPSetting('flushlogs', bool, False, 'Flush logs on every write'),
+              MPSetting('logfsync', float, 0, 'Seconds between log fsyncs, 0 for none', range=(0,3600), increment=1),
+              MPSetting('logbuffer', int, 2048, 'Log buffer size in KB per log', range=(128,131072), increment=64),
+              MPSetting('logcompress', str, 'none', 'Log compression, from the next segment', choice=['none','gzip','zstd']),
+              MPSetting('logsegsize', int, 0, 'Log segment size in MB, 0 for no limit', range=(0,100000), increment=1),
+              MPSetting('logsegtime', int, 0, 'Log segment length in minutes, 0 for no limit', range=(0,10000), increment=1),
+              MPSetting('logindex', bool, True, 'Write tlog indexes, from the next segment'),
               MPSetting('requireexit', bool, False, 'Require exit command'),
 
               MPSetting('basealt', int, 0, 'Base Altitude', range=(0,30000), increment=1, tab='Altitude'),
@@ -135,7 +184,11 @@ class MPState(object):
 
         self.completions = {
             "script" : ["(FILENAME)"],
-            "set"    : ["(SETTING)"]
+            "set"    : ["(SETTING)"],
+            "vehicles" : ["<clear>"],
+            "perf"   : ["<start|stop|reset|modules|types>"],
+            "latency" : ["<start|stop|reset|show>"],
+            "replay" : ["<status|pause|resume|speed|seek>"]
             }
 
         self.status = MPStatus()
@@ -143,6 +196,9 @@ class MPState(object):
         # master mavlink device
         self.mav_master = None
 
+        # tlogs being replayed as masters
+        self.replay = []
+
         # mavlink outputs
         self.mav_outputs = []
 
@@ -150,17 +206,86 @@ class MPState(object):
         self.sitl_output = None
 
         self.mav_param = mavparm.MAVParmDict()
+        # per system/component state
+        self.vehicles = mp_vehicles.VehicleRegistry()
         self.modules = []
         self.public_modules = {}
+        # map of message type to the modules that want it
+        self.mavlink_dispatch = {}
+        # messages to forward to the outputs, when forwarding raw link data
+        self.forward_msgs = None
+        # messages waiting for dispatch_message() while process_master
+        # parses a block, or None to dispatch each as it is decoded
+        self.dispatch_queue = None
         self.functions = MAVFunctions()
-        self.select_extra = {}
+        # file descriptors for the main loop to wait on
+        self.selector = mp_select.MPSelect()
+        # this allows modules to register their own file descriptors
+        # for the main select loop
+        self.select_extra = mp_select.MPSelectDict(self.selector, process_select_extra)
+        # forwarding latency tracing, see the latency command
+        self.latency = mp_latency.LatencyTracer()
+        # duplicate packets from redundant links
+        self.dedupe = mp_dedupe.Deduplicator()
+        # module CPU accounting, see the perf command
+        self.perf = mp_perf.PerfRecorder()
+        # module timers
+        self.scheduler = mp_scheduler.MPScheduler(callback_exception, perf=self.perf)
+        # lets other threads wake the main loop when there is input
+        self.wakeup = mp_select.MPWakeup(self.selector, process_input)
         self.continue_mode = False
         self.aliases = {}
-        # this can be adjusted for HIL
+        # main loop timeout while any module polls in idle_task()
         self.select_timeout = 0.01
+        # longest the main loop waits when nothing is due. Without a
+        # wakeup pipe input is only seen when the loop wakes
+        if self.wakeup.available:
+            self.max_select_timeout = 1.0
+        else:
+            self.max_select_timeout = 0.1
+        # set by run_idle_tasks() when a module needs idle_task() on every pass
+        self.idle_polling = True
+        # set when running with --event-loop
+        self.event_loop = None
+        # received messages shared with GUI child processes, see telemetry_ring()
+        self.telemetry = None
+        # tlog and raw log writers, set by open_logs()
+        self.logwriter = None
+        self.logwriter_raw = None
+        # modules loaded on first use, see register_lazy_module()
+        self.lazy_modules = {}
+        # message type -> names of the lazy modules it loads
+        self.lazy_types = {}
+        # set by --profile-startup
+        self.profile_startup = False
+
+    def add_output(self, conn):
+        '''add a mavlink output'''
+        conn.filter = mp_output.OutputFilter()
+        conn.sendq = mp_output.SendQueue(conn, self.selector, disconnect=output_overflow)
+        self.mav_outputs.append(conn)
+        self.selector.register(conn.fd, process_mavlink, conn)
+
+    def remove_output(self, conn):
+        '''remove a mavlink output'''
+        if not conn in self.mav_outputs:
+            return
+        conn.sendq.close()
+        self.mav_outputs.remove(conn)
+        self.selector.unregister(conn.fd)
+
+    def telemetry_ring(self):
+        '''return the shared memory ring of received messages for GUI
+        child processes, creating it on first use'''
+        if self.telemetry is None:
+            from MAVProxy.modules.lib import mp_telemetry
+            self.telemetry = mp_telemetry.create_ring()
+        return self.telemetry
 
     def module(self, name):
         '''Find a public module (most modules are private)'''
+        if name in self.lazy_modules:
+            load_module(name, quiet=True)
         if name in self.public_modules:
             return self.public_modules[name]
         return None
@@ -202,15 +327,30 @@ def cmd_script(args):
 
 def cmd_set(args):
     '''control mavproxy options'''
+    if len(args) > 0:
+        # settings added by a module exist once it is loaded
+        for lazy in mpstate.lazy_modules.values():
+            if args[0] in lazy.settings:
+                load_module(lazy.name, quiet=True)
+                break
     mpstate.settings.command(args)
 
 def cmd_status(args):
     '''show status'''
     if len(args) == 0:
-        mpstate.status.show(sys.stdout, pattern=None)
+        mpstate.status.show(sys.stdout, pattern=None, vehicles=mpstate.vehicles)
+        if mpstate.logwriter is not None:
+            print("Log: %s" % mpstate.logwriter)
+            print("Raw log: %s" % mpstate.logwriter_raw)
+    elif args[0] == 'rates':
+        if len(args) > 1 and args[1] == 'reset':
+            mpstate.status.rates.reset()
+            return
+        for pattern in args[1:] or [None]:
+            mpstate.status.rates.show(sys.stdout, pattern=pattern)
     else:
         for pattern in args:
-            mpstate.status.show(sys.stdout, pattern=pattern)
+            mpstate.status.show(sys.stdout, pattern=pattern, vehicles=mpstate.vehicles)
 
 def cmd_setup(args):
     mpstate.status.setup_mode = True
@@ -232,6 +372,117 @@ def cmd_link(args):
                                                                                   linkdelay,
                                                                                   master.mav_loss,
                                                                                   master.packet_loss()))
+        if len(mpstate.mav_master) > 1:
+            print("  %u first, %u duplicates" % (mpstate.dedupe.link_first.get(master.linknum, 0),
+                                                 mpstate.dedupe.link_duplicates.get(master.linknum, 0)))
+
+def callback_owner(fn):
+    '''return the name of the module a callback belongs to'''
+    return getattr(getattr(fn, '__self__', None), 'name', 'core')
+
+def cmd_perf(args):
+    '''module CPU accounting'''
+    usage = "usage: perf <start|stop|reset|modules|types|MODULE> (SORT)"
+    if len(args) < 1:
+        print(usage)
+        return
+    perf = mpstate.perf
+    sort = 'time'
+    if len(args) > 1:
+        sort = args[1]
+        if not sort in mp_perf.sort_keys:
+            print("sort must be one of %s" % ','.join(sorted(mp_perf.sort_keys.keys())))
+            return
+    if args[0] == 'start':
+        perf.enabled = True
+    elif args[0] == 'stop':
+        perf.enabled = False
+    elif args[0] == 'reset':
+        perf.reset()
+    elif args[0] == 'modules':
+        for line in mp_perf.format_table(perf.by_module(), sort=sort):
+            print(line)
+    elif args[0] == 'types':
+        for line in mp_perf.format_table(perf.by_type(), sort=sort):
+            print(line)
+    else:
+        stats = perf.for_module(args[0])
+        if len(stats) == 0:
+            print("No timings for %s" % args[0])
+            return
+        for line in mp_perf.format_table(stats, sort=sort, hist=True):
+            print(line)
+    if not perf.enabled and args[0] in ['modules', 'types']:
+        print("perf is stopped, use 'perf start' to record")
+
+def cmd_latency(args):
+    '''forwarding latency tracing'''
+    tracer = mpstate.latency
+    if len(args) == 0 or args[0] == 'show':
+        if not tracer.enabled:
+            print("latency tracing is stopped, use 'latency start' to record")
+        for line in tracer.report():
+            print(line)
+    elif args[0] == 'start':
+        tracer.enabled = True
+    elif args[0] == 'stop':
+        tracer.enabled = False
+        tracer.done()
+    elif args[0] == 'reset':
+        tracer.reset()
+    else:
+        print("usage: latency <start|stop|reset|show>")
+
+def cmd_vehicles(args):
+    '''show the vehicles seen on the links'''
+    if len(args) > 0 and args[0] == 'clear':
+        mpstate.vehicles.clear()
+        return
+    for v in sorted(mpstate.vehicles, key=lambda v: (v.sysid, v.compid)):
+        print(v)
+
+def cmd_replay(args):
+    '''control tlog replay masters'''
+    from MAVProxy.modules.lib import mp_replay
+    if len(mpstate.replay) == 0:
+        print("No replay master, use --master=replay:FILE.tlog")
+        return
+    if len(args) == 0 or args[0] == 'status':
+        for source in mpstate.replay:
+            print(source)
+    elif args[0] == 'pause':
+        for source in mpstate.replay:
+            source.pause()
+    elif args[0] == 'resume':
+        for source in mpstate.replay:
+            source.resume()
+    elif args[0] == 'speed':
+        if len(args) != 2:
+            print("usage: replay speed <FACTOR|max>")
+            return
+        try:
+            speed = mp_replay.parse_speed(args[1])
+        except ValueError:
+            print("Bad speed %s" % args[1])
+            return
+        for source in mpstate.replay:
+            source.set_speed(speed)
+    elif args[0] == 'seek':
+        if len(args) != 2:
+            print("usage: replay seek <SECONDS|+SECONDS|-SECONDS>")
+            return
+        try:
+            seconds = float(args[1])
+        except ValueError:
+            print("Bad time %s" % args[1])
+            return
+        for source in mpstate.replay:
+            if args[1][0] in '+-':
+                source.seek(source.position() + seconds)
+            else:
+                source.seek(seconds)
+    else:
+        print("usage: replay <status|pause|resume|speed|seek>")
 
 def cmd_watch(args):
     '''watch a mavlink packet pattern'''
@@ -239,11 +490,74 @@ def cmd_watch(args):
         mpstate.status.watch = None
         return
     mpstate.status.watch = args[0]
+    mpstate.status.watch_re = re.compile(fnmatch.translate(args[0].upper()))
+    mpstate.status.watch_types = {}
     print("Watching %s" % mpstate.status.watch)
 
+class LazyModule(object):
+    '''a module loaded the first time one of its commands, message types
+    or settings is used'''
+    def __init__(self, name, commands=[], mtypes=[], settings=[], unknown_commands=False,
+                 completions={}, menus=False):
+        self.name = name
+        self.commands = commands
+        self.mtypes = mtypes
+        self.settings = settings
+        # load the module when a command isn't in the command map
+        self.unknown_commands = unknown_commands
+        # tab completion rules of the commands until the module adds its own
+        self.completions = completions
+        # load the module when a console or map is loaded, so it adds its menus
+        self.menus = menus
+
+def register_lazy_module(lazy):
+    '''register a module to be loaded on first use'''
+    mpstate.lazy_modules[lazy.name] = lazy
+    for mtype in lazy.mtypes:
+        mpstate.lazy_types.setdefault(mtype, []).append(lazy.name)
+    for cmd in lazy.commands:
+        if not cmd in command_map:
+            command_map[cmd] = (functools.partial(lazy_command, lazy.name, cmd),
+                                '%s module, loaded on first use' % lazy.name)
+    for cmd in lazy.completions:
+        if not cmd in mpstate.completions:
+            mpstate.completions[cmd] = lazy.completions[cmd]
+    mpstate.mavlink_dispatch.clear()
+
+def unregister_lazy_module(modname):
+    '''forget a lazy module, as it is being loaded'''
+    lazy = mpstate.lazy_modules.pop(modname, None)
+    if lazy is None:
+        return
+    for mtype in lazy.mtypes:
+        mpstate.lazy_types[mtype].remove(modname)
+        if len(mpstate.lazy_types[mtype]) == 0:
+            mpstate.lazy_types.pop(mtype)
+    for cmd in lazy.commands:
+        if cmd in command_map and isinstance(command_map[cmd][0], functools.partial):
+            command_map.pop(cmd)
+    for cmd in lazy.completions:
+        if mpstate.completions.get(cmd, None) is lazy.completions[cmd]:
+            mpstate.completions.pop(cmd)
+
+def load_menu_modules():
+    '''load the lazy modules that add console and map menus'''
+    for lazy in list(mpstate.lazy_modules.values()):
+        if lazy.menus:
+            load_module(lazy.name, quiet=True)
+
+def lazy_command(modname, cmd, args):
+    '''load a module on first use of one of its commands, then run the command'''
+    load_module(modname, quiet=True)
+    if not cmd in command_map:
+        print("Module %s did not add command %s" % (modname, cmd))
+        return
+    command_map[cmd][0](args)
+
 def load_module(modname, quiet=False):
     '''load a module'''
     modpaths = ['MAVProxy.modules.mavproxy_%s' % modname, modname]
+    unregister_lazy_module(modname)
     for (m,pm) in mpstate.modules:
         if m.name == modname:
             if not quiet:
@@ -251,13 +565,24 @@ def load_module(modname, quiet=False):
             return False
     for modpath in modpaths:
         try:
+            t0 = time.time()
+            imported = modpath in sys.modules
             m = import_package(modpath)
-            reload(m)
+            if imported:
+                # pick up changes when a module is loaded again
+                reload(m)
+            t1 = time.time()
             module = m.init(mpstate)
+            t2 = time.time()
+            if mpstate.profile_startup:
+                print("module %-14s import %7.1fms init %7.1fms" % (modname, (t1-t0)*1000, (t2-t1)*1000))
             if isinstance(module, mp_module.MPModule):
                 mpstate.modules.append((module, m))
+                mpstate.mavlink_dispatch.clear()
                 if not quiet:
                     print("Loaded module %s" % (modname,))
+                if modname in ['console', 'map']:
+                    load_menu_modules()
                 return True
             else:
                 ex = "%s.init did not return a MPModule instance" % modname
@@ -270,13 +595,33 @@ def load_module(modname, quiet=False):
     print("Failed to load module: %s" % ex)
     return False
 
+def load_worker(modname):
+    '''load a module in a worker process'''
+    from MAVProxy.modules.lib import mp_worker
+    unregister_lazy_module(modname)
+    for (m,pm) in mpstate.modules:
+        if m.name == modname:
+            print("module %s already loaded" % modname)
+            return False
+    module = mp_worker.WorkerModule(mpstate, modname)
+    if module.load_error is not None:
+        print("Failed to load module %s in worker: %s" % (modname, module.load_error))
+        module.unload()
+        return False
+    mpstate.modules.append((module, mp_worker))
+    mpstate.mavlink_dispatch.clear()
+    print("Loaded module %s in worker process %u" % (modname, module.process.pid))
+    return True
+
 def unload_module(modname):
     '''unload a module'''
     for (m,pm) in mpstate.modules:
         if m.name == modname:
             if hasattr(m, 'unload'):
                 m.unload()
+            mpstate.scheduler.remove_owner(m)
             mpstate.modules.remove((m,pm))
+            mpstate.mavlink_dispatch.clear()
             print("Unloaded module %s" % modname)
             return True
     print("Unable to find module %s" % modname)
@@ -284,30 +629,44 @@ def unload_module(modname):
 
 def cmd_module(args):
     '''module commands'''
-    usage = "usage: module <list|load|reload|unload>"
+    usage = "usage: module <list|load|worker|reload|unload>"
     if len(args) < 1:
         print(usage)
         return
     if args[0] == "list":
         for (m,pm) in mpstate.modules:
             print("%s: %s" % (m.name, m.description))
+        for name in sorted(mpstate.lazy_modules.keys()):
+            print("%s: not loaded yet" % name)
     elif args[0] == "load":
         if len(args) < 2:
             print("usage: module load <name>")
             return
         load_module(args[1])
+    elif args[0] == "worker":
+        if len(args) < 2:
+            print("usage: module worker <name>")
+            return
+        load_worker(args[1])
     elif args[0] == "reload":
         if len(args) < 2:
             print("usage: module reload <name>")
             return
         modname = args[1]
         pmodule = None
+        worker = False
         for (m,pm) in mpstate.modules:
             if m.name == modname:
                 pmodule = pm
+                worker = hasattr(m, 'process')
         if pmodule is None:
             print("Module %s not loaded" % modname)
             return
+        if worker:
+            # a new worker imports the module afresh
+            if unload_module(modname) and load_worker(modname):
+                print("Reloaded module %s" % modname)
+            return
         if unload_module(modname):
             reload(pmodule)
             if load_module(modname, quiet=True):
@@ -372,11 +731,64 @@ command_map = {
     'status'  : (cmd_status,   'show status'),
     'set'     : (cmd_set,      'mavproxy settings'),
     'link'    : (cmd_link,     'show link status'),
+    'vehicles': (cmd_vehicles, 'show vehicles seen on the links'),
+    'perf'    : (cmd_perf,     'module CPU accounting'),
+    'latency' : (cmd_latency,  'forwarding latency tracing'),
+    'replay'  : (cmd_replay,   'control tlog replay'),
     'watch'   : (cmd_watch,    'watch a MAVLink pattern'),
     'module'  : (cmd_module,   'module commands'),
     'alias'   : (cmd_alias,    'command aliases')
     }
 
+# the standard modules, with the commands, message types and settings
+# that load them. The message types are those the modules ask for, and
+# HEARTBEAT for param so it starts fetching parameters on connection
+standard_modules = [
+    LazyModule('log', ['log'], ['LOG_ENTRY', 'LOG_DATA'],
+               completions={'log' : ['<download|status|erase|resume|cancel|list>']}),
+    LazyModule('wp', ['wp'], ['WAYPOINT_COUNT', 'MISSION_COUNT', 'WAYPOINT', 'MISSION_ITEM',
+                              'WAYPOINT_REQUEST', 'MISSION_REQUEST',
+                              'WAYPOINT_CURRENT', 'MISSION_CURRENT'],
+               completions={'wp' : ["<list|clear|move|remove|loop|set|undo>",
+                                    "<load|update|save|show> (FILENAME)"]},
+               menus=True),
+    LazyModule('rally', ['rally'], ['COMMAND_ACK'],
+               completions={'rally' : ["<add|clear|land|list|move|remove|>",
+                                       "<load|save> (FILENAME)"]},
+               menus=True),
+    LazyModule('fence', ['fence'], ['FENCE_STATUS', 'SYS_STATUS'],
+               completions={'fence' : ["<draw|list|clear|enable|disable|move|remove>",
+                                       "<load|save> (FILENAME)"]},
+               menus=True),
+    LazyModule('param', ['param'], ['PARAM_VALUE', 'HEARTBEAT'],
+               completions={'param' : ["<download>",
+                                       "<set|show|fetch|help> (PARAMETER)",
+                                       "<load|save|diff> (FILENAME)"]}),
+    LazyModule('relay', ['relay', 'servo']),
+    LazyModule('tuneopt', ['tuneopt']),
+    LazyModule('arm', ['arm', 'disarm'],
+               completions={'arm' : ['check <all|baro|compass|gps|ins|params|rc|voltage|battery>',
+                                     'uncheck <all|baro|compass|gps|ins|params|rc|voltage|battery>',
+                                     'list',
+                                     'throttle']}),
+    LazyModule('mode', ['mode', 'guided'], unknown_commands=True),
+    LazyModule('calibration', ['ground', 'level', 'compassmot', 'calpress', 'accelcal'], ['STATUSTEXT']),
+    LazyModule('rc', ['rc', 'switch'],
+               completions={'rc' : ['<1|2|3|4|5|6|7|8|all>'],
+                            'switch' : ['<0|1|2|3|4|5|6>']}),
+    LazyModule('auxopt', ['auxopt'],
+               completions={'auxopt' : ['set <7|8> <Nothing|Flip|SimpleMode|RTL|SaveTrim|SaveWP|MultiMode|CameraTrigger|Sonar|Fence|ResetYaw|SuperSimpleMode|AcroTrainer|Acro|Auto|AutoTune|Land>',
+                                        'reset <7|8|all>',
+                                        '<show|list>']}),
+    LazyModule('misc', ['alt', 'up', 'reboot', 'time']),
+    LazyModule('cmdlong', ['setspeed', 'setyaw', 'takeoff']),
+    LazyModule('battery', ['bat'], ['SYS_STATUS'], settings=['battwarn', 'batwarncell', 'numcells']),
+    LazyModule('terrain', ['terrain'], ['TERRAIN_REQUEST', 'TERRAIN_REPORT'],
+               completions={'terrain' : ["<status|check|set>"]}),
+    LazyModule('output', ['output'],
+               completions={'output' : ["<list|add|remove|set>"]}),
+    ]
+
 def process_stdin(line):
     '''handle commands from user'''
     if line is None:
@@ -419,6 +831,9 @@ def process_stdin(line):
         return
 
     if not cmd in command_map:
+        for lazy in mpstate.lazy_modules.values():
+            if lazy.unknown_commands:
+                load_module(lazy.name, quiet=True)
         for (m,pm) in mpstate.modules:
             if hasattr(m, 'unknown_command'):
                 try:
@@ -430,7 +845,12 @@ def process_stdin(line):
         return
     (fn, help) = command_map[cmd]
     try:
-        fn(args[1:])
+        if mpstate.perf.enabled:
+            t0 = time.time()
+            fn(args[1:])
+            mpstate.perf.record(callback_owner(fn), 'command', cmd, time.time() - t0)
+        else:
+            fn(args[1:])
     except Exception as e:
         print("ERROR in command: %s" % str(e))
         if mpstate.settings.moddebug > 1:
@@ -485,11 +905,198 @@ def master_send_callback(m, master):
     '''called on sending a message'''
     mtype = m.get_type()
 
-    if mtype != 'BAD_DATA' and mpstate.logqueue:
+    if mtype != 'BAD_DATA' and mpstate.logwriter:
         usec = get_usec()
         usec = (usec & ~3) | 3 # linknum 3
-        mpstate.logqueue.put(str(struct.pack('>Q', usec) + m.get_msgbuf()))
+        mpstate.logwriter.append_record(usec, m.get_msgbuf())
+
+
+def mavlink_handlers(mtype):
+    '''build the list of modules wanting messages of type mtype'''
+    if mtype in mpstate.lazy_types:
+        for name in mpstate.lazy_types[mtype][:]:
+            load_module(name, quiet=True)
+    handlers = []
+    for (mod,pm) in mpstate.modules:
+        if mod.wants_mavlink_type(mtype):
+            handlers.append(mod)
+    mpstate.mavlink_dispatch[mtype] = handlers
+    return handlers
+
+# message types that show a link is alive
+link_alive_types = frozenset([ 'HEARTBEAT', 'GPS_RAW_INT', 'GPS_RAW', 'GLOBAL_POSITION_INT', 'SYS_STATUS' ])
+
+# message types not processed from a delayed link, as they would cause double reporting
+link_delayed_types = frozenset([ 'MISSION_CURRENT', 'SYS_STATUS', 'VFR_HUD',
+                                 'GPS_RAW_INT', 'SCALED_PRESSURE', 'GLOBAL_POSITION_INT',
+                                 'NAV_CONTROLLER_OUTPUT' ])
+
+def handle_heartbeat(m, master):
+    '''core handling of HEARTBEAT'''
+    if m.get_srcSystem() == 255:
+        return
+    if (mpstate.status.target_system != m.get_srcSystem() or
+        mpstate.status.target_component != m.get_srcComponent()):
+        mpstate.status.target_system = m.get_srcSystem()
+        mpstate.status.target_component = m.get_srcComponent()
+        say("online system %u component %u" % (mpstate.status.target_system, mpstate.status.target_component),'message')
+
+    if mpstate.status.heartbeat_error:
+        mpstate.status.heartbeat_error = False
+        say("heartbeat OK")
+    if master.linkerror:
+        master.linkerror = False
+        say("link %u OK" % (master.linknum+1))
+
+    mpstate.status.last_heartbeat = time.time()
+    master.last_heartbeat = mpstate.status.last_heartbeat
+
+    armed = mpstate.master().motors_armed()
+    if armed != mpstate.status.armed:
+        mpstate.status.armed = armed
+        if armed:
+            say("ARMED")
+        else:
+            say("DISARMED")
+
+    if master.flightmode != mpstate.status.flightmode and time.time() > mpstate.status.last_mode_announce + 2:
+        mpstate.status.flightmode = master.flightmode
+        mpstate.status.last_mode_announce = time.time()
+        mpstate.rl.set_prompt(mpstate.status.flightmode + "> ")
+        say("Mode " + mpstate.status.flightmode)
+
+    if m.type in [mavutil.mavlink.MAV_TYPE_FIXED_WING]:
+        mpstate.vehicle_type = 'plane'
+        mpstate.vehicle_name = 'ArduPlane'
+    elif m.type in [mavutil.mavlink.MAV_TYPE_GROUND_ROVER,
+                    mavutil.mavlink.MAV_TYPE_SURFACE_BOAT,
+                    mavutil.mavlink.MAV_TYPE_SUBMARINE]:
+        mpstate.vehicle_type = 'rover'
+        mpstate.vehicle_name = 'APMrover2'
+    elif m.type in [mavutil.mavlink.MAV_TYPE_QUADROTOR,
+                    mavutil.mavlink.MAV_TYPE_COAXIAL,
+                    mavutil.mavlink.MAV_TYPE_HEXAROTOR,
+                    mavutil.mavlink.MAV_TYPE_OCTOROTOR,
+                    mavutil.mavlink.MAV_TYPE_TRICOPTER,
+                    mavutil.mavlink.MAV_TYPE_HELICOPTER]:
+        mpstate.vehicle_type = 'copter'
+        mpstate.vehicle_name = 'ArduCopter'
+    elif m.type in [mavutil.mavlink.MAV_TYPE_ANTENNA_TRACKER]:
+        mpstate.vehicle_type = 'antenna'
+        mpstate.vehicle_name = 'AntennaTracker'
+
+def handle_statustext(m, master):
+    '''core handling of STATUSTEXT'''
+    if m.text != mpstate.status.last_apm_msg or time.time() > mpstate.status.last_apm_msg_time+2:
+        mpstate.console.writeln("APM: %s" % m.text, bg='red')
+        mpstate.status.last_apm_msg = m.text
+        mpstate.status.last_apm_msg_time = time.time()
+
+def handle_vfr_hud(m, master):
+    '''core handling of VFR_HUD'''
+    have_gps_fix = False
+    if 'GPS_RAW' in mpstate.status.msgs and mpstate.status.msgs['GPS_RAW'].fix_type == 2:
+        have_gps_fix = True
+    if 'GPS_RAW_INT' in mpstate.status.msgs and mpstate.status.msgs['GPS_RAW_INT'].fix_type == 3:
+        have_gps_fix = True
+    if have_gps_fix and not mpstate.status.have_gps_lock and m.alt != 0:
+            say("GPS lock at %u meters" % m.alt, priority='notification')
+            mpstate.status.have_gps_lock = True
+
+def handle_gps_raw(m, master):
+    '''core handling of GPS_RAW'''
+    if mpstate.status.have_gps_lock:
+        if m.fix_type != 2 and not mpstate.status.lost_gps_lock and (time.time() - mpstate.status.last_gps_lock) > 3:
+            say("GPS fix lost")
+            mpstate.status.lost_gps_lock = True
+        if m.fix_type == 2 and mpstate.status.lost_gps_lock:
+            say("GPS OK")
+            mpstate.status.lost_gps_lock = False
+        if m.fix_type == 2:
+            mpstate.status.last_gps_lock = time.time()
+
+def handle_gps_raw_int(m, master):
+    '''core handling of GPS_RAW_INT'''
+    if mpstate.status.have_gps_lock:
+        if m.fix_type < 3 and not mpstate.status.lost_gps_lock and (time.time() - mpstate.status.last_gps_lock) > 3:
+            say("GPS fix lost")
+            mpstate.status.lost_gps_lock = True
+        if m.fix_type >= 3 and mpstate.status.lost_gps_lock:
+            say("GPS OK")
+            mpstate.status.lost_gps_lock = False
+        if m.fix_type >= 3:
+            mpstate.status.last_gps_lock = time.time()
+
+def handle_nav_controller_output(m, master):
+    '''core handling of NAV_CONTROLLER_OUTPUT'''
+    if mpstate.status.flightmode != "AUTO" or not mpstate.settings.distreadout:
+        return
+    rounded_dist = int(m.wp_dist/mpstate.settings.distreadout)*mpstate.settings.distreadout
+    if math.fabs(rounded_dist - mpstate.status.last_distance_announce) >= mpstate.settings.distreadout:
+        if rounded_dist != 0:
+            say("%u" % rounded_dist, priority="progress")
+        mpstate.status.last_distance_announce = rounded_dist
+
+def handle_global_position_int(m, master):
+    '''core handling of GLOBAL_POSITION_INT'''
+    report_altitude(m.relative_alt*0.001)
+
+def handle_compassmot_status(m, master):
+    '''core handling of COMPASSMOT_STATUS'''
+    print(m)
+
+def handle_bad_data(m, master):
+    '''core handling of BAD_DATA'''
+    if mpstate.settings.shownoise and mavutil.all_printable(m.data):
+        mpstate.console.write(str(m.data), bg='red')
+
+def handle_ack(m, master):
+    '''core handling of COMMAND_ACK and MISSION_ACK'''
+    mpstate.console.writeln("Got MAVLink msg: %s" % m)
+
+    if m.get_type() == "COMMAND_ACK" and m.command == mavutil.mavlink.MAV_CMD_PREFLIGHT_CALIBRATION:
+        if m.result == mavutil.mavlink.MAV_RESULT_ACCEPTED:
+            say("Calibrated")
+
+# core handlers for each message type
+core_handlers = {
+    'HEARTBEAT'             : handle_heartbeat,
+    'STATUSTEXT'            : handle_statustext,
+    'VFR_HUD'               : handle_vfr_hud,
+    'GPS_RAW'               : handle_gps_raw,
+    'GPS_RAW_INT'           : handle_gps_raw_int,
+    'NAV_CONTROLLER_OUTPUT' : handle_nav_controller_output,
+    'GLOBAL_POSITION_INT'   : handle_global_position_int,
+    'COMPASSMOT_STATUS'     : handle_compassmot_status,
+    'BAD_DATA'              : handle_bad_data,
+    'COMMAND_ACK'           : handle_ack,
+    'MISSION_ACK'           : handle_ack
+    }
 
+def watch_match(mtype):
+    '''return True if mtype matches the watch pattern, caching the result per type'''
+    match = mpstate.status.watch_types.get(mtype, None)
+    if match is None:
+        match = mpstate.status.watch_re.match(mtype.upper()) is not None
+        mpstate.status.watch_types[mtype] = match
+    return match
+
+def forward_message(m, mtype):
+    '''send a message to the outputs that want it'''
+    buf = m.get_msgbuf()
+    priority = mp_output.message_priority(mtype)
+    tracer = mpstate.latency
+    for r in mpstate.mav_outputs:
+        if r.filter.active and not r.filter.check(mtype):
+            continue
+        r.sendq.write(buf, priority)
+        if tracer.enabled:
+            tracer.output_write(r.address)
+
+def output_overflow(conn):
+    '''called when an output with the disconnect policy can't keep up'''
+    mpstate.console.writeln("Output %s overflowed, disconnecting" % conn.address)
+    mpstate.remove_output(conn)
 
 def master_callback(m, master):
     '''process mavlink message m on master, sending any messages to recipients'''
@@ -497,175 +1104,94 @@ def master_callback(m, master):
     if getattr(m, '_timestamp', None) is None:
         master.post_message(m)
     mpstate.status.counters['MasterIn'][master.linknum] += 1
+    tracer = mpstate.latency
+    if tracer.enabled:
+        tracer.link_stage(master.linknum, 'decode')
 
     if getattr(m, 'time_boot_ms', None) is not None:
         # update link_delayed attribute
         handle_msec_timestamp(m, master)
 
     mtype = m.get_type()
+    now = time.time()
+    if mtype != 'BAD_DATA':
+        mpstate.status.rates.update(master.linknum, m.get_srcSystem(), mtype, now)
 
     # and log them
-    if mtype not in ['BAD_DATA','LOG_DATA'] and mpstate.logqueue:
+    if mtype not in ['BAD_DATA','LOG_DATA'] and mpstate.logwriter:
         # put link number in bottom 2 bits, so we can analyse packet
         # delay in saved logs
         usec = get_usec()
         usec = (usec & ~3) | master.linknum
-        mpstate.logqueue.put(str(struct.pack('>Q', usec) + m.get_msgbuf()))
+        mpstate.logwriter.append_record(usec, m.get_msgbuf())
 
-    if mtype in [ 'HEARTBEAT', 'GPS_RAW_INT', 'GPS_RAW', 'GLOBAL_POSITION_INT', 'SYS_STATUS' ]:
+    if mtype in link_alive_types:
         if master.linkerror:
             master.linkerror = False
             say("link %u OK" % (master.linknum+1))
-        mpstate.status.last_message = time.time()
-        master.last_message = mpstate.status.last_message
-
-    if master.link_delayed:
-        # don't process delayed packets that cause double reporting
-        if mtype in [ 'MISSION_CURRENT', 'SYS_STATUS', 'VFR_HUD',
-                      'GPS_RAW_INT', 'SCALED_PRESSURE', 'GLOBAL_POSITION_INT',
-                      'NAV_CONTROLLER_OUTPUT' ]:
-            return
-
-    if mtype == 'HEARTBEAT' and m.get_srcSystem() != 255:
-        if (mpstate.status.target_system != m.get_srcSystem() or
-            mpstate.status.target_component != m.get_srcComponent()):
-            mpstate.status.target_system = m.get_srcSystem()
-            mpstate.status.target_component = m.get_srcComponent()
-            say("online system %u component %u" % (mpstate.status.target_system, mpstate.status.target_component),'message')
-
-        if mpstate.status.heartbeat_error:
-            mpstate.status.heartbeat_error = False
-            say("heartbeat OK")
-        if master.linkerror:
-            master.linkerror = False
-            say("link %u OK" % (master.linknum+1))
-
-        mpstate.status.last_heartbeat = time.time()
-        master.last_heartbeat = mpstate.status.last_heartbeat
+        mpstate.status.last_message = now
+        master.last_message = now
 
-        armed = mpstate.master().motors_armed()
-        if armed != mpstate.status.armed:
-            mpstate.status.armed = armed
-            if armed:
-                say("ARMED")
-            else:
-                say("DISARMED")
-
-        if master.flightmode != mpstate.status.flightmode and time.time() > mpstate.status.last_mode_announce + 2:
-            mpstate.status.flightmode = master.flightmode
-            mpstate.status.last_mode_announce = time.time()
-            mpstate.rl.set_prompt(mpstate.status.flightmode + "> ")
-            say("Mode " + mpstate.status.flightmode)
-
-        if m.type in [mavutil.mavlink.MAV_TYPE_FIXED_WING]:
-            mpstate.vehicle_type = 'plane'
-            mpstate.vehicle_name = 'ArduPlane'
-        elif m.type in [mavutil.mavlink.MAV_TYPE_GROUND_ROVER,
-                        mavutil.mavlink.MAV_TYPE_SURFACE_BOAT,
-                        mavutil.mavlink.MAV_TYPE_SUBMARINE]:
-            mpstate.vehicle_type = 'rover'
-            mpstate.vehicle_name = 'APMrover2'
-        elif m.type in [mavutil.mavlink.MAV_TYPE_QUADROTOR,
-                        mavutil.mavlink.MAV_TYPE_COAXIAL,
-                        mavutil.mavlink.MAV_TYPE_HEXAROTOR,
-                        mavutil.mavlink.MAV_TYPE_OCTOROTOR,
-                        mavutil.mavlink.MAV_TYPE_TRICOPTER,
-                        mavutil.mavlink.MAV_TYPE_HELICOPTER]:
-            mpstate.vehicle_type = 'copter'
-            mpstate.vehicle_name = 'ArduCopter'
-        elif m.type in [mavutil.mavlink.MAV_TYPE_ANTENNA_TRACKER]:
-            mpstate.vehicle_type = 'antenna'
-            mpstate.vehicle_name = 'AntennaTracker'
-        
-    elif mtype == 'STATUSTEXT':
-        if m.text != mpstate.status.last_apm_msg or time.time() > mpstate.status.last_apm_msg_time+2:
-            mpstate.console.writeln("APM: %s" % m.text, bg='red')
-            mpstate.status.last_apm_msg = m.text
-            mpstate.status.last_apm_msg_time = time.time()
-
-    elif mtype == "VFR_HUD":
-        have_gps_fix = False
-        if 'GPS_RAW' in mpstate.status.msgs and mpstate.status.msgs['GPS_RAW'].fix_type == 2:
-            have_gps_fix = True
-        if 'GPS_RAW_INT' in mpstate.status.msgs and mpstate.status.msgs['GPS_RAW_INT'].fix_type == 3:
-            have_gps_fix = True
-        if have_gps_fix and not mpstate.status.have_gps_lock and m.alt != 0:
-                say("GPS lock at %u meters" % m.alt, priority='notification')
-                mpstate.status.have_gps_lock = True
-
-    elif mtype == "GPS_RAW":
-        if mpstate.status.have_gps_lock:
-            if m.fix_type != 2 and not mpstate.status.lost_gps_lock and (time.time() - mpstate.status.last_gps_lock) > 3:
-                say("GPS fix lost")
-                mpstate.status.lost_gps_lock = True
-            if m.fix_type == 2 and mpstate.status.lost_gps_lock:
-                say("GPS OK")
-                mpstate.status.lost_gps_lock = False
-            if m.fix_type == 2:
-                mpstate.status.last_gps_lock = time.time()
-
-    elif mtype == "GPS_RAW_INT":
-        if mpstate.status.have_gps_lock:
-            if m.fix_type < 3 and not mpstate.status.lost_gps_lock and (time.time() - mpstate.status.last_gps_lock) > 3:
-                say("GPS fix lost")
-                mpstate.status.lost_gps_lock = True
-            if m.fix_type >= 3 and mpstate.status.lost_gps_lock:
-                say("GPS OK")
-                mpstate.status.lost_gps_lock = False
-            if m.fix_type >= 3:
-                mpstate.status.last_gps_lock = time.time()
-
-    elif mtype == "NAV_CONTROLLER_OUTPUT" and mpstate.status.flightmode == "AUTO" and mpstate.settings.distreadout:
-        rounded_dist = int(m.wp_dist/mpstate.settings.distreadout)*mpstate.settings.distreadout
-        if math.fabs(rounded_dist - mpstate.status.last_distance_announce) >= mpstate.settings.distreadout:
-            if rounded_dist != 0:
-                say("%u" % rounded_dist, priority="progress")
-            mpstate.status.last_distance_announce = rounded_dist
-    
-    elif mtype == "GLOBAL_POSITION_INT":
-        report_altitude(m.relative_alt*0.001)
+    if (len(mpstate.mav_master) > 1 and mtype != 'BAD_DATA' and mpstate.settings.dedupe and
+        mpstate.dedupe.check(m, master.linknum, now, mpstate.settings.dedupewindow)):
+        # already processed from another link, the log has both copies
+        return
 
-    elif mtype == "COMPASSMOT_STATUS":
-        print(m)
+    if master.link_delayed and mtype in link_delayed_types:
+        # don't process delayed packets that cause double reporting
+        return
 
-    elif mtype == "BAD_DATA":
-        if mpstate.settings.shownoise and mavutil.all_printable(m.data):
-            mpstate.console.write(str(m.data), bg='red')
-    elif mtype in [ "COMMAND_ACK", "MISSION_ACK" ]:
-        mpstate.console.writeln("Got MAVLink msg: %s" % m)
+    # pass messages along to listeners, except for REQUEST_DATA_STREAM, which
+    # would lead a conflict in stream rate setting between mavproxy and the other
+    # GCS
+    if mtype != "BAD_DATA" and (mpstate.settings.mavfwd_rate or mtype != 'REQUEST_DATA_STREAM'):
+        if mpstate.forward_msgs is not None:
+            # process_master will forward the raw data
+            mpstate.forward_msgs.append(m)
+        else:
+            forward_message(m, mtype)
 
-        if mtype == "COMMAND_ACK" and m.command == mavutil.mavlink.MAV_CMD_PREFLIGHT_CALIBRATION:
-            if m.result == mavutil.mavlink.MAV_RESULT_ACCEPTED:
-                say("Calibrated")
+    if mpstate.dispatch_queue is not None:
+        # process_master dispatches once the data has gone to the outputs
+        mpstate.dispatch_queue.append((m, master))
     else:
-        #mpstate.console.writeln("Got MAVLink msg: %s" % m)
-        pass
+        dispatch_message(m, master)
 
-    if mpstate.status.watch is not None:
-        if fnmatch.fnmatch(m.get_type().upper(), mpstate.status.watch.upper()):
-            mpstate.console.writeln(m)
+def dispatch_message(m, master):
+    '''pass a message from a master to the core handlers and the modules'''
+    mtype = m.get_type()
+    handler = core_handlers.get(mtype, None)
+    if handler is not None:
+        handler(m, master)
+
+    if mpstate.status.watch is not None and watch_match(mtype):
+        mpstate.console.writeln(m)
 
     # keep the last message of each type around
-    mpstate.status.msgs[m.get_type()] = m
-    if not m.get_type() in mpstate.status.msg_count:
-        mpstate.status.msg_count[m.get_type()] = 0
-    mpstate.status.msg_count[m.get_type()] += 1
+    mpstate.status.msgs[mtype] = m
+    if not mtype in mpstate.status.msg_count:
+        mpstate.status.msg_count[mtype] = 0
+    mpstate.status.msg_count[mtype] += 1
+    if mtype != 'BAD_DATA':
+        mpstate.vehicles.update(m, mtype, master.linknum)
+        if mpstate.telemetry is not None:
+            mpstate.telemetry.write(m.get_msgbuf())
 
     # don't pass along bad data
     if mtype != "BAD_DATA":
-        # pass messages along to listeners, except for REQUEST_DATA_STREAM, which
-        # would lead a conflict in stream rate setting between mavproxy and the other
-        # GCS
-        if mpstate.settings.mavfwd_rate or mtype != 'REQUEST_DATA_STREAM':
-            for r in mpstate.mav_outputs:
-                r.write(m.get_msgbuf())
-
-        # pass to modules
-        for (mod,pm) in mpstate.modules:
-            if not hasattr(mod, 'mavlink_packet'):
-                continue
+        # pass to modules that want this message type
+        handlers = mpstate.mavlink_dispatch.get(mtype, None)
+        if handlers is None:
+            handlers = mavlink_handlers(mtype)
+        perf = mpstate.perf
+        for mod in handlers:
             try:
-                mod.mavlink_packet(m)
+                if perf.enabled:
+                    t0 = time.time()
+                    mod.mavlink_packet(m)
+                    perf.record(mod.name, 'packet', mtype, time.time() - t0)
+                else:
+                    mod.mavlink_packet(m)
             except Exception as msg:
                 if mpstate.settings.moddebug == 1:
                     print(msg)
@@ -673,6 +1199,15 @@ def master_callback(m, master):
                     exc_type, exc_value, exc_traceback = sys.exc_info()
                     traceback.print_exception(exc_type, exc_value, exc_traceback,
                                               limit=2, file=sys.stdout)
+        tracer = mpstate.latency
+        if tracer.enabled:
+            tracer.link_stage(master.linknum, 'dispatch')
+
+def mav_buffered(mav):
+    '''return the number of bytes held by a MAVLink parser waiting for the rest of a message'''
+    if hasattr(mav, 'buf_len'):
+        return mav.buf_len()
+    return len(mav.buf)
 
 def process_master(m):
     '''process packets from the MAVLink master'''
@@ -686,9 +1221,12 @@ def process_master(m):
     if len(s) == 0:
         time.sleep(0.1)
         return
+    tracer = mpstate.latency
+    if tracer.enabled:
+        tracer.received()
     
-    if mpstate.logqueue_raw:
-        mpstate.logqueue_raw.put(str(s))
+    if mpstate.logwriter_raw:
+        mpstate.logwriter_raw.append(s)
 
     if mpstate.status.setup_mode:
         sys.stdout.write(str(s))
@@ -697,7 +1235,50 @@ def process_master(m):
 
     if m.first_byte and opts.auto_protocol:
         m.auto_mavlink_version(s)
-    msgs = m.mav.parse_buffer(s)
+
+    # if the data holds only whole messages and none of them are
+    # filtered then pass the raw data on to the outputs in one write,
+    # otherwise forward the messages one at a time. Either way the
+    # outputs are written before the modules see the messages, so module
+    # work doesn't delay forwarding
+    passthrough = (mpstate.settings.passthrough and
+                   len(mpstate.mav_outputs) > 0 and
+                   mav_buffered(m.mav) == 0)
+    if passthrough:
+        mpstate.forward_msgs = []
+    mpstate.dispatch_queue = []
+    try:
+        msgs = m.mav.parse_buffer(s)
+    except Exception:
+        # still dispatch what was decoded before the error
+        for (msg, master) in mpstate.dispatch_queue:
+            dispatch_message(msg, master)
+        raise
+    finally:
+        forward_msgs = mpstate.forward_msgs
+        mpstate.forward_msgs = None
+        dispatch_queue = mpstate.dispatch_queue
+        mpstate.dispatch_queue = None
+    if passthrough:
+        whole = msgs and len(forward_msgs) == len(msgs) and mav_buffered(m.mav) == 0
+        for r in list(mpstate.mav_outputs):
+            if whole and not r.filter.active and not r.sendq.backlogged():
+                r.sendq.write(s)
+                if tracer.enabled:
+                    tracer.output_write(r.address)
+                continue
+            for msg in forward_msgs:
+                mtype = msg.get_type()
+                if r.filter.active and not r.filter.check(mtype):
+                    continue
+                r.sendq.write(msg.get_msgbuf(), mp_output.message_priority(mtype))
+                if tracer.enabled:
+                    tracer.output_write(r.address)
+    for (msg, master) in dispatch_queue:
+        dispatch_message(msg, master)
+    if tracer.enabled:
+        tracer.done()
+
     if msgs:
         for msg in msgs:
             if getattr(m, '_timestamp', None) is None:
@@ -725,8 +1306,13 @@ def process_mavlink(slave):
     if msgs is None:
         return
     if mpstate.settings.mavfwd and not mpstate.status.setup_mode:
-        for m in msgs:
-            mpstate.master().write(m.get_msgbuf())
+        if (mpstate.settings.passthrough and mav_buffered(slave.mav) == 0 and
+            len(msgs) > 0 and len(buf) == sum([len(m.get_msgbuf()) for m in msgs])):
+            # the data is exactly the messages, send it in one write
+            mpstate.master().write(buf)
+        else:
+            for m in msgs:
+                mpstate.master().write(m.get_msgbuf())
     mpstate.status.counters['Slave'] += 1
 
 
@@ -742,17 +1328,33 @@ def mkdir_p(dir):
     mkdir_p(os.path.dirname(dir))
     os.mkdir(dir)
 
-def log_writer():
-    '''log writing thread'''
-    while True:
-        mpstate.logfile_raw.write(mpstate.logqueue_raw.get())
-        while not mpstate.logqueue_raw.empty():
-            mpstate.logfile_raw.write(mpstate.logqueue_raw.get())
-        while not mpstate.logqueue.empty():
-            mpstate.logfile.write(mpstate.logqueue.get())
-        if mpstate.settings.flushlogs:
-            mpstate.logfile.flush()
-            mpstate.logfile_raw.flush()
+def log_write_pending():
+    '''write out any buffered log data'''
+    mpstate.logwriter.write_pending()
+    mpstate.logwriter_raw.write_pending()
+
+def log_close():
+    '''write out the rest of the logs on exit'''
+    mpstate.logwriter.close()
+    mpstate.logwriter_raw.close()
+
+def log_settings_changed(setting):
+    '''apply changes to the log settings'''
+    from MAVProxy.modules.lib import mp_logwriter
+    if mpstate.logwriter is None:
+        return
+    if not mp_logwriter.compress_available(mpstate.settings.logcompress):
+        print("zstd log compression needs the zstandard module")
+        # show the compression still in use
+        mpstate.settings.get_setting('logcompress').value = mpstate.logwriter.file_setting('compress')
+    for writer in [mpstate.logwriter, mpstate.logwriter_raw]:
+        writer.flush = mpstate.settings.flushlogs
+        writer.fsync_interval = mpstate.settings.logfsync
+        writer.buffer_size = mpstate.settings.logbuffer * 1024
+        writer.set_file_settings(compress=mpstate.settings.logcompress,
+                                 segment_size=mpstate.settings.logsegsize * 1024 * 1024,
+                                 segment_time=mpstate.settings.logsegtime * 60)
+    mpstate.logwriter.set_file_settings(indexed=mpstate.settings.logindex)
 
 def open_logs():
     '''open log files'''
@@ -784,20 +1386,46 @@ def open_logs():
         logfile = os.path.join(fdir, 'flight.tlog')
         mpstate.status.logdir = fdir
     mpstate.logfile_name = logfile
-    mpstate.logfile = open(logfile, mode=mode)
-    mpstate.logfile_raw = open(logfile+'.raw', mode=mode)
-    print("Logging to %s" % logfile)
 
-    # queues for logging
-    mpstate.logqueue = Queue.Queue()
-    mpstate.logqueue_raw = Queue.Queue()
+    from MAVProxy.modules.lib import mp_logwriter
+    if opts.log_compress is not None:
+        mpstate.settings.logcompress = opts.log_compress
+    if opts.log_segment_size is not None:
+        mpstate.settings.logsegsize = opts.log_segment_size
+    if opts.log_segment_time is not None:
+        mpstate.settings.logsegtime = opts.log_segment_time
+    settings = mpstate.settings
+    try:
+        mpstate.logfile = mp_logwriter.LogFile(logfile, append=(mode=='a'),
+                                               compress=settings.logcompress,
+                                               segment_size=settings.logsegsize*1024*1024,
+                                               segment_time=settings.logsegtime*60,
+                                               indexed=settings.logindex)
+        mpstate.logfile_raw = mp_logwriter.LogFile(logfile+'.raw', append=(mode=='a'),
+                                                   compress=settings.logcompress,
+                                                   segment_size=settings.logsegsize*1024*1024,
+                                                   segment_time=settings.logsegtime*60)
+    except ImportError:
+        print("zstd log compression needs the zstandard module")
+        sys.exit(1)
+    print("Logging to %s" % mpstate.logfile.name)
+
+    # buffered writers for logging
+    mpstate.logwriter = mp_logwriter.LogWriter(mpstate.logfile)
+    mpstate.logwriter_raw = mp_logwriter.LogWriter(mpstate.logfile_raw)
+    log_settings_changed(None)
+    mpstate.settings.set_callback(log_settings_changed)
+    atexit.register(log_close)
+
+    if mpstate.event_loop is not None:
+        mpstate.event_loop.call_periodic(mp_logwriter.WRITE_INTERVAL, log_write_pending)
+        return
 
-    # use a separate thread for writing to the logfile to prevent
+    # use separate threads for writing to the logfiles to prevent
     # delays during disk writes (important as delays can be long if camera
     # app is running)
-    t = threading.Thread(target=log_writer)
-    t.daemon = True
-    t.start()
+    mpstate.logwriter.start()
+    mpstate.logwriter_raw.start()
 
 def set_stream_rates():
     '''set mavlink stream rates'''
@@ -852,14 +1480,33 @@ def periodic_tasks():
 
     if heartbeat_check_period.trigger():
         check_link_status()
+        mpstate.status.update_wakeup_rate()
 
     set_stream_rates()
 
-    # call optional module idle tasks. These are called at several hundred Hz
+    run_idle_tasks()
+
+def run_idle_tasks():
+    '''call module timers that are due, and the idle tasks of modules
+    that have not declared an idle rate. Those are called at several
+    hundred Hz'''
+    mpstate.scheduler.run_due()
+    polling = False
     for (m,pm) in mpstate.modules:
+        if getattr(m, 'idle_rate', None) is not None:
+            continue
         if hasattr(m, 'idle_task'):
+            if getattr(m.idle_task, '__func__', None) is mp_module.MPModule.idle_task.__func__:
+                # the module has no idle task
+                continue
+            polling = True
             try:
-                m.idle_task()
+                if mpstate.perf.enabled:
+                    t0 = time.time()
+                    m.idle_task()
+                    mpstate.perf.record(m.name, 'idle', 'idle_task', time.time() - t0)
+                else:
+                    m.idle_task()
             except Exception as msg:
                 if mpstate.settings.moddebug == 1:
                     print(msg)
@@ -867,77 +1514,230 @@ def periodic_tasks():
                     exc_type, exc_value, exc_traceback = sys.exc_info()
                     traceback.print_exception(exc_type, exc_value, exc_traceback,
                                               limit=2, file=sys.stdout)
+    mpstate.idle_polling = polling
+
+def idle_timeout(now):
+    '''return how long the main loop can wait for input before a module
+    needs to run. Modules that poll in idle_task() get select_timeout, as
+    do master links without a fd'''
+    if mpstate.status.setup_mode or mpstate.idle_polling:
+        return mpstate.select_timeout
+    timeout = mpstate.max_select_timeout
+    for master in mpstate.mav_master:
+        if master.fd is None:
+            if master.port.inWaiting() > 0:
+                # more data is already waiting
+                return 0
+            timeout = mpstate.select_timeout
+    deadline = mpstate.scheduler.next_deadline()
+    if deadline is not None:
+        timeout = min(timeout, deadline - now)
+    return max(timeout, 0)
+
+def periodic_deadline(event):
+    '''return when a periodic_event is next due'''
+    return event.last_time + 1.0/event.frequency
+
+def main_loop_timeout():
+    '''return how long the main loop can wait before something is due'''
+    now = time.time()
+    timeout = idle_timeout(now)
+    if mpstate.status.setup_mode:
+        return timeout
+    deadline = min(periodic_deadline(heartbeat_check_period), periodic_deadline(msg_period))
+    if mpstate.settings.heartbeat != 0:
+        deadline = min(deadline, periodic_deadline(heartbeat_period))
+    return max(min(timeout, deadline - now), 0)
 
+def process_select_extra(fd):
+    '''call the read function a module registered for fd in select_extra'''
+    try:
+        (fn, args) = mpstate.select_extra[fd]
+        if mpstate.perf.enabled:
+            t0 = time.time()
+            fn(args)
+            mpstate.perf.record(callback_owner(fn), 'fd', getattr(fn, '__name__', str(fd)), time.time() - t0)
+        else:
+            fn(args)
+    except Exception as msg:
+        if mpstate.settings.moddebug == 1:
+            print(msg)
+        # on an exception, remove it from the select list
+        mpstate.select_extra.pop(fd, None)
+
+def add_master(m):
+    '''set up a master link and add it to the main loop'''
+    m.mav.set_callback(master_callback, m)
+    if hasattr(m.mav, 'set_send_callback'):
+        m.mav.set_send_callback(master_send_callback, m)
+    if opts.rtscts:
+        m.set_rtscts(True)
+    m.linknum = len(mpstate.mav_master)
+    m.linkerror = False
+    m.link_delayed = False
+    m.last_heartbeat = 0
+    m.last_message = 0
+    m.highest_msec = 0
+    m.select_fd = None
+    m.select_port = None
+    register_master(m)
+    mpstate.mav_master.append(m)
+    mpstate.status.counters['MasterIn'].append(0)
+
+def open_replay(spec):
+    '''open a replay:FILE[,SPEED][,paused][,merge] master, adding a
+    master link for each link recorded in the log'''
+    from MAVProxy.modules.lib import mp_replay
+    options = []
+    filename = spec
+    if not os.path.exists(spec):
+        options = spec.split(',')
+        filename = options.pop(0)
+    speed = 1.0
+    paused = False
+    merge = False
+    try:
+        for opt in options:
+            if opt == 'paused':
+                paused = True
+            elif opt == 'merge':
+                merge = True
+            else:
+                speed = mp_replay.parse_speed(opt)
+        source = mp_replay.ReplaySource(filename, speed=speed, merge=merge, paused=paused)
+    except (IOError, ValueError) as e:
+        print("Failed to open replay %s: %s" % (spec, e))
+        sys.exit(1)
+    print("Replaying %s" % source)
+    mpstate.replay.append(source)
+    for m in source.make_links():
+        add_master(m)
+
+def register_master(master):
+    '''(re)register a master link with the main loop selector'''
+    if master.select_fd is not None:
+        mpstate.selector.unregister(master.select_fd)
+    master.select_fd = master.fd
+    master.select_port = getattr(master, 'port', None)
+    if master.fd is not None:
+        mpstate.selector.register(master.fd, process_master, master)
+
+def process_input():
+    '''process queued command input'''
+    while not mpstate.input_queue.empty():
+        line = mpstate.input_queue.get()
+        mpstate.input_count += 1
+        cmds = line.split(';')
+        for c in cmds:
+            process_stdin(c)
 
-def main_loop():
-    '''main processing loop'''
+def check_masters():
+    '''poll master links without a fd, and re-register any reopened links'''
+    for master in mpstate.mav_master:
+        if master.fd is None:
+            if master.port.inWaiting() > 0:
+                process_master(master)
+        elif master.fd != master.select_fd or getattr(master, 'port', None) is not master.select_port:
+            # the link has been reopened
+            register_master(master)
+
+def wait_masters():
+    '''wait for a heartbeat from each master on startup'''
     if not mpstate.status.setup_mode and not opts.nowait:
         for master in mpstate.mav_master:
             send_heartbeat(master)
             master.wait_heartbeat()
         set_stream_rates()
 
+def main_loop():
+    '''main processing loop'''
+    wait_masters()
+
     while True:
         if mpstate is None or mpstate.status.exit:
             return
-        while not mpstate.input_queue.empty():
-            line = mpstate.input_queue.get()
-            mpstate.input_count += 1
-            cmds = line.split(';')
-            for c in cmds:
-                process_stdin(c)
-
-        for master in mpstate.mav_master:
-            if master.fd is None:
-                if master.port.inWaiting() > 0:
-                    process_master(master)
+        process_input()
+        check_masters()
 
         periodic_tasks()
 
-        rin = []
-        for master in mpstate.mav_master:
-            if master.fd is not None:
-                rin.append(master.fd)
-        for m in mpstate.mav_outputs:
-            rin.append(m.fd)
-        if rin == []:
+        if len(mpstate.selector) == 0:
             time.sleep(0.0001)
             continue
 
-        for fd in mpstate.select_extra:
-            rin.append(fd)
-        try:
-            (rin, win, xin) = select.select(rin, [], [], mpstate.select_timeout)
-        except select.error:
-            continue
+        (readable, writable) = mpstate.selector.select(main_loop_timeout())
 
         if mpstate is None:
             return
-
-        for fd in rin:
+        mpstate.status.wakeups += 1
+
+        for fd in writable:
+            handler = mpstate.selector.writer(fd)
+            if handler is not None:
+                (fn, args) = handler
+                fn(args)
+
+        for fd in readable:
+            handler = mpstate.selector.handler(fd)
+            if handler is not None:
+                (fn, args) = handler
+                fn(args)
+
+def callback_exception(e):
+    '''report an exception raised by an event loop or timer callback'''
+    if mpstate.settings.moddebug == 1:
+        print(e)
+    elif mpstate.settings.moddebug > 1:
+        traceback.print_exc()
+
+def core_task():
+    '''event loop task for command input, polled links and module idle tasks'''
+    while True:
+        process_input()
+        check_masters()
+        if not mpstate.status.setup_mode:
+            run_idle_tasks()
+        # the timeout covers any timers added so far
+        mpstate.scheduler.deadline_moved = False
+        yield idle_timeout(time.time())
+
+def heartbeat_task():
+    '''event loop task sending heartbeats to the masters'''
+    while True:
+        if mpstate.settings.heartbeat != 0 and not mpstate.status.setup_mode:
+            mpstate.status.counters['MasterOut'] += 1
             for master in mpstate.mav_master:
-                if fd == master.fd:
-                    process_master(master)
-                    continue
-            for m in mpstate.mav_outputs:
-                if fd == m.fd:
-                    process_mavlink(m)
-                    continue
-
-            # this allow modules to register their own file descriptors
-            # for the main select loop
-            if fd in mpstate.select_extra:
-                try:
-                    # call the registered read function
-                    (fn, args) = mpstate.select_extra[fd]
-                    fn(args)
-                except Exception as msg:
-                    if mpstate.settings.moddebug == 1:
-                        print(msg)
-                    # on an exception, remove it from the select list
-                    mpstate.select_extra.pop(fd)
-
+                send_heartbeat(master)
+            yield 1.0 / mpstate.settings.heartbeat
+        else:
+            yield 1
 
+def link_task():
+    '''event loop task checking link status and stream rates'''
+    while True:
+        if not mpstate.status.setup_mode:
+            check_link_status()
+            set_stream_rates()
+            mpstate.status.update_wakeup_rate()
+        yield 0.33
+
+def event_loop_main():
+    '''main processing loop using the event loop'''
+    wait_masters()
+
+    loop = mpstate.event_loop
+    loop.set_exception_handler(callback_exception)
+    core = loop.create_task(core_task())
+    loop.create_task(heartbeat_task())
+    loop.create_task(link_task())
+
+    while mpstate is not None and not mpstate.status.exit:
+        loop.run_once()
+        mpstate.status.wakeups += 1
+        if mpstate.scheduler.deadline_moved:
+            # a module timer is due before the core task next runs
+            mpstate.scheduler.deadline_moved = False
+            core.wake()
 
 def input_loop():
     '''wait for user input'''
@@ -947,8 +1747,12 @@ def input_loop():
                 line = raw_input(mpstate.rl.prompt)
         except EOFError:
             mpstate.status.exit = True
+            # let the main loop see the exit before the interpreter shuts down
+            mpstate.wakeup.wake()
+            mpstate.status.thread.join(1)
             sys.exit(1)
         mpstate.input_queue.put(line)
+        mpstate.wakeup.wake()
 
 
 def run_script(scriptfile):
@@ -974,7 +1778,8 @@ if __name__ == '__main__':
     parser = OptionParser("mavproxy.py [options]")
 
     parser.add_option("--master", dest="master", action='append',
-                      metavar="DEVICE[,BAUD]", help="MAVLink master port and optional baud rate",
+                      metavar="DEVICE[,BAUD]",
+                      help="MAVLink master port and optional baud rate, or replay:FILE.tlog[,SPEED] to replay a log",
                       default=[])
     parser.add_option("--out", dest="output", action='append',
                       metavar="DEVICE[,BAUD]", help="MAVLink output port and optional baud rate",
@@ -1020,6 +1825,16 @@ if __name__ == '__main__':
     parser.add_option("--dialect",  default="ardupilotmega", help="MAVLink dialect")
     parser.add_option("--rtscts",  action='store_true', help="enable hardware RTS/CTS flow control")
     parser.add_option("--mission", dest="mission", help="mission name", default=None)
+    parser.add_option("--event-loop", dest="event_loop", action='store_true', default=False,
+                      help="use the event loop runtime instead of the select loop")
+    parser.add_option("--profile-startup", dest="profile_startup", action='store_true', default=False,
+                      help="show import and init time of each module")
+    parser.add_option("--log-compress", dest="log_compress", default=None, type='choice',
+                      choices=['none','gzip','zstd'], help="compress logs as they are written")
+    parser.add_option("--log-segment-size", dest="log_segment_size", default=None, type='int',
+                      help="start a new log segment every this many MB")
+    parser.add_option("--log-segment-time", dest="log_segment_time", default=None, type='int',
+                      help="start a new log segment every this many minutes")
 
     (opts, args) = parser.parse_args()
 
@@ -1037,6 +1852,11 @@ if __name__ == '__main__':
     mpstate.status.exit = False
     mpstate.command_map = command_map
     mpstate.continue_mode = opts.continue_mode
+    mpstate.profile_startup = opts.profile_startup
+    if opts.event_loop:
+        from MAVProxy.modules.lib import mp_eventloop
+        mpstate.event_loop = mp_eventloop.MPEventLoop(mpstate.selector,
+                                                      max_timeout=mpstate.max_select_timeout)
 
     if opts.speech:
         # start the speech-dispatcher early, so it doesn't inherit any ports from
@@ -1069,25 +1889,16 @@ Auto-detected serial ports are:
 
     # open master link
     for mdev in opts.master:
+        if mdev.startswith('replay:'):
+            open_replay(mdev[len('replay:'):])
+            continue
         if ',' in mdev and not os.path.exists(mdev):
             port, baud = mdev.split(',')
         else:
             port, baud = mdev, opts.baudrate
 
         m = mavutil.mavlink_connection(port, autoreconnect=True, baud=int(baud))
-        m.mav.set_callback(master_callback, m)
-        if hasattr(m.mav, 'set_send_callback'):
-            m.mav.set_send_callback(master_send_callback, m)
-        if opts.rtscts:
-            m.set_rtscts(True)
-        m.linknum = len(mpstate.mav_master)
-        m.linkerror = False
-        m.link_delayed = False
-        m.last_heartbeat = 0
-        m.last_message = 0
-        m.highest_msec = 0
-        mpstate.mav_master.append(m)
-        mpstate.status.counters['MasterIn'].append(0)
+        add_master(m)
 
     # log all packets from the master, for later replay
     open_logs()
@@ -1099,7 +1910,7 @@ Auto-detected serial ports are:
         else:
             port, baud = p, opts.baudrate
 
-        mpstate.mav_outputs.append(mavutil.mavlink_connection(port, baud=int(baud), input=False))
+        mpstate.add_output(mavutil.mavlink_connection(port, baud=int(baud), input=False))
 
     if opts.sitl:
         mpstate.sitl_output = mavutil.mavudp(opts.sitl, input=False)
@@ -1130,12 +1941,11 @@ Auto-detected serial ports are:
             print("no script %s" % start_script)
 
     if not opts.setup:
-        # some core functionality is in modules
-        standard_modules = ['log', 'wp', 'rally','fence','param','relay',
-                            'tuneopt','arm','mode','calibration','rc','auxopt','misc','cmdlong',
-                            'battery','terrain','output']
-        for m in standard_modules:
-            load_module(m, quiet=True)
+        # some core functionality is in modules. They are loaded the
+        # first time one of their commands, message types or settings
+        # is used
+        for lazy in standard_modules:
+            register_lazy_module(lazy)
 
     if opts.console:
         process_stdin('module load console')
@@ -1153,8 +1963,14 @@ Auto-detected serial ports are:
         for c in cmds:
             process_stdin(c)
 
+    if mpstate.profile_startup:
+        print("startup took %.1fms" % ((time.time() - startup_time)*1000))
+
     # run main loop as a thread
-    mpstate.status.thread = threading.Thread(target=main_loop)
+    if mpstate.event_loop is not None:
+        mpstate.status.thread = threading.Thread(target=event_loop_main)
+    else:
+        mpstate.status.thread = threading.Thread(target=main_loop)
     mpstate.status.thread.daemon = True
     mpstate.status.thread.start()
 
@@ -14,14 +14,17 @@ class LiveGraph():
     All of the GUI work is done in a child process to provide some insulation
     from the parent mavproxy instance and prevent instability in the GCS
 
-    New data is sent to the LiveGraph instance via a pipe
+    New data is sent to the LiveGraph instance via a pipe, or if a
+    telemetry ring is given the child evaluates the fields itself from
+    the newest messages in the ring on each tick
     '''
     def __init__(self,
                  fields,
                  title='MAVProxy: LiveGraph',
                  timespan=20.0,
                  tickresolution=0.2,
-                 colors=[ 'red', 'green', 'blue', 'orange', 'olive', 'yellow', 'grey', 'black']):
+                 colors=[ 'red', 'green', 'blue', 'orange', 'olive', 'yellow', 'grey', 'black'],
+                 telemetry=None):
         import multiprocessing
         self.fields = fields
         self.colors = colors
@@ -29,6 +32,8 @@ class LiveGraph():
         self.timespan = timespan
         self.tickresolution = tickresolution
         self.values = [None]*len(self.fields)
+        self.telemetry = telemetry
+        self.view = None
 
         self.parent_pipe,self.child_pipe = multiprocessing.Pipe()
         self.close_graph = multiprocessing.Event()
@@ -40,6 +45,9 @@ class LiveGraph():
         '''child process - this holds all the GUI elements'''
         import wx, matplotlib
         matplotlib.use('WXAgg')
+        if self.telemetry is not None:
+            from MAVProxy.modules.lib import mp_telemetry
+            self.view = mp_telemetry.TelemetryView(self.telemetry)
         app = wx.PySimpleApp()
         app.frame = GraphFrame(state=self)
         app.frame.Show()
@@ -212,6 +220,8 @@ class GraphFrame(wx.Frame):
             return
         while state.child_pipe.poll():
             state.values = state.child_pipe.recv()
+        if state.view is not None:
+            self.update_values()
         if self.paused:
             return
         for i in range(len(self.plot_data)):
@@ -226,6 +236,17 @@ class GraphFrame(wx.Frame):
         self.axes.legend(state.fields, loc='upper left', bbox_to_anchor=(0, 1.1))
         self.draw_plot()
 
+    def update_values(self):
+        '''evaluate the fields on the newest telemetry'''
+        from pymavlink import mavutil
+        state = self.state
+        state.view.update()
+        messages = state.view.messages()
+        for i in range(len(state.fields)):
+            v = mavutil.evaluate_expression(state.fields[i], messages)
+            if v is not None:
+                state.values[i] = v
+
 if __name__ == "__main__":
     # test the graph
     import time, math
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+'''
+duplicate packet suppression across master links
+
+with redundant links to a vehicle each packet arrives once per link.
+A packet is identified by its (sysid, compid, seq, msgid, crc), and
+one already seen on any link within a short window is a duplicate.
+The sequence number of a component wraps every 256 packets, so the
+window should be well under the time that takes
+'''
+
+from collections import deque
+
+class Deduplicator(object):
+    '''
+    remembers the packets seen in the last window seconds. The number of
+    packets remembered is also limited, in case the clock jumps back
+    '''
+    def __init__(self, max_entries=20000):
+        self.max_entries = max_entries
+        # key -> link the packet came in on first
+        self.seen = {}
+        # (arrival time, key) in arrival order
+        self.order = deque()
+        self.unique = 0
+        self.duplicates = 0
+        # per link counts of packets that arrived first, and of duplicates
+        self.link_first = {}
+        self.link_duplicates = {}
+
+    def check(self, m, linknum, now, window=0.5):
+        '''return True if the message m from a link is a copy of one
+        seen within window seconds'''
+        try:
+            h = m._header
+            key = (h.srcSystem, h.srcComponent, h.seq, h.msgId, m._crc)
+        except AttributeError:
+            # not a decoded packet
+            return False
+        order = self.order
+        limit = now - window
+        while order and (order[0][0] < limit or len(order) > self.max_entries):
+            del self.seen[order.popleft()[1]]
+        if key in self.seen:
+            self.duplicates += 1
+            self.link_duplicates[linknum] = self.link_duplicates.get(linknum, 0) + 1
+            return True
+        self.seen[key] = linknum
+        order.append((now, key))
+        self.unique += 1
+        self.link_first[linknum] = self.link_first.get(linknum, 0) + 1
+        return False
+
+    def __str__(self):
+        return '%u unique %u duplicates' % (self.unique, self.duplicates)
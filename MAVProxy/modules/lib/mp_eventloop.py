@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+'''
+event loop for MAVProxy
+
+This is a small single threaded event loop modelled on the asyncio
+API (call_soon, call_later, add_reader, create_task), for use with
+python versions that don't have asyncio. File descriptors are waited
+on with a MPSelect, so fds registered with the main loop selector are
+serviced here as well.
+
+Tasks are generators. A task yields the number of seconds to sleep
+before it is resumed, or None to be resumed on the next pass of the
+loop.
+'''
+
+import heapq, time, itertools
+from collections import deque
+
+class Handle(object):
+    '''a callback scheduled on the event loop'''
+    __slots__ = ['when', 'callback', 'args', 'cancelled']
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        '''stop the callback from being called'''
+        self.cancelled = True
+
+class Task(object):
+    '''a generator driven by the event loop'''
+    def __init__(self, loop, gen):
+        self.loop = loop
+        self.gen = gen
+        self.done = False
+        self.handle = loop.call_soon(self.step)
+
+    def step(self):
+        '''run the generator to its next yield'''
+        try:
+            delay = next(self.gen)
+        except StopIteration:
+            self.done = True
+            return
+        except Exception as e:
+            self.done = True
+            self.loop.call_exception_handler(e)
+            return
+        if delay is None:
+            self.handle = self.loop.call_soon(self.step)
+        else:
+            self.handle = self.loop.call_later(delay, self.step)
+
+    def wake(self):
+        '''resume the task on the next pass, rather than waiting for its delay.
+        Must not be called from within the task'''
+        if self.done:
+            return
+        self.handle.cancel()
+        self.handle = self.loop.call_soon(self.step)
+
+    def cancel(self):
+        '''stop the task'''
+        self.handle.cancel()
+        self.gen.close()
+        self.done = True
+
+class MPEventLoop(object):
+    '''
+    a timer and file descriptor event loop
+    '''
+    def __init__(self, selector, max_timeout=0.1):
+        self.selector = selector
+        self.max_timeout = max_timeout
+        self.timers = []
+        self.ready = deque()
+        self.counter = itertools.count()
+        self.stopping = False
+        self.exception_handler = None
+
+    def time(self):
+        '''the loop clock'''
+        return time.time()
+
+    def call_soon(self, callback, *args):
+        '''call callback(*args) on the next pass of the loop'''
+        handle = Handle(None, callback, args)
+        self.ready.append(handle)
+        return handle
+
+    def call_at(self, when, callback, *args):
+        '''call callback(*args) at time when'''
+        handle = Handle(when, callback, args)
+        heapq.heappush(self.timers, (when, next(self.counter), handle))
+        return handle
+
+    def call_later(self, delay, callback, *args):
+        '''call callback(*args) after delay seconds'''
+        return self.call_at(self.time() + delay, callback, *args)
+
+    def call_periodic(self, period, callback, *args):
+        '''call callback(*args) every period seconds until the task is cancelled'''
+        def periodic():
+            while True:
+                callback(*args)
+                yield period
+        return self.create_task(periodic())
+
+    def create_task(self, gen):
+        '''start running a generator task'''
+        return Task(self, gen)
+
+    def add_reader(self, fd, callback, *args):
+        '''call callback(*args) whenever fd is readable'''
+        self.selector.register(fd, self._call_handler, (callback, args))
+
+    def remove_reader(self, fd):
+        '''stop watching fd'''
+        self.selector.unregister(fd)
+
+    def add_writer(self, fd, callback, *args):
+        '''call callback(*args) whenever fd is writable'''
+        self.selector.register_writer(fd, self._call_handler, (callback, args))
+
+    def remove_writer(self, fd):
+        '''stop waiting for fd to be writable'''
+        self.selector.unregister_writer(fd)
+
+    def _call_handler(self, reader):
+        (callback, args) = reader
+        callback(*args)
+
+    def _dispatch(self, handler):
+        '''call a selector handler'''
+        if handler is None:
+            return
+        (fn, args) = handler
+        try:
+            fn(args)
+        except Exception as e:
+            self.call_exception_handler(e)
+
+    def set_exception_handler(self, handler):
+        '''set a function to call with exceptions raised by callbacks'''
+        self.exception_handler = handler
+
+    def call_exception_handler(self, e):
+        '''report an exception from a callback'''
+        if self.exception_handler is not None:
+            self.exception_handler(e)
+
+    def _run(self, handle):
+        if handle.cancelled:
+            return
+        try:
+            handle.callback(*handle.args)
+        except Exception as e:
+            self.call_exception_handler(e)
+
+    def run_once(self):
+        '''wait for the next event and run everything that is due'''
+        if self.ready:
+            timeout = 0
+        elif self.timers:
+            timeout = min(max(0, self.timers[0][0] - self.time()), self.max_timeout)
+        else:
+            timeout = self.max_timeout
+
+        if len(self.selector) > 0:
+            (readable, writable) = self.selector.select(timeout)
+        else:
+            time.sleep(timeout)
+            (readable, writable) = ([], [])
+        for fd in writable:
+            self._dispatch(self.selector.writer(fd))
+        for fd in readable:
+            self._dispatch(self.selector.handler(fd))
+
+        now = self.time()
+        while self.timers and self.timers[0][0] <= now:
+            (when, count, handle) = heapq.heappop(self.timers)
+            self.ready.append(handle)
+
+        # only run what is ready now, callbacks added while running
+        # wait for the next pass
+        for i in range(len(self.ready)):
+            self._run(self.ready.popleft())
+
+    def run_forever(self):
+        '''run until stop() is called'''
+        self.stopping = False
+        while not self.stopping:
+            self.run_once()
+
+    def stop(self):
+        '''stop run_forever() at the end of the current pass'''
+        self.stopping = True
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+'''
+forwarding latency tracing for MAVProxy
+
+when enabled, each block of data read from a master is timestamped
+when recv() returns. Each message from it is then timed when it has
+been decoded, when the modules have processed it, and when it is
+written to each output. Rolling percentiles are kept per link and per
+output
+'''
+
+import time
+from collections import deque
+
+class LatencyWindow(object):
+    '''the most recent latency samples of one stage'''
+    def __init__(self, size=2000):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, dt):
+        '''add a sample in seconds'''
+        self.samples.append(dt)
+        self.count += 1
+        if dt > self.max:
+            self.max = dt
+
+    def percentiles(self, pcts=(50, 95, 99)):
+        '''return the given percentiles of the window, in seconds'''
+        values = sorted(self.samples)
+        if len(values) == 0:
+            return [0.0] * len(pcts)
+        ret = []
+        for p in pcts:
+            ret.append(values[min(len(values)-1, int(len(values) * p / 100.0))])
+        return ret
+
+    def __str__(self):
+        (p50, p95, p99) = self.percentiles()
+        return 'p50=%.3fms p95=%.3fms p99=%.3fms max=%.3fms n=%u' % (
+            p50*1000, p95*1000, p99*1000, self.max*1000, self.count)
+
+class LatencyTracer(object):
+    '''
+    latency from recv() to each stage of the forwarding path
+    '''
+    def __init__(self, window=2000):
+        self.enabled = False
+        self.window = window
+        # recv time of the data being processed, or None
+        self.recv_time = None
+        self.links = {}
+        self.outputs = {}
+
+    def received(self):
+        '''mark the time a block of data was read from a master'''
+        self.recv_time = time.time()
+
+    def done(self):
+        '''mark the end of processing of the block'''
+        self.recv_time = None
+
+    def link_stage(self, linknum, stage):
+        '''record the latency of a stage for a message on a link'''
+        if self.recv_time is None:
+            return
+        key = (linknum, stage)
+        w = self.links.get(key, None)
+        if w is None:
+            w = LatencyWindow(self.window)
+            self.links[key] = w
+        w.add(time.time() - self.recv_time)
+
+    def output_write(self, address):
+        '''record the latency of a write to an output'''
+        if self.recv_time is None:
+            return
+        w = self.outputs.get(address, None)
+        if w is None:
+            w = LatencyWindow(self.window)
+            self.outputs[address] = w
+        w.add(time.time() - self.recv_time)
+
+    def reset(self):
+        '''forget all samples'''
+        self.links = {}
+        self.outputs = {}
+
+    def report(self):
+        '''return the latencies as lines of text'''
+        lines = []
+        for (linknum, stage) in sorted(self.links.keys()):
+            lines.append('link %u %-8s %s' % (linknum+1, stage, self.links[(linknum, stage)]))
+        for address in sorted(self.outputs.keys()):
+            lines.append('out %s %s' % (address, self.outputs[address]))
+        return lines
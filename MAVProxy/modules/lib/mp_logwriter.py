@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+'''
+buffered log file writing
+
+records are copied through a memoryview into a ring of pre-allocated
+blocks, so adding one allocates nothing. A writer thread writes each
+block whole once it fills, and the partly filled block a few times a
+second, so the thread adding records never waits on the disk. Records
+never span blocks. Memory is bounded by the ring: if the disk stalls
+long enough for every block to fill, records are dropped and counted
+instead of queueing without limit
+
+the writer thread can also compress the log as it goes and split it
+into numbered segments, and write the sidecar index of each tlog
+segment, see LogFile
+'''
+
+import os, struct, threading, time, zlib
+from MAVProxy.modules.lib import mp_tlog
+
+# seconds between writes
+WRITE_INTERVAL = 0.1
+# size of the blocks of the ring, the largest record that can be logged
+BLOCK_SIZE = 1<<16
+# most seconds of compressed data held back by the compressor, so a
+# crash loses little of a compressed log
+SYNC_INTERVAL = 1.0
+
+header_struct = struct.Struct('>Q')
+
+# file name suffixes of the compression methods
+compress_suffix = { 'none' : '', 'gzip' : '.gz', 'zstd' : '.zst' }
+
+class Compressor(object):
+    '''streaming gzip or zstd compression'''
+    def __init__(self, method):
+        self.method = method
+        if method == 'gzip':
+            self.obj = zlib.compressobj(6, zlib.DEFLATED, 16+zlib.MAX_WBITS)
+        elif method == 'zstd':
+            import zstandard
+            self.zstd = zstandard
+            self.obj = zstandard.ZstdCompressor(level=3).compressobj()
+        else:
+            raise ValueError('unknown compression %s' % method)
+
+    def compress(self, data):
+        '''compress some data, returning what is ready to write'''
+        return self.obj.compress(data)
+
+    def sync(self):
+        '''return the data needed to make all compressed so far readable'''
+        if self.method == 'gzip':
+            return self.obj.flush(zlib.Z_SYNC_FLUSH)
+        return self.obj.flush(self.zstd.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        '''return the end of the compressed stream'''
+        return self.obj.flush()
+
+def compress_available(method):
+    '''return True if a compression method can be used'''
+    if method == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            return False
+    return method in compress_suffix
+
+def segment_filename(filename, segment, compress='none'):
+    '''the file name of a log segment. filename is the log name without
+    segment number or compression suffix, like flight.tlog. A segment
+    of None is the log without a number'''
+    if segment is not None:
+        (dirname, base) = os.path.split(filename)
+        i = base.find('.')
+        if i == -1:
+            i = len(base)
+        filename = os.path.join(dirname, '%s.%04u%s' % (base[:i], segment, base[i:]))
+    return filename + compress_suffix[compress]
+
+class LogFile(object):
+    '''
+    the file a LogWriter writes to. The data can be compressed as it is
+    written, and the log split into numbered segments of a size in bytes
+    on disk or a number of seconds. If indexed is set, each segment of a
+    tlog gets an index. Changes to the compression and indexing apply
+    from the next segment. Only call it from one thread
+    '''
+    def __init__(self, filename, append=False, compress='none', segment_size=0, segment_time=0,
+                 indexed=False):
+        self.filename = filename
+        self.compress = compress
+        self.indexed = indexed
+        self.segment_size = segment_size
+        self.segment_time = segment_time
+        self.segment = None
+        if segment_size > 0 or segment_time > 0:
+            self.segment = 1
+            if append:
+                # carry on in the last segment
+                while os.path.exists(self.segment_name(self.segment + 1)):
+                    self.segment += 1
+        self.f = None
+        self.compressor = None
+        self.index = None
+        self.segments = 0
+        self.open(append)
+
+    def segment_name(self, segment):
+        '''the name of a segment with the current compression'''
+        return segment_filename(self.filename, segment, self.compress)
+
+    def open(self, append):
+        '''start the current segment'''
+        self.name = self.segment_name(self.segment)
+        self.compressor = None
+        if self.compress != 'none':
+            self.compressor = Compressor(self.compress)
+        self.f = open(self.name, 'ab' if append else 'wb')
+        self.opened = time.time()
+        self.last_sync = self.opened
+        self.size = self.f.tell()
+        self.segments += 1
+        self.open_index(append)
+
+    def open_index(self, append):
+        '''start the index of the current segment, unless appending would make it wrong'''
+        self.index = None
+        # bytes of log data in the segment, before compression
+        self.data_size = 0
+        if not self.indexed:
+            return
+        if append and self.size > 0:
+            # carry on only with an index covering all of a plain log
+            if self.compressor is not None:
+                return
+            old = mp_tlog.load_index(self.name, msgids=set())
+            if old is None or old.end != self.size:
+                return
+            self.data_size = self.size
+        self.index = mp_tlog.TlogIndexWriter(mp_tlog.index_filename(self.name),
+                                             append=(self.data_size > 0))
+
+    def finish(self):
+        '''end the current segment'''
+        if self.compressor is not None:
+            self._write(self.compressor.finish())
+        self.f.close()
+        if self.index is not None:
+            self.index.close()
+
+    def rotate(self):
+        '''start a new segment'''
+        self.finish()
+        if self.segment is None:
+            self.segment = 1
+        self.segment += 1
+        self.open(False)
+
+    def _write(self, data):
+        '''write to the current segment'''
+        if data:
+            self.f.write(data)
+            self.size += len(data)
+
+    def write(self, data):
+        '''write data, which must start on a record boundary if segments are in use'''
+        if ((self.segment_size > 0 and self.size >= self.segment_size) or
+            (self.segment_time > 0 and time.time() - self.opened >= self.segment_time)):
+            self.rotate()
+        if self.compressor is not None:
+            self._write(self.compressor.compress(data))
+            if time.time() - self.last_sync >= SYNC_INTERVAL:
+                self._write(self.compressor.sync())
+                self.last_sync = time.time()
+        else:
+            self._write(data)
+        if self.index is not None:
+            self.index.add(data, self.data_size)
+        self.data_size += len(data)
+
+    def flush(self):
+        '''make everything written so far readable'''
+        if self.compressor is not None:
+            self._write(self.compressor.sync())
+            self.last_sync = time.time()
+        self.f.flush()
+        if self.index is not None:
+            self.index.flush()
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def close(self):
+        '''end the log'''
+        self.finish()
+
+class LogWriter(object):
+    '''
+    writes records to a file from a background thread, or from
+    write_pending() when there is no thread. Changes to the settings of
+    a LogFile are passed through set_file_settings(), so they are made
+    by the thread writing to it
+    '''
+    def __init__(self, f, buffer_size=1<<21, flush=False, fsync_interval=0):
+        self.f = f
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        # size of the ring, changes apply once the writer catches up
+        self.buffer_size = buffer_size
+        self.make_ring()
+        # flush the file after each write
+        self.flush = flush
+        # seconds between fsyncs, 0 for none
+        self.fsync_interval = fsync_interval
+        self.last_fsync = time.time()
+        # LogFile settings to change on the next write
+        self.file_settings = {}
+        self.woken = False
+        self.thread = None
+        self.closed = False
+        self.records = 0
+        self.bytes = 0
+        self.writes = 0
+        self.fsyncs = 0
+        self.dropped = 0
+        self.dropped_bytes = 0
+        self.write_errors = 0
+
+    def ring_blocks(self):
+        '''number of blocks for the buffer size'''
+        return max(2, self.buffer_size // BLOCK_SIZE)
+
+    def make_ring(self):
+        '''allocate the blocks for the buffer size'''
+        count = self.ring_blocks()
+        self.blocks = [bytearray(BLOCK_SIZE) for i in range(count)]
+        self.views = [memoryview(b) for b in self.blocks]
+        # filled length of each complete block
+        self.lengths = [0] * count
+        # block being filled, and how much of it is used
+        self.head = 0
+        self.view = self.views[0]
+        self.fill_len = 0
+        # oldest complete block, and the number waiting to be written
+        self.tail = 0
+        self.full = 0
+
+    def next_block(self):
+        '''complete the block being filled and move on to the next,
+        returning False if they are all waiting to be written. Call
+        with the lock held'''
+        if self.fill_len == 0:
+            return True
+        if self.full + 1 >= len(self.blocks):
+            return False
+        self.lengths[self.head] = self.fill_len
+        self.full += 1
+        self.head = (self.head + 1) % len(self.blocks)
+        self.view = self.views[self.head]
+        self.fill_len = 0
+        if not self.woken:
+            self.woken = True
+            self.wakeup.set()
+        return True
+
+    def append(self, data):
+        '''add data to the log, returning False if it was dropped'''
+        n = len(data)
+        with self.lock:
+            pos = self.fill_len
+            if pos + n > BLOCK_SIZE:
+                if n > BLOCK_SIZE or not self.next_block():
+                    self.dropped += 1
+                    self.dropped_bytes += n
+                    return False
+                pos = 0
+            self.view[pos:pos+n] = data
+            self.fill_len = pos + n
+            self.records += 1
+        return True
+
+    def append_record(self, usec, data):
+        '''add a tlog record of a timestamp and a packet, returning False if it was dropped'''
+        n = len(data)
+        with self.lock:
+            pos = self.fill_len
+            if pos + 8 + n > BLOCK_SIZE:
+                if 8 + n > BLOCK_SIZE or not self.next_block():
+                    self.dropped += 1
+                    self.dropped_bytes += 8 + n
+                    return False
+                pos = 0
+            header_struct.pack_into(self.blocks[self.head], pos, usec)
+            self.view[pos+8:pos+8+n] = data
+            self.fill_len = pos + 8 + n
+            self.records += 1
+        return True
+
+    def set_file_settings(self, **kwargs):
+        '''change settings of the file, such as compress or segment_size'''
+        with self.lock:
+            self.file_settings.update(kwargs)
+
+    def file_setting(self, name):
+        '''the value of a file setting, including changes not yet made'''
+        with self.lock:
+            if name in self.file_settings:
+                return self.file_settings[name]
+        return getattr(self.f, name)
+
+    def write_pending(self):
+        '''write out the records added since the last write, a block at a time'''
+        with self.lock:
+            self.next_block()
+            self.woken = False
+            pending = self.full
+            file_settings = self.file_settings
+            if file_settings:
+                self.file_settings = {}
+        for (name, value) in file_settings.items():
+            setattr(self.f, name, value)
+        for i in range(pending):
+            block = self.tail
+            n = self.lengths[block]
+            try:
+                self.f.write(buffer(self.blocks[block], 0, n))
+                self.bytes += n
+                self.writes += 1
+            except (IOError, ValueError):
+                # a full disk, or the file was closed
+                self.write_errors += 1
+            with self.lock:
+                self.tail = (block + 1) % len(self.blocks)
+                self.full -= 1
+        with self.lock:
+            if self.full == 0 and self.ring_blocks() != len(self.blocks):
+                # resize, keeping the partly filled block
+                data = self.views[self.head][:self.fill_len].tobytes()
+                self.make_ring()
+                self.view[:len(data)] = data
+                self.fill_len = len(data)
+        try:
+            if self.flush or self.fsync_interval > 0:
+                self.f.flush()
+            if self.fsync_interval > 0 and time.time() - self.last_fsync >= self.fsync_interval:
+                self.last_fsync = time.time()
+                os.fsync(self.f.fileno())
+                self.fsyncs += 1
+        except (IOError, OSError):
+            self.write_errors += 1
+
+    def run(self):
+        '''writer thread'''
+        while not self.closed:
+            self.wakeup.wait(WRITE_INTERVAL)
+            self.wakeup.clear()
+            self.write_pending()
+
+    def start(self):
+        '''start the writer thread'''
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        '''write out everything added so far and close the file'''
+        self.closed = True
+        if self.thread is not None:
+            self.wakeup.set()
+            self.thread.join(2)
+            self.thread = None
+        self.write_pending()
+        self.f.close()
+
+    def __str__(self):
+        return '%u records %u bytes in %u writes, %u fsyncs, %u dropped (%u bytes), %u errors' % (
+            self.records, self.bytes, self.writes, self.fsyncs,
+            self.dropped, self.dropped_bytes, self.write_errors)
@@ -18,6 +18,11 @@ class MPModule(object):
             self.description = description
         if public:
             mpstate.public_modules[name] = self
+        # message types passed to mavlink_packet(). None means all types
+        self.mavlink_types = None
+        # calls per second of idle_task(), None means every pass of the main loop
+        self.idle_rate = None
+        self.idle_timer = None
 
     #
     # Overridable hooks follow...
@@ -80,6 +85,16 @@ class MPModule(object):
     def target_component(self):
         return self.mpstate.status.target_component
 
+    @property
+    def vehicles(self):
+        '''the registry of vehicles seen, keyed by system and component ID'''
+        return self.mpstate.vehicles
+
+    @property
+    def event_loop(self):
+        '''the event loop, or None when using the select loop'''
+        return self.mpstate.event_loop
+
     @property
     def master(self):
         return self.mpstate.master()
@@ -108,3 +123,47 @@ class MPModule(object):
 
     def add_completion_function(self, name, callback):
         self.mpstate.completion_functions[name] = callback
+
+    def add_mavlink_types(self, mtypes):
+        '''only pass messages of the given types to mavlink_packet(). Modules
+        that never call this are passed every message'''
+        if self.mavlink_types is None:
+            self.mavlink_types = set()
+        self.mavlink_types.update(mtypes)
+        self.mpstate.mavlink_dispatch.clear()
+
+    def add_timer(self, period, callback, *args):
+        '''call callback(*args) every period seconds. Returns the timer,
+        which can be cancelled. Timers are cancelled when the module is unloaded'''
+        return self.mpstate.scheduler.add(period, callback, args, owner=self)
+
+    def add_deadline(self, when, callback, *args):
+        '''call callback(*args) once at time when'''
+        return self.mpstate.scheduler.add(None, callback, args, owner=self, when=when)
+
+    def telemetry_ring(self):
+        '''return the shared memory ring of received messages, for passing
+        to a GUI child process to read with mp_telemetry.TelemetryView'''
+        return self.mpstate.telemetry_ring()
+
+    def message_rate(self, mtype, link=None, sysid=None):
+        '''messages per second of a type received, from one link or
+        system if given. See mp_rates for the age and jitter'''
+        return self.mpstate.status.rates.rate(mtype, link, sysid)
+
+    def set_idle_rate(self, rate):
+        '''call idle_task() rate times per second instead of on every pass
+        of the main loop. A rate of None restores the old behaviour'''
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+            self.idle_timer = None
+        self.idle_rate = rate
+        if rate is not None:
+            self.idle_timer = self.add_timer(1.0/rate, self.idle_task)
+
+    def wants_mavlink_type(self, mtype):
+        '''return True if mavlink_packet() should be called for mtype'''
+        if self.mavlink_packet.__func__ is MPModule.mavlink_packet.__func__:
+            # no handler, don't bother calling it
+            return False
+        return self.mavlink_types is None or mtype in self.mavlink_types
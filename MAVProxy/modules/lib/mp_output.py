@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+'''per-output state for MAVProxy outputs'''
+
+import time, fnmatch, errno, socket, threading
+from collections import deque
+from pymavlink import mavutil
+
+class OutputFilter(object):
+    '''
+    message type filter for an output. Types can be fnmatch patterns,
+    so GPS* matches all GPS messages. Rates are in Hz, and limit how
+    often a message type is sent to the output
+    '''
+    def __init__(self):
+        self.allow = None
+        self.deny = []
+        self.rates = []
+        self.active = False
+        self.decisions = {}
+        self.last_sent = {}
+        self.dropped = 0
+
+    def update(self):
+        '''recompute cached state after a change'''
+        self.active = self.allow is not None or len(self.deny) > 0 or len(self.rates) > 0
+        self.decisions = {}
+
+    def set_allow(self, types):
+        '''only send these types, or everything if types is None'''
+        if types is None:
+            self.allow = None
+        else:
+            self.allow = [t.upper() for t in types]
+        self.update()
+
+    def set_deny(self, types):
+        '''never send these types'''
+        self.deny = [t.upper() for t in types]
+        self.update()
+
+    def set_rate(self, mtype, rate):
+        '''send at most rate messages per second of this type. A rate of 0 removes the limit'''
+        mtype = mtype.upper()
+        self.rates = [(t, r) for (t, r) in self.rates if t != mtype]
+        if rate > 0:
+            self.rates.append((mtype, rate))
+        self.update()
+
+    def clear(self):
+        '''remove all filtering'''
+        self.allow = None
+        self.deny = []
+        self.rates = []
+        self.last_sent = {}
+        self.update()
+
+    def decide(self, mtype):
+        '''work out if a type is sent and its minimum interval'''
+        allowed = True
+        if self.allow is not None:
+            allowed = False
+            for t in self.allow:
+                if fnmatch.fnmatch(mtype, t):
+                    allowed = True
+                    break
+        for t in self.deny:
+            if fnmatch.fnmatch(mtype, t):
+                allowed = False
+        interval = 0
+        for (t, r) in self.rates:
+            if fnmatch.fnmatch(mtype, t):
+                interval = 1.0 / r
+        self.decisions[mtype] = (allowed, interval)
+        return (allowed, interval)
+
+    def check(self, mtype):
+        '''return True if a message of this type should be sent now'''
+        decision = self.decisions.get(mtype, None)
+        if decision is None:
+            decision = self.decide(mtype)
+        (allowed, interval) = decision
+        if not allowed:
+            self.dropped += 1
+            return False
+        if interval == 0:
+            return True
+        now = time.time()
+        last = self.last_sent.get(mtype, 0)
+        # allow some jitter, so a 1Hz message isn't cut to 0.5Hz by a 1Hz limit
+        if now - last < 0.9*interval and now >= last:
+            self.dropped += 1
+            return False
+        self.last_sent[mtype] = now
+        return True
+
+    def __str__(self):
+        if not self.active:
+            return 'all'
+        ret = []
+        if self.allow is not None:
+            ret.append('allow=%s' % ','.join(self.allow))
+        if len(self.deny) > 0:
+            ret.append('deny=%s' % ','.join(self.deny))
+        if len(self.rates) > 0:
+            ret.append('rate=%s' % ','.join(['%s:%g' % (t, r) for (t, r) in self.rates]))
+        ret.append('dropped=%u' % self.dropped)
+        return ' '.join(ret)
+
+# message types that are kept in preference to others when an output
+# queue overflows with the drop_priority policy
+high_priority_types = frozenset([ 'HEARTBEAT', 'STATUSTEXT', 'COMMAND_ACK', 'COMMAND_LONG',
+                                  'MISSION_ACK', 'MISSION_COUNT', 'MISSION_ITEM', 'MISSION_REQUEST',
+                                  'MISSION_CURRENT', 'PARAM_VALUE', 'SYS_STATUS' ])
+
+def message_priority(mtype):
+    '''return the send priority of a message type, higher is more important'''
+    if mtype in high_priority_types:
+        return 2
+    return 1
+
+overflow_policies = [ 'drop_oldest', 'drop_priority', 'disconnect' ]
+
+class SendQueue(object):
+    '''
+    bounded send buffer for an output, so a slow output never holds up
+    the vehicle link. Buffers that can't be sent at once are queued,
+    and when more than max_bytes are waiting the overflow policy is
+    applied. How an output is written depends on its type:
+
+      socket  TCP outputs. pymavlink makes the socket non-blocking and
+              keeps it for the life of the connection, so it is written
+              to directly, with anything not sent held until the socket
+              is writable
+      thread  serial, child process and other outputs whose write() can
+              block. A writer thread per output calls conn.write()
+      direct  UDP and TCP listener outputs, which pymavlink writes
+              without blocking, and outputs that aren't pymavlink
+              connections. These are not queued
+    '''
+    def __init__(self, conn, selector, disconnect=None, max_bytes=16384, policy='drop_oldest'):
+        self.conn = conn
+        self.selector = selector
+        self.disconnect = disconnect
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.queue = deque()
+        self.queued_bytes = 0
+        # bytes of the first queued buffer already written
+        self.head_sent = 0
+        self.max_depth = 0
+        self.dropped = 0
+        self.dropped_bytes = 0
+        self.errors = 0
+        self.sock = None
+        self.fd = None
+        self.thread = None
+        self.closed = False
+        if isinstance(conn, mavutil.mavtcp):
+            self.mode = 'socket'
+            self.sock = conn.port
+            self.fd = self.sock.fileno()
+        elif isinstance(conn, mavutil.mavudp):
+            self.mode = 'direct'
+            self.reason = 'UDP'
+        elif isinstance(conn, mavutil.mavtcpin):
+            self.mode = 'direct'
+            self.reason = 'TCP listener'
+        elif not isinstance(conn, mavutil.mavfile):
+            self.mode = 'direct'
+            self.reason = 'not a MAVLink connection'
+        else:
+            self.mode = 'thread'
+            # reentrant, as the disconnect policy removes the output from write()
+            self.cond = threading.Condition(threading.RLock())
+            self.thread = threading.Thread(target=self.writer_thread)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def backlogged(self):
+        '''return True if data is waiting to be sent'''
+        return len(self.queue) > 0
+
+    def write(self, buf, priority=1):
+        '''send or queue a buffer'''
+        if self.mode == 'direct':
+            self.conn.write(buf)
+        elif self.mode == 'thread':
+            with self.cond:
+                if self.closed:
+                    return
+                self.queue.append((priority, buf))
+                self.queued_bytes += len(buf)
+                self.check_depth()
+                self.cond.notify()
+        elif not self.queue:
+            n = self._send(buf)
+            if n is None or n == len(buf):
+                return
+            self.queue.append((priority, buf))
+            self.head_sent = n
+            self.queued_bytes += len(buf) - n
+            self.selector.register_writer(self.fd, self.drain, None)
+            self.check_depth()
+        else:
+            self.queue.append((priority, buf))
+            self.queued_bytes += len(buf)
+            self.check_depth()
+
+    def check_depth(self):
+        '''apply the overflow policy if needed, and track the deepest the queue has been'''
+        if self.queued_bytes > self.max_bytes:
+            self.overflow()
+        self.max_depth = max(self.max_depth, self.queued_bytes)
+
+    def _send(self, buf):
+        '''try to write, returning the number of bytes written, or None on error'''
+        try:
+            return self.sock.send(buf)
+        except socket.error as e:
+            if e.errno in [ errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR ]:
+                return 0
+            self.errors += 1
+            self.clear()
+            return None
+
+    def drain(self, args=None):
+        '''write as much queued data as the socket will take'''
+        while self.queue:
+            (priority, buf) = self.queue[0]
+            n = self._send(buf[self.head_sent:] if self.head_sent else buf)
+            if n is None:
+                return
+            self.queued_bytes -= n
+            if self.head_sent + n < len(buf):
+                self.head_sent += n
+                return
+            self.queue.popleft()
+            self.head_sent = 0
+        self.selector.unregister_writer(self.fd)
+
+    def writer_thread(self):
+        '''write queued buffers with conn.write(), which may block'''
+        while True:
+            with self.cond:
+                while not self.queue and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                (priority, buf) = self.queue.popleft()
+                self.queued_bytes -= len(buf)
+            try:
+                if self.conn.write(buf) == -1:
+                    # a serial port that has gone away
+                    self.errors += 1
+            except Exception:
+                self.errors += 1
+
+    def drop(self, index):
+        '''drop a queued buffer'''
+        (priority, buf) = self.queue[index]
+        del self.queue[index]
+        self.queued_bytes -= len(buf)
+        self.dropped += 1
+        self.dropped_bytes += len(buf)
+
+    def overflow(self):
+        '''apply the overflow policy'''
+        if self.policy == 'disconnect':
+            self.dropped += len(self.queue)
+            self.dropped_bytes += self.queued_bytes
+            self.clear()
+            if self.disconnect is not None:
+                self.disconnect(self.conn)
+            return
+        # a partly written first buffer is never dropped, so the
+        # stream stays in sync
+        first = 1 if self.head_sent > 0 else 0
+        while self.queued_bytes > self.max_bytes and len(self.queue) > first:
+            idx = first
+            if self.policy == 'drop_priority':
+                lowest = min([p for (p, b) in list(self.queue)[first:]])
+                for i in range(first, len(self.queue)):
+                    if self.queue[i][0] == lowest:
+                        idx = i
+                        break
+            self.drop(idx)
+
+    def clear(self):
+        '''discard anything queued'''
+        self.queue.clear()
+        self.queued_bytes = 0
+        self.head_sent = 0
+        if self.mode == 'socket':
+            self.selector.unregister_writer(self.fd)
+
+    def close(self):
+        '''discard anything queued and stop the writer thread'''
+        if self.mode == 'thread':
+            with self.cond:
+                self.closed = True
+                self.clear()
+                self.cond.notify()
+        else:
+            self.clear()
+
+    def set_policy(self, policy):
+        '''change the overflow policy'''
+        if not policy in overflow_policies:
+            raise ValueError("policy must be one of %s" % ','.join(overflow_policies))
+        self.policy = policy
+
+    def __str__(self):
+        if self.mode == 'direct':
+            return 'not queued (%s)' % self.reason
+        return '%s queue=%u/%u max=%u policy=%s dropped=%u(%u bytes) errors=%u' % (
+            self.mode, self.queued_bytes, self.max_bytes, self.max_depth, self.policy,
+            self.dropped, self.dropped_bytes, self.errors)
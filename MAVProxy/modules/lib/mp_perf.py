@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+'''
+CPU accounting for MAVProxy modules
+
+records the time taken by module callbacks: mavlink_packet(), idle
+tasks, timers, commands and select_extra readers. Each (module, kind,
+name) gets a call count, total and maximum time, and a histogram with
+power of two buckets in microseconds
+'''
+
+# histogram bucket i counts calls taking under 2**i microseconds
+HIST_BUCKETS = 24
+
+class PerfStat(object):
+    '''timing of one callback'''
+    __slots__ = ['count', 'total', 'max', 'hist']
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.hist = [0] * HIST_BUCKETS
+
+    def add(self, dt):
+        '''record a call taking dt seconds'''
+        self.count += 1
+        self.total += dt
+        if dt > self.max:
+            self.max = dt
+        usec = int(dt * 1.0e6)
+        if usec < 0:
+            usec = 0
+        bucket = usec.bit_length()
+        if bucket >= HIST_BUCKETS:
+            bucket = HIST_BUCKETS - 1
+        self.hist[bucket] += 1
+
+    def merge(self, other):
+        '''add another PerfStat into this one'''
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        for i in range(HIST_BUCKETS):
+            self.hist[i] += other.hist[i]
+
+    def mean(self):
+        '''mean call time in seconds'''
+        if self.count == 0:
+            return 0
+        return self.total / self.count
+
+    def hist_str(self):
+        '''the non-empty histogram buckets'''
+        ret = []
+        for i in range(HIST_BUCKETS):
+            if self.hist[i] != 0:
+                ret.append('<%s:%u' % (usec_str(1 << i), self.hist[i]))
+        return ' '.join(ret)
+
+def usec_str(usec):
+    '''format a time in microseconds'''
+    if usec >= 1000000:
+        return '%us' % (usec // 1000000)
+    if usec >= 1000:
+        return '%ums' % (usec // 1000)
+    return '%uus' % usec
+
+sort_keys = {
+    'time'  : lambda s: s.total,
+    'count' : lambda s: s.count,
+    'max'   : lambda s: s.max,
+    'mean'  : lambda s: s.mean(),
+    }
+
+class PerfRecorder(object):
+    '''
+    timing of all module callbacks. Nothing is recorded unless enabled
+    is set
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.stats = {}
+
+    def record(self, module, kind, name, dt):
+        '''record a callback of module taking dt seconds'''
+        key = (module, kind, name)
+        stat = self.stats.get(key, None)
+        if stat is None:
+            stat = PerfStat()
+            self.stats[key] = stat
+        stat.add(dt)
+
+    def reset(self):
+        '''forget all timings'''
+        self.stats = {}
+
+    def by_module(self):
+        '''return a dictionary of module name to total PerfStat'''
+        ret = {}
+        for ((module, kind, name), stat) in self.stats.items():
+            if not module in ret:
+                ret[module] = PerfStat()
+            ret[module].merge(stat)
+        return ret
+
+    def by_type(self):
+        '''return a dictionary of message type to total PerfStat, over all modules'''
+        ret = {}
+        for ((module, kind, name), stat) in self.stats.items():
+            if kind != 'packet':
+                continue
+            if not name in ret:
+                ret[name] = PerfStat()
+            ret[name].merge(stat)
+        return ret
+
+    def for_module(self, module):
+        '''return a dictionary of (kind, name) to PerfStat for one module'''
+        ret = {}
+        for ((mod, kind, name), stat) in self.stats.items():
+            if mod == module:
+                ret[(kind, name)] = stat
+        return ret
+
+def format_table(stats, sort='time', hist=False):
+    '''format a dictionary of name to PerfStat as lines of text'''
+    key = sort_keys.get(sort, sort_keys['time'])
+    lines = ['%-32s %9s %10s %10s %10s' % ('name', 'calls', 'total(s)', 'mean(us)', 'max(us)')]
+    for (name, stat) in sorted(stats.items(), key=lambda x: key(x[1]), reverse=True):
+        if isinstance(name, tuple):
+            name = '%s %s' % name
+        lines.append('%-32s %9u %10.3f %10.1f %10.1f' % (name, stat.count, stat.total,
+                                                         stat.mean()*1.0e6, stat.max*1.0e6))
+        if hist:
+            lines.append('    %s' % stat.hist_str())
+    return lines
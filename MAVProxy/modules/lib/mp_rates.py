@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+'''
+message rate statistics for MAVProxy
+
+each stream of messages, keyed by link, source system and message
+type, keeps an exponentially weighted moving average of its
+inter-arrival interval, and of the jitter, the mean deviation of each
+interval from that average, with the gain RFC 3550 uses. An update is
+a dictionary lookup and a few float operations, so it can be done for
+every packet
+'''
+
+import fnmatch, time
+
+# weight of each new interval in the averages
+GAIN = 1.0/16
+
+class RateStat(object):
+    '''arrival statistics of one stream of messages'''
+    __slots__ = ('count', 'last', 'interval', 'jitter')
+
+    def __init__(self):
+        self.count = 0
+        self.last = None
+        self.interval = None
+        self.jitter = 0.0
+
+    def update(self, now):
+        '''add a message arriving at time now'''
+        last = self.last
+        if last is not None:
+            dt = now - last
+            interval = self.interval
+            if interval is None:
+                self.interval = dt
+            else:
+                self.jitter += GAIN * (abs(dt - interval) - self.jitter)
+                self.interval = interval + GAIN * (dt - interval)
+        self.last = now
+        self.count += 1
+
+    def age(self, now=None):
+        '''seconds since the last message'''
+        if now is None:
+            now = time.time()
+        return now - self.last
+
+    def rate(self, now=None):
+        '''messages per second. Once the stream stops the rate falls with
+        the time since the last message'''
+        if self.interval is None:
+            return 0.0
+        return 1.0 / max(self.interval, self.age(now), 1.0e-6)
+
+class RateTracker(object):
+    '''
+    rates of the messages received, per (link, sysid, mtype). Links are
+    numbered from 0
+    '''
+    def __init__(self):
+        self.streams = {}
+
+    def update(self, link, sysid, mtype, now):
+        '''add a message'''
+        key = (link, sysid, mtype)
+        stat = self.streams.get(key, None)
+        if stat is None:
+            stat = self.streams[key] = RateStat()
+        stat.update(now)
+
+    def reset(self):
+        '''forget all streams'''
+        self.streams = {}
+
+    def find(self, mtype=None, link=None, sysid=None):
+        '''return a sorted list of ((link, sysid, mtype), RateStat) of
+        the streams matching the arguments given'''
+        ret = []
+        for (key, stat) in self.streams.items():
+            if ((link is None or key[0] == link) and
+                (sysid is None or key[1] == sysid) and
+                (mtype is None or key[2] == mtype)):
+                ret.append((key, stat))
+        return sorted(ret)
+
+    def rate(self, mtype, link=None, sysid=None, now=None):
+        '''total messages per second of a type, from all matching streams'''
+        if now is None:
+            now = time.time()
+        return sum([stat.rate(now) for (key, stat) in self.find(mtype, link, sysid)])
+
+    def age(self, mtype, link=None, sysid=None, now=None):
+        '''seconds since a message of a type arrived, or None if none has'''
+        if now is None:
+            now = time.time()
+        ages = [stat.age(now) for (key, stat) in self.find(mtype, link, sysid)]
+        if len(ages) == 0:
+            return None
+        return min(ages)
+
+    def show(self, f, pattern=None):
+        '''write a table of the streams with types matching a pattern'''
+        now = time.time()
+        f.write('%4s %4s %-28s %9s %10s %9s %8s %8s\n' % (
+            'Link', 'Sys', 'Type', 'Rate', 'Interval', 'Jitter', 'Age', 'Count'))
+        for ((link, sysid, mtype), stat) in self.find():
+            if pattern is not None and not fnmatch.fnmatch(mtype.upper(), pattern.upper()):
+                continue
+            interval = stat.interval if stat.interval is not None else 0.0
+            f.write('%4u %4u %-28s %7.2f/s %8.1fms %7.1fms %7.2fs %8u\n' % (
+                link+1, sysid, mtype, stat.rate(now), interval*1000,
+                stat.jitter*1000, stat.age(now), stat.count))
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+'''
+replay of a tlog as a MAVLink master
+
+--master=replay:flight.tlog feeds a recorded log into MAVProxy as if it
+came from a live vehicle, paced by the log timestamps. Each link
+recorded in the bottom 2 bits of the timestamps becomes a master link,
+so multi-link logs replay with their original link numbers. Packets
+MAVProxy sent to the vehicle are skipped
+'''
+
+import time
+from collections import deque
+from pymavlink import mavutil
+from MAVProxy.modules.lib import mp_tlog
+
+# gaps in the log longer than this many seconds are skipped
+MAX_GAP = 5.0
+# a seek point is kept every this many seconds of log time
+INDEX_INTERVAL = 1.0
+# stop reading ahead when this many bytes are waiting for the links
+MAX_QUEUED = 65536
+
+def parse_speed(s):
+    '''parse a replay speed, a factor like 10 or 10x, or max for as fast as possible'''
+    s = s.lower()
+    if s == 'max':
+        return None
+    if s.endswith('x'):
+        s = s[:-1]
+    speed = float(s)
+    if speed <= 0:
+        raise ValueError('bad replay speed %s' % s)
+    return speed
+
+def speed_str(speed):
+    '''format a replay speed'''
+    if speed is None:
+        return 'max'
+    return '%gx' % speed
+
+class ReplaySource(object):
+    '''
+    a tlog being replayed. The records are released to the links as
+    the replay clock reaches their timestamps. A speed of None replays
+    as fast as MAVProxy can take the data
+    '''
+    def __init__(self, filename, speed=1.0, merge=False, paused=False):
+        self.filename = filename
+        self.f = mp_tlog.open_log(filename)
+        self.reader = mp_tlog.TlogReader(self.f)
+        self.merge = merge
+        self.scan()
+        self.speed = speed
+        self.paused = paused
+        self.finished = False
+        self.next_record = None
+        self.last_usec = self.start_usec
+        self.log_base = self.start_usec
+        self.wall_base = time.time()
+        self.queues = {}
+        self.queued = {}
+        for link in self.links:
+            self.queues[link] = deque()
+            self.queued[link] = 0
+        self.queued_total = 0
+        self.played = 0
+
+    def scan(self):
+        '''find the links, length and seek points of the log'''
+        self.index = []
+        self.link_counts = {}
+        self.start_usec = None
+        self.end_usec = None
+        self.count = 0
+        next_index = None
+        while True:
+            offset = self.reader.tell()
+            r = self.reader.next()
+            if r is None:
+                break
+            usec = r[0]
+            link = mp_tlog.timestamp_link(usec)
+            self.link_counts[link] = self.link_counts.get(link, 0) + 1
+            self.count += 1
+            if self.start_usec is None:
+                self.start_usec = usec
+                self.end_usec = usec
+            if next_index is None or usec >= next_index:
+                self.index.append((usec, offset))
+                next_index = usec + INDEX_INTERVAL * 1.0e6
+            if usec > self.end_usec:
+                self.end_usec = usec
+        if self.count == 0:
+            raise ValueError('no MAVLink packets in %s' % self.filename)
+        self.sent = self.link_counts.pop(mp_tlog.SENT_LINK, 0)
+        if self.merge or len(self.link_counts) == 0:
+            self.links = [0]
+        else:
+            self.links = sorted(self.link_counts.keys())
+        self.reader.seek(0)
+
+    def make_links(self):
+        '''return a ReplayLink for each link in the log'''
+        return [ReplayLink(self, link) for link in self.links]
+
+    def log_time(self, now):
+        '''the replay clock, in log microseconds'''
+        if self.paused:
+            return self.log_base
+        if self.speed is None:
+            return float('inf')
+        return self.log_base + (now - self.wall_base) * 1.0e6 * self.speed
+
+    def rebase(self, usec, now):
+        '''make the replay clock read usec at time now'''
+        self.log_base = usec
+        self.wall_base = now
+
+    def fill(self, now, link):
+        '''queue the records that are due for the links. Reading goes on
+        past MAX_QUEUED until there is data for the link asking, so one
+        link waiting on another can't stop the replay'''
+        if self.paused or self.finished:
+            return
+        t = self.log_time(now)
+        while self.queued_total < MAX_QUEUED or self.queued[link] == 0:
+            r = self.next_record
+            if r is None:
+                r = self.reader.next()
+                if r is None:
+                    self.finished = True
+                    break
+            (usec, pkt) = r
+            if abs(usec - self.last_usec) > MAX_GAP * 1.0e6:
+                # a long pause in the recording, or the clock jumped
+                self.rebase(usec, now)
+                t = self.log_time(now)
+            if usec > t:
+                self.next_record = r
+                break
+            self.next_record = None
+            self.last_usec = usec
+            dest = mp_tlog.timestamp_link(usec)
+            if dest == mp_tlog.SENT_LINK:
+                continue
+            if self.merge:
+                dest = 0
+            self.queues[dest].append(pkt)
+            self.queued[dest] += len(pkt)
+            self.queued_total += len(pkt)
+            self.played += 1
+
+    def take(self, link, n):
+        '''remove and return up to n bytes of whole packets queued for a link'''
+        q = self.queues[link]
+        ret = []
+        size = 0
+        while q and (size == 0 or size + len(q[0]) <= n):
+            pkt = q.popleft()
+            ret.append(pkt)
+            size += len(pkt)
+        self.queued[link] -= size
+        self.queued_total -= size
+        return ''.join(ret)
+
+    def position(self):
+        '''seconds from the start of the log of the last packet replayed'''
+        return (self.last_usec - self.start_usec) * 1.0e-6
+
+    def duration(self):
+        '''length of the log in seconds'''
+        return (self.end_usec - self.start_usec) * 1.0e-6
+
+    def set_speed(self, speed, now=None):
+        '''change the replay speed, None for as fast as possible'''
+        if now is None:
+            now = time.time()
+        self.rebase(self.last_usec, now)
+        self.speed = speed
+
+    def pause(self):
+        '''stop replaying'''
+        self.rebase(self.last_usec, time.time())
+        self.paused = True
+
+    def resume(self, now=None):
+        '''continue replaying after a pause'''
+        if now is None:
+            now = time.time()
+        self.rebase(self.last_usec, now)
+        self.paused = False
+
+    def seek(self, seconds, now=None):
+        '''continue the replay from seconds after the start of the log'''
+        if now is None:
+            now = time.time()
+        target = self.start_usec + int(max(seconds, 0) * 1.0e6)
+        offset = 0
+        for (usec, ofs) in self.index:
+            if usec > target:
+                break
+            offset = ofs
+        self.reader.seek(offset)
+        self.next_record = None
+        while True:
+            r = self.reader.next()
+            if r is None or r[0] >= target:
+                self.next_record = r
+                break
+        self.finished = self.next_record is None
+        # drop queued packets, the links finish any packet they have started
+        for link in self.links:
+            self.queues[link].clear()
+            self.queued[link] = 0
+        self.queued_total = 0
+        self.last_usec = min(target, self.end_usec)
+        self.rebase(self.last_usec, now)
+
+    def close(self):
+        '''close the log'''
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def __str__(self):
+        if self.finished:
+            state = 'finished'
+        elif self.paused:
+            state = 'paused'
+        else:
+            state = 'playing'
+        return '%s %s %.1f/%.1fs speed %s, %u/%u packets, links %s' % (
+            self.filename, state, self.position(), self.duration(), speed_str(self.speed),
+            self.played, self.count - self.sent, ','.join(['%u' % (l+1) for l in self.links]))
+
+class ReplayLink(mavutil.mavfile):
+    '''
+    one recorded link of a ReplaySource, used as a master link. It has
+    no file descriptor, so the main loop polls it with port.inWaiting()
+    like a serial port without one. Data sent to it is discarded
+    '''
+    def __init__(self, source, link):
+        mavutil.mavfile.__init__(self, None, 'replay:%s' % source.filename)
+        self.source = source
+        self.link = link
+        self.port = self
+        self.autoreconnect = False
+        # the rest of a packet that didn't fit in the last recv()
+        self.pending = ''
+        self.written = 0
+
+    def inWaiting(self):
+        '''return the number of bytes ready to be read'''
+        self.source.fill(time.time(), self.link)
+        return len(self.pending) + self.source.queued[self.link]
+
+    def recv(self, n=None):
+        '''read the data that is due'''
+        if n is None:
+            n = 16*1024
+        if not self.pending:
+            self.source.fill(time.time(), self.link)
+            self.pending = self.source.take(self.link, n)
+        ret = self.pending[:n]
+        self.pending = self.pending[n:]
+        return ret
+
+    def wait_heartbeat(self, blocking=True):
+        '''wait for a heartbeat, unless the replay starts paused'''
+        if self.source.paused:
+            return None
+        return mavutil.mavfile.wait_heartbeat(self, blocking=blocking)
+
+    def write(self, buf):
+        '''discard data sent to the vehicle'''
+        self.written += len(buf)
+
+    def reset(self):
+        '''restart the replay from the beginning of the log'''
+        self.source.seek(0)
+
+    def close(self):
+        '''close the log'''
+        self.source.close()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+'''
+shared memory ring buffer of frames
+
+one process writes length prefixed frames and other processes read
+them, without any system calls on either side. The writer never
+waits: a reader that falls more than the ring size behind skips to
+the newest data and counts the overrun
+'''
+
+import struct
+from multiprocessing.sharedctypes import RawArray
+
+# the header holds the total bytes ever written
+HEADER_SIZE = 8
+head_struct = struct.Struct('<Q')
+length_struct = struct.Struct('<H')
+
+class SharedRing(object):
+    '''
+    a ring of frames in shared memory. Create it before starting the
+    reader processes and pass it to them. Frames must be under 64k
+    '''
+    def __init__(self, size=1<<20):
+        self.size = size
+        self.buf = RawArray('c', HEADER_SIZE + size)
+        self.view = memoryview(self.buf)
+        # writer state, kept locally so the writer never reads shared memory
+        self.head = 0
+        self.frames = 0
+
+    def __getstate__(self):
+        # memoryviews can't be pickled, the shared array can
+        state = self.__dict__.copy()
+        del state['view']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.view = memoryview(self.buf)
+
+    def _copy_in(self, pos, data):
+        '''copy data into the ring at a position, wrapping at the end'''
+        ofs = pos % self.size
+        n = len(data)
+        if ofs + n <= self.size:
+            self.view[HEADER_SIZE+ofs:HEADER_SIZE+ofs+n] = data
+        else:
+            split = self.size - ofs
+            self.view[HEADER_SIZE+ofs:HEADER_SIZE+self.size] = data[:split]
+            self.view[HEADER_SIZE:HEADER_SIZE+n-split] = data[split:]
+
+    def write(self, frame):
+        '''add a frame to the ring'''
+        self._copy_in(self.head, length_struct.pack(len(frame)) + frame)
+        self.head += length_struct.size + len(frame)
+        self.frames += 1
+        # publish the frame once it is complete
+        head_struct.pack_into(self.buf, 0, self.head)
+
+    def reader(self):
+        '''return a reader starting at the newest data'''
+        return RingReader(self)
+
+class RingReader(object):
+    '''reads the frames of a SharedRing in another process'''
+    def __init__(self, ring):
+        self.ring = ring
+        self.tail = self.head()
+        self.frames = 0
+        # times the reader fell a whole ring behind and skipped ahead
+        self.overruns = 0
+
+    def head(self):
+        '''total bytes written to the ring'''
+        return head_struct.unpack_from(self.ring.buf, 0)[0]
+
+    def _copy_out(self, pos, n):
+        '''copy n bytes out of the ring at a position'''
+        ring = self.ring
+        ofs = pos % ring.size
+        if ofs + n <= ring.size:
+            return ring.view[HEADER_SIZE+ofs:HEADER_SIZE+ofs+n].tobytes()
+        split = ring.size - ofs
+        return (ring.view[HEADER_SIZE+ofs:HEADER_SIZE+ring.size].tobytes() +
+                ring.view[HEADER_SIZE:HEADER_SIZE+n-split].tobytes())
+
+    def read(self, max_frames=None):
+        '''return a list of the frames written since the last read'''
+        ret = []
+        start = self.tail
+        head = self.head()
+        if head - start > self.ring.size:
+            # we've been lapped, skip to the newest data
+            self.overruns += 1
+            self.tail = head
+            return ret
+        while self.tail < head:
+            if max_frames is not None and len(ret) >= max_frames:
+                break
+            (n,) = length_struct.unpack(self._copy_out(self.tail, length_struct.size))
+            ret.append(self._copy_out(self.tail + length_struct.size, n))
+            self.tail += length_struct.size + n
+        if self.head() - start > self.ring.size:
+            # the writer overwrote frames while they were being copied
+            self.overruns += 1
+            self.tail = self.head()
+            return []
+        self.frames += len(ret)
+        return ret
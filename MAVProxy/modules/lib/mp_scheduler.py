@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+'''
+timer scheduler for MAVProxy modules
+
+timers are kept in a heap ordered by deadline, so each pass of the
+main loop only looks at the timers that are due rather than calling
+every module
+'''
+
+import heapq, time, itertools
+
+class Timer(object):
+    '''a scheduled callback, either one-shot or periodic'''
+    __slots__ = ['when', 'period', 'callback', 'args', 'owner', 'cancelled', 'scheduler']
+
+    def __init__(self, scheduler, when, period, callback, args, owner):
+        self.scheduler = scheduler
+        self.when = when
+        self.period = period
+        self.callback = callback
+        self.args = args
+        self.owner = owner
+        self.cancelled = False
+
+    def cancel(self):
+        '''stop the timer'''
+        self.cancelled = True
+
+    def set_deadline(self, when):
+        '''move the next call to time when'''
+        self.cancelled = False
+        self.scheduler.schedule(self, when)
+
+    def set_period(self, period):
+        '''change the period, taking effect from the next call'''
+        self.period = period
+
+class MPScheduler(object):
+    '''
+    a heap of timers. run_due() calls everything that is due, and
+    next_deadline() gives the time of the next call
+    '''
+    def __init__(self, exception_handler=None, perf=None):
+        self.heap = []
+        self.perf = perf
+        self.counter = itertools.count()
+        self.exception_handler = exception_handler
+        # set when a timer is scheduled before the previous first deadline
+        self.deadline_moved = False
+
+    def __len__(self):
+        return len(self.heap)
+
+    def schedule(self, timer, when):
+        '''(re)schedule a timer. Old heap entries are skipped when popped'''
+        timer.when = when
+        if not self.heap or when < self.heap[0][0]:
+            self.deadline_moved = True
+        heapq.heappush(self.heap, (when, next(self.counter), timer))
+
+    def add(self, period, callback, args=(), owner=None, when=None):
+        '''call callback(*args) every period seconds, first at time when. A
+        period of None makes a one-shot timer'''
+        if when is None:
+            when = time.time() + (period or 0)
+        timer = Timer(self, when, period, callback, args, owner)
+        self.schedule(timer, when)
+        return timer
+
+    def remove_owner(self, owner):
+        '''cancel all timers belonging to owner'''
+        for (when, count, timer) in self.heap:
+            if timer.owner is owner:
+                timer.cancel()
+
+    def next_deadline(self):
+        '''return the time the next timer is due, or None if there are no timers'''
+        heap = self.heap
+        while heap:
+            (when, count, timer) = heap[0]
+            if not timer.cancelled and when == timer.when:
+                return when
+            heapq.heappop(heap)
+        return None
+
+    def run_due(self, now=None):
+        '''call all timers that are due'''
+        if now is None:
+            now = time.time()
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            (when, count, timer) = heapq.heappop(heap)
+            if timer.cancelled or when != timer.when:
+                continue
+            if timer.period is None:
+                timer.cancelled = True
+            else:
+                # don't try to catch up on missed calls
+                next_when = when + timer.period
+                if next_when <= now:
+                    next_when = now + timer.period
+                self.schedule(timer, next_when)
+            try:
+                if self.perf is not None and self.perf.enabled:
+                    t0 = time.time()
+                    timer.callback(*timer.args)
+                    self.perf.record(getattr(timer.owner, 'name', 'core'), 'timer',
+                                     getattr(timer.callback, '__name__', 'timer'), time.time() - t0)
+                else:
+                    timer.callback(*timer.args)
+            except Exception as e:
+                if self.exception_handler is not None:
+                    self.exception_handler(e)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+'''
+file descriptor registry for the MAVProxy main loop
+
+file descriptors are registered once along with the function to call
+when they are readable or writable. Uses epoll or poll where
+available, falling back to select
+'''
+
+import select, errno, os, math
+
+# fcntl is not available on windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+class MPSelect(object):
+    '''
+    a set of file descriptors to wait on, each with a handler
+    '''
+    def __init__(self):
+        self.handlers = {}
+        self.writers = {}
+        self.masks = {}
+        if hasattr(select, 'epoll'):
+            self.backend = 'epoll'
+            self.poller = select.epoll()
+            self.IN = select.EPOLLIN
+            self.OUT = select.EPOLLOUT
+            self.ERR = select.EPOLLERR | select.EPOLLHUP
+        elif hasattr(select, 'poll'):
+            self.backend = 'poll'
+            self.poller = select.poll()
+            self.IN = select.POLLIN
+            self.OUT = select.POLLOUT
+            self.ERR = select.POLLERR | select.POLLHUP
+        else:
+            self.backend = 'select'
+            self.poller = None
+
+    def __len__(self):
+        return len(self.handlers) + len(self.writers)
+
+    def _update(self, fd):
+        '''update the poller for a change in what fd is waited on for'''
+        if self.poller is None:
+            return
+        mask = 0
+        if fd in self.handlers:
+            mask |= self.IN
+        if fd in self.writers:
+            mask |= self.OUT
+        old = self.masks.get(fd, 0)
+        if mask == old:
+            return
+        if mask == 0:
+            self.masks.pop(fd)
+            try:
+                self.poller.unregister(fd)
+            except Exception:
+                # the fd may already have been closed
+                pass
+            return
+        self.masks[fd] = mask
+        try:
+            if old != 0:
+                self.poller.modify(fd, mask)
+            else:
+                self.poller.register(fd, mask)
+        except IOError as e:
+            # the fd may have been closed and reopened since it was registered
+            if e.errno == errno.EEXIST:
+                self.poller.modify(fd, mask)
+            elif e.errno == errno.ENOENT:
+                self.poller.register(fd, mask)
+            else:
+                raise
+
+    def register(self, fd, fn, args):
+        '''register a file descriptor, calling fn(args) when it is readable'''
+        if fd in self.handlers:
+            self.unregister(fd)
+        self.handlers[fd] = (fn, args)
+        self._update(fd)
+
+    def unregister(self, fd):
+        '''stop waiting for a file descriptor to be readable'''
+        if not fd in self.handlers:
+            return
+        self.handlers.pop(fd)
+        self._update(fd)
+
+    def register_writer(self, fd, fn, args):
+        '''call fn(args) when fd is writable'''
+        self.writers[fd] = (fn, args)
+        self._update(fd)
+
+    def unregister_writer(self, fd):
+        '''stop waiting for a file descriptor to be writable'''
+        if not fd in self.writers:
+            return
+        self.writers.pop(fd)
+        self._update(fd)
+
+    def handler(self, fd):
+        '''return the (fn, args) for a readable fd, or None if it has been removed'''
+        return self.handlers.get(fd, None)
+
+    def writer(self, fd):
+        '''return the (fn, args) for a writable fd, or None if it has been removed'''
+        return self.writers.get(fd, None)
+
+    def select(self, timeout):
+        '''wait up to timeout seconds, returning lists of readable and writable fds'''
+        try:
+            if self.backend == 'select':
+                (rin, win, xin) = select.select(self.handlers.keys(), self.writers.keys(), [], timeout)
+                return (rin, win)
+            # poll timeouts are in whole milliseconds. Round up, so we
+            # don't spin with a zero timeout while waiting for a deadline
+            msec = int(math.ceil(timeout*1000))
+            if self.backend == 'epoll':
+                events = self.poller.poll(msec*0.001)
+            else:
+                events = self.poller.poll(msec)
+        except (select.error, IOError, OSError):
+            # interrupted system call
+            return ([], [])
+        rin = []
+        win = []
+        for (fd, event) in events:
+            if event & (self.IN | self.ERR):
+                rin.append(fd)
+            if event & (self.OUT | self.ERR) and fd in self.writers:
+                win.append(fd)
+        return (rin, win)
+
+class MPSelectDict(dict):
+    '''
+    a dictionary of fd -> (fn, args), as used for select_extra, which
+    keeps a MPSelect registration in sync with its contents. The
+    handler is called with the fd when it is readable
+    '''
+    def __init__(self, selector, handler):
+        dict.__init__(self)
+        self.selector = selector
+        self.handler = handler
+
+    def __setitem__(self, fd, value):
+        dict.__setitem__(self, fd, value)
+        self.selector.register(fd, self.handler, fd)
+
+    def __delitem__(self, fd):
+        dict.__delitem__(self, fd)
+        self.selector.unregister(fd)
+
+    def pop(self, fd, *default):
+        self.selector.unregister(fd)
+        return dict.pop(self, fd, *default)
+
+class MPWakeup(object):
+    '''
+    a pipe registered with a MPSelect, used by other threads to wake
+    the main loop. Where pipes can't be used (windows) wake() does
+    nothing, and available is False
+    '''
+    def __init__(self, selector, handler=None):
+        self.handler = handler
+        self.rfd = None
+        self.wfd = None
+        self.available = False
+        if fcntl is None:
+            return
+        (self.rfd, self.wfd) = os.pipe()
+        for fd in [self.rfd, self.wfd]:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        selector.register(self.rfd, self.read, None)
+        self.available = True
+
+    def wake(self):
+        '''wake the main loop. Safe to call from any thread'''
+        if self.wfd is None:
+            return
+        try:
+            os.write(self.wfd, b'x')
+        except OSError:
+            # the pipe is full, so a wakeup is already pending
+            pass
+
+    def read(self, args):
+        '''empty the pipe and call the handler'''
+        try:
+            os.read(self.rfd, 4096)
+        except OSError:
+            pass
+        if self.handler is not None:
+            self.handler()
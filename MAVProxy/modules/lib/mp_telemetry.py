@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+'''
+shared memory telemetry for GUI child processes
+
+the main process writes each MAVLink message it receives into one
+SharedRing as a raw frame. GUI children read the ring with a
+TelemetryView at their own frame rate, decoding only the newest
+message of each type, instead of the main process pickling and
+sending them objects for every packet
+'''
+
+from pymavlink import mavutil
+from MAVProxy.modules.lib import mp_ring
+from MAVProxy.modules.lib import mp_tlog
+
+# size of the telemetry ring. A child reading at 5Hz can fall this far
+# behind before it skips ahead
+RING_SIZE = 1<<21
+
+MAV_TYPE_GCS = 6
+
+def create_ring():
+    '''create the telemetry ring'''
+    return mp_ring.SharedRing(RING_SIZE)
+
+def frame_header(buf):
+    '''return the (msgid, sysid, compid) of a raw MAVLink frame'''
+    if ord(buf[0]) == mp_tlog.MAGIC_V2:
+        return (ord(buf[7]) | (ord(buf[8])<<8) | (ord(buf[9])<<16), ord(buf[5]), ord(buf[6]))
+    return (ord(buf[5]), ord(buf[3]), ord(buf[4]))
+
+def gcs_heartbeat(buf):
+    '''return True if a HEARTBEAT frame is from a ground station'''
+    if ord(buf[0]) == mp_tlog.MAGIC_V2:
+        return ord(buf[14]) == MAV_TYPE_GCS
+    return ord(buf[10]) == MAV_TYPE_GCS
+
+class TelemetryView(object):
+    '''
+    the newest messages in a telemetry ring, as seen by a child
+    process. Create it in the child. Messages are decoded when they are
+    asked for, and then only once
+    '''
+    def __init__(self, ring):
+        self.reader = ring.reader()
+        self.mav = None
+        # newest frame of each (msgid, sysid)
+        self.frames = {}
+        # newest frame of each msgid from any system, leaving out ground
+        # station heartbeats as mavfile.messages does
+        self.latest = {}
+        # key -> (frame, message)
+        self.decoded = {}
+
+    def update(self):
+        '''take in the frames written since the last update, returning how many there were'''
+        frames = self.reader.read()
+        for buf in frames:
+            (msgid, sysid, compid) = frame_header(buf)
+            self.frames[(msgid, sysid)] = buf
+            if msgid == 0 and gcs_heartbeat(buf):
+                continue
+            self.latest[msgid] = buf
+        return len(frames)
+
+    def decode(self, key, buf):
+        '''decode a frame, reusing the message if it was decoded before'''
+        d = self.decoded.get(key, None)
+        if d is not None and d[0] is buf:
+            return d[1]
+        if self.mav is None:
+            self.mav = mavutil.mavlink.MAVLink(None)
+        try:
+            m = self.mav.decode(bytearray(buf))
+        except mavutil.mavlink.MAVError:
+            m = None
+        self.decoded[key] = (buf, m)
+        return m
+
+    def message(self, mtype, sysid=None):
+        '''return the newest message of a type, from a system if sysid is
+        given, or None if there hasn't been one'''
+        msgid = getattr(mavutil.mavlink, 'MAVLINK_MSG_ID_' + mtype, None)
+        if sysid is None:
+            key = msgid
+            buf = self.latest.get(msgid, None)
+        else:
+            key = (msgid, sysid)
+            buf = self.frames.get(key, None)
+        if buf is None:
+            return None
+        return self.decode(key, buf)
+
+    def messages(self):
+        '''return a dictionary of the newest message of each type, like mavfile.messages'''
+        ret = {}
+        for (msgid, buf) in self.latest.items():
+            m = self.decode(msgid, buf)
+            if m is not None:
+                ret[m.get_type()] = m
+        return ret
@@ -0,0 +1,495 @@
+#!/usr/bin/env python
+'''
+reading of MAVProxy telemetry logs
+
+a tlog is a sequence of records, each an 8 byte big endian timestamp in
+microseconds followed by one MAVLink packet. MAVProxy puts the number
+of the link the packet arrived on in the bottom 2 bits of the
+timestamp, and 3 for packets it sent
+
+logs written with compression are gzip or zstd streams, possibly cut
+short by a crash. open_log() reads them like a plain log
+
+a log can have a sidecar index, the log name with .idx added. It is a
+sequence of chunks, each covering about a second of the log: the
+timestamp and offset of its first record, then the offsets of the
+records of each message type within it. Offsets are into the
+decompressed log. Chunks are written as the log grows, so a crash only
+loses the last one, and readers scan whatever the index doesn't cover
+'''
+
+import array, bisect, os, re, struct, sys, zlib
+
+# packet start markers
+MAGIC_V09 = 0x55
+MAGIC_V1 = 0xFE
+MAGIC_V2 = 0xFD
+
+def packet_length(buf, ofs):
+    '''return the length of the MAVLink packet at buf[ofs:], None if the
+    header is incomplete, or 0 if there is no packet start there'''
+    if len(buf) - ofs < 3:
+        return None
+    magic = ord(buf[ofs])
+    if magic == MAGIC_V1 or magic == MAGIC_V09:
+        return ord(buf[ofs+1]) + 8
+    if magic == MAGIC_V2:
+        length = ord(buf[ofs+1]) + 12
+        if ord(buf[ofs+2]) & 1:
+            # signed packet
+            length += 13
+        return length
+    return 0
+
+def packet_msgid(buf, ofs):
+    '''return the message id of the MAVLink packet at buf[ofs:]'''
+    if ord(buf[ofs]) == MAGIC_V2:
+        return ord(buf[ofs+7]) | (ord(buf[ofs+8])<<8) | (ord(buf[ofs+9])<<16)
+    return ord(buf[ofs+5])
+
+# link number of packets MAVProxy sent to the vehicle
+SENT_LINK = 3
+
+def timestamp_link(usec):
+    '''the link number held in a tlog timestamp'''
+    return usec & 3
+
+class TlogReader(object):
+    '''
+    reads the records of a tlog in order. Data that isn't a valid
+    record is skipped until one is found again
+    '''
+    def __init__(self, f, offset=0, blocksize=65536):
+        self.f = f
+        self.blocksize = blocksize
+        self.seek(offset)
+
+    def seek(self, offset):
+        '''continue reading at a file offset, which must be the start of a record'''
+        self.f.seek(offset)
+        self.buf = ''
+        self.ofs = 0
+        # file offset of buf[0]
+        self.base = offset
+        self.eof = False
+        self.skipped = 0
+
+    def tell(self):
+        '''file offset of the next record'''
+        return self.base + self.ofs
+
+    def _fill(self):
+        '''read another block, returning False at the end of the file'''
+        if self.eof:
+            return False
+        data = self.f.read(self.blocksize)
+        if not data:
+            self.eof = True
+            return False
+        self.base += self.ofs
+        self.buf = self.buf[self.ofs:] + data
+        self.ofs = 0
+        return True
+
+    def next(self):
+        '''return the next (usec, packet) record, or None at the end of the file'''
+        while True:
+            length = packet_length(self.buf, self.ofs + 8)
+            if length is None or self.ofs + 8 + length > len(self.buf):
+                if not self._fill():
+                    return None
+                continue
+            if length == 0:
+                self.ofs += 1
+                self.skipped += 1
+                continue
+            (usec,) = struct.unpack_from('>Q', self.buf, self.ofs)
+            start = self.ofs + 8
+            self.ofs = start + length
+            return (usec, self.buf[start:self.ofs])
+
+    def __iter__(self):
+        while True:
+            r = self.next()
+            if r is None:
+                return
+            yield r
+
+# start of the compressed formats
+GZIP_MAGIC = '\x1f\x8b'
+ZSTD_MAGIC = '\x28\xb5\x2f\xfd'
+
+def compression(f):
+    '''return 'gzip' or 'zstd' for a compressed file, or None'''
+    pos = f.tell()
+    magic = f.read(4)
+    f.seek(pos)
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic == ZSTD_MAGIC:
+        return 'zstd'
+    return None
+
+class DecompressedFile(object):
+    '''
+    a read only file of the data in a compressed log. Seeking backwards
+    decompresses again from the start. Data after a damaged or
+    truncated part is not read
+    '''
+    def __init__(self, f, method):
+        self.f = f
+        self.method = method
+        if method == 'zstd':
+            import zstandard
+            self.zstd = zstandard
+            self.errors = (zstandard.ZstdError,)
+        else:
+            self.errors = (zlib.error,)
+        self.rewind()
+
+    def decompressor(self):
+        '''a decompressor for one gzip member or zstd frame'''
+        if self.method == 'zstd':
+            return self.zstd.ZstdDecompressor().decompressobj()
+        return zlib.decompressobj(16+zlib.MAX_WBITS)
+
+    def rewind(self):
+        '''go back to the start'''
+        self.f.seek(0)
+        self.obj = self.decompressor()
+        self.buf = ''
+        self.ofs = 0
+        # decompressed offset of the next read
+        self.pos = 0
+        self.eof = False
+
+    def _decompress(self, data):
+        '''decompress some of the file, returning the data'''
+        ret = []
+        while data:
+            try:
+                ret.append(self.obj.decompress(data))
+            except self.errors:
+                self.eof = True
+                break
+            data = getattr(self.obj, 'unused_data', '')
+            if data:
+                # another stream follows, as when a log is appended to
+                self.obj = self.decompressor()
+        return ''.join(ret)
+
+    def _fill(self, n):
+        '''decompress until n bytes are waiting or the end is reached'''
+        while len(self.buf) - self.ofs < n and not self.eof:
+            data = self.f.read(65536)
+            if not data:
+                self.eof = True
+                break
+            self.buf = self.buf[self.ofs:] + self._decompress(data)
+            self.ofs = 0
+
+    def read(self, n=-1):
+        if n < 0:
+            n = 1<<62
+        self._fill(n)
+        ret = self.buf[self.ofs:self.ofs+n]
+        self.ofs += len(ret)
+        self.pos += len(ret)
+        return ret
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence != 0:
+            raise IOError('can only seek from the start of a compressed log')
+        if offset < self.pos:
+            self.rewind()
+        while self.pos < offset:
+            if not self.read(min(offset - self.pos, 1<<20)):
+                break
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.f.close()
+
+def open_log(filename):
+    '''open a log for reading, decompressing it if needed'''
+    f = open(filename, 'rb')
+    method = compression(f)
+    if method is None:
+        return f
+    return DecompressedFile(f, method)
+
+def mavlink_log(filename, **kwargs):
+    '''open a log as a pymavlink connection, decompressing it if needed'''
+    from pymavlink import mavutil
+    f = open(filename, 'rb')
+    method = compression(f)
+    f.close()
+    if method is None:
+        return mavutil.mavlink_connection(filename, **kwargs)
+    mlog = mavutil.mavlogfile(filename, **kwargs)
+    mlog.f.close()
+    mlog.f = open_log(filename)
+    # the decompressed size isn't known, so there is no percentage
+    mlog.filesize = 0
+    return mlog
+
+def log_segments(filename):
+    '''return the files of a log in order, given its name without segment
+    number or compression suffix, like flight.tlog'''
+    (dirname, base) = os.path.split(filename)
+    i = base.find('.')
+    if i == -1:
+        i = len(base)
+    pattern = re.compile(re.escape(base[:i]) + r'(\.(\d+))?' + re.escape(base[i:]) + r'(\.gz|\.zst)?$')
+    ret = []
+    for name in os.listdir(dirname or '.'):
+        m = pattern.match(name)
+        if m is None:
+            continue
+        # the unnumbered file comes first
+        segment = int(m.group(2)) if m.group(2) is not None else 0
+        ret.append((segment, os.path.join(dirname, name)))
+    return [path for (segment, path) in sorted(ret)]
+
+# index file name suffix and header
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = 'MPTLIDX1'
+# seconds of log between index chunks
+CHECKPOINT_INTERVAL = 1.0
+
+# chunk header: first usec, first offset, length, records, types
+chunk_struct = struct.Struct('<QQIII')
+# type header: msgid, records
+chunk_type_struct = struct.Struct('<II')
+
+def index_filename(filename):
+    '''the index file of a log'''
+    return filename + INDEX_SUFFIX
+
+def offset_array(typecode, data=''):
+    '''an array of little endian offsets'''
+    a = array.array(typecode)
+    a.fromstring(data)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a
+
+class TlogIndexWriter(object):
+    '''
+    writes the index of a log as its records are added. Records must be
+    added in log order
+    '''
+    def __init__(self, filename, append=False):
+        self.f = open(filename, 'ab' if append else 'wb')
+        if self.f.tell() == 0:
+            self.f.write(INDEX_MAGIC)
+        self.chunk_usec = None
+        self.chunk_offset = 0
+        self.chunk_end = 0
+        self.chunk_records = 0
+        self.chunk_types = {}
+
+    def add_record(self, offset, usec, msgid, length):
+        '''add a record of length bytes at a log offset'''
+        if (self.chunk_usec is None or usec < self.chunk_usec or
+            usec >= self.chunk_usec + CHECKPOINT_INTERVAL*1.0e6 or
+            offset - self.chunk_offset >= 0xFFFFFFFF - 0xFFFF):
+            self.write_chunk()
+            self.chunk_usec = usec
+            self.chunk_offset = offset
+        a = self.chunk_types.get(msgid, None)
+        if a is None:
+            a = self.chunk_types[msgid] = array.array('I')
+        a.append(offset - self.chunk_offset)
+        self.chunk_end = offset + length
+        self.chunk_records += 1
+
+    def add(self, data, offset):
+        '''add the records in a block of whole records written at a log offset'''
+        ofs = 0
+        n = len(data)
+        while ofs + 8 < n:
+            length = packet_length(data, ofs + 8)
+            if length is None or ofs + 8 + length > n:
+                break
+            if length == 0:
+                # not a record, as in a damaged log. Index what follows it
+                ofs += 1
+                continue
+            (usec,) = struct.unpack_from('>Q', data, ofs)
+            self.add_record(offset + ofs, usec, packet_msgid(data, ofs + 8), 8 + length)
+            ofs += 8 + length
+
+    def write_chunk(self):
+        '''write out the records added since the last chunk'''
+        if self.chunk_records == 0:
+            return
+        length = self.chunk_end - self.chunk_offset
+        typecode = 'H' if length <= 0xFFFF else 'I'
+        out = [chunk_struct.pack(self.chunk_usec, self.chunk_offset, length,
+                                 self.chunk_records, len(self.chunk_types))]
+        for (msgid, offsets) in sorted(self.chunk_types.items()):
+            a = offsets if typecode == 'I' else array.array('H', offsets)
+            if sys.byteorder == 'big':
+                a.byteswap()
+            out.append(chunk_type_struct.pack(msgid, len(a)))
+            out.append(a.tostring())
+        self.f.write(''.join(out))
+        self.chunk_records = 0
+        self.chunk_types = {}
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        '''write the last chunk and close the index'''
+        self.write_chunk()
+        self.f.close()
+
+class TlogIndex(object):
+    '''
+    the index of a log. Only the offsets of the message types asked for
+    are loaded. chunks is a list of (usec, offset, length, records) of
+    each chunk, in log order
+    '''
+    def __init__(self, filename, msgids=None):
+        data = open(filename, 'rb').read()
+        if not data.startswith(INDEX_MAGIC):
+            raise ValueError('%s is not a log index' % filename)
+        self.chunks = []
+        # msgid -> list of offsets
+        self.offsets = {}
+        # log offset up to which the index is complete
+        self.end = 0
+        pos = len(INDEX_MAGIC)
+        while pos + chunk_struct.size <= len(data):
+            (usec, offset, length, records, ntypes) = chunk_struct.unpack_from(data, pos)
+            typecode = 'H' if length <= 0xFFFF else 'I'
+            size = array.array(typecode).itemsize
+            p = pos + chunk_struct.size
+            types = []
+            for i in range(ntypes):
+                if p + chunk_type_struct.size > len(data):
+                    break
+                (msgid, n) = chunk_type_struct.unpack_from(data, p)
+                p += chunk_type_struct.size
+                types.append((msgid, p, n))
+                p += n * size
+            if len(types) != ntypes or p > len(data):
+                # cut short by a crash
+                break
+            for (msgid, start, n) in types:
+                if msgids is not None and msgid not in msgids:
+                    continue
+                a = offset_array(typecode, data[start:start+n*size])
+                self.offsets.setdefault(msgid, []).extend([offset + x for x in a])
+            self.chunks.append((usec, offset, length, records))
+            self.end = offset + length
+            pos = p
+
+    def clip(self, size):
+        '''forget anything past the first size bytes of the log, which the
+        index can be ahead of after a crash'''
+        while self.chunks and self.chunks[-1][1] + self.chunks[-1][2] > size:
+            self.chunks.pop()
+        self.end = 0
+        if self.chunks:
+            self.end = self.chunks[-1][1] + self.chunks[-1][2]
+        for msgid in self.offsets:
+            a = self.offsets[msgid]
+            del a[bisect.bisect_left(a, self.end):]
+
+    def records(self):
+        '''number of records indexed'''
+        return sum([c[3] for c in self.chunks])
+
+    def seek_offset(self, usec):
+        '''offset of the last checkpoint at or before a log timestamp'''
+        ret = 0
+        for (cusec, offset, length, records) in self.chunks:
+            if cusec > usec:
+                break
+            ret = offset
+        return ret
+
+    def find(self, msgids, start_usec=None, end_usec=None):
+        '''return the sorted offsets of the records of some message ids,
+        within a time window to the nearest checkpoint'''
+        ret = []
+        for msgid in msgids:
+            ret.extend(self.offsets.get(msgid, []))
+        ret.sort()
+        if start_usec is not None:
+            del ret[:bisect.bisect_left(ret, self.seek_offset(start_usec))]
+        if end_usec is not None:
+            end = self.end
+            for (usec, offset, length, records) in self.chunks:
+                if usec > end_usec:
+                    end = offset
+                    break
+            del ret[bisect.bisect_left(ret, end):]
+        return ret
+
+def load_index(filename, msgids=None):
+    '''load the index of a log, or return None if it has none'''
+    try:
+        index = TlogIndex(index_filename(filename), msgids)
+    except (IOError, ValueError):
+        return None
+    f = open(filename, 'rb')
+    if compression(f) is None:
+        index.clip(os.path.getsize(filename))
+    f.close()
+    return index
+
+def index_log(filename):
+    '''write the index of a log, returning the number of records'''
+    f = open_log(filename)
+    reader = TlogReader(f)
+    index = TlogIndexWriter(index_filename(filename))
+    count = 0
+    while True:
+        offset = reader.tell()
+        r = reader.next()
+        if r is None:
+            break
+        (usec, pkt) = r
+        index.add_record(offset, usec, packet_msgid(pkt, 0), 8 + len(pkt))
+        count += 1
+    index.close()
+    f.close()
+    return count
+
+def type_msgids(types):
+    '''the set of message ids of some message type names'''
+    from pymavlink import mavutil
+    ret = set()
+    for t in types:
+        msgid = getattr(mavutil.mavlink, 'MAVLINK_MSG_ID_' + t, None)
+        if msgid is not None:
+            ret.add(msgid)
+    return ret
+
+def recv_indexed(mlog, index, types, start_usec=None, end_usec=None):
+    '''yield the messages of some types from a log opened with
+    mavlink_log, reading only those records. Records past the end of the
+    index are read in full and filtered'''
+    for offset in index.find(type_msgids(types), start_usec, end_usec):
+        mlog.f.seek(offset)
+        m = mlog.recv_msg()
+        if m is None:
+            return
+        if m.get_type() in types:
+            yield m
+    if end_usec is not None and index.chunks and index.chunks[-1][0] > end_usec:
+        return
+    mlog.f.seek(index.end)
+    while True:
+        m = mlog.recv_match(type=types)
+        if m is None:
+            return
+        yield m
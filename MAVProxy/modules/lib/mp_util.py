@@ -5,10 +5,12 @@
 import math
 import os
 
-# Some platforms (CYGWIN and others) many not have this library
+# Some platforms (CYGWIN and others) many not have this library. Only
+# look for it here, importing wx is slow and headless runs don't need it
 has_wxpython = False
 try:
-    import wx
+    import imp
+    imp.find_module('wx')
     has_wxpython = True
 except ImportError, e:
     pass
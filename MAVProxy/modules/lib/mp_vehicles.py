@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+'''
+registry of the vehicles seen on the MAVLink links
+
+each system/component pair gets a Vehicle, holding the last message
+of each type and packet counters. Lookups are a single dictionary
+access, so the cost doesn't grow with the number of vehicles
+'''
+
+import time
+
+def vehicle_key(sysid, compid):
+    '''the registry key for a system/component pair'''
+    return (sysid << 8) | compid
+
+class Vehicle(object):
+    '''state of one system/component'''
+    __slots__ = ['sysid', 'compid', 'name', 'msgs', 'msg_count', 'packets', 'lost',
+                 'last_seq', 'linknum', 'first_seen', 'last_seen', 'vehicle_type']
+
+    def __init__(self, sysid, compid):
+        self.sysid = sysid
+        self.compid = compid
+        # map and other modules use this to name per vehicle objects
+        self.name = 'Vehicle%u' % sysid
+        self.msgs = {}
+        self.msg_count = {}
+        self.packets = 0
+        self.lost = 0
+        self.last_seq = -1
+        self.linknum = 0
+        self.first_seen = time.time()
+        self.last_seen = self.first_seen
+        self.vehicle_type = None
+
+    def update(self, m, mtype, linknum, now):
+        '''record a message from this vehicle'''
+        self.msgs[mtype] = m
+        self.msg_count[mtype] = self.msg_count.get(mtype, 0) + 1
+        self.packets += 1
+        self.linknum = linknum
+        self.last_seen = now
+        seq = m.get_seq()
+        if self.last_seq != -1:
+            gap = (seq - self.last_seq - 1) & 0xFF
+            # a large gap is more likely a reboot or a duplicate than loss
+            if gap < 128:
+                self.lost += gap
+        self.last_seq = seq
+        if mtype == 'HEARTBEAT':
+            self.vehicle_type = m.type
+
+    def message(self, mtype, default=None):
+        '''return the last message of a type from this vehicle'''
+        return self.msgs.get(mtype, default)
+
+    def __str__(self):
+        return '%u:%u type=%s link=%u packets=%u lost=%u age=%.1fs' % (
+            self.sysid, self.compid, self.vehicle_type, self.linknum+1,
+            self.packets, self.lost, time.time() - self.last_seen)
+
+class VehicleRegistry(object):
+    '''
+    all vehicles seen, keyed by system and component ID
+    '''
+    def __init__(self):
+        self.vehicles = {}
+        self.systems = {}
+
+    def __len__(self):
+        return len(self.vehicles)
+
+    def __iter__(self):
+        return iter(self.vehicles.values())
+
+    def add(self, sysid, compid):
+        '''add a vehicle, returning the Vehicle'''
+        v = Vehicle(sysid, compid)
+        self.vehicles[vehicle_key(sysid, compid)] = v
+        self.systems.setdefault(sysid, []).append(v)
+        return v
+
+    def update(self, m, mtype, linknum, now=None):
+        '''record a message, returning the Vehicle that sent it'''
+        v = self.vehicle_for(m)
+        if now is None:
+            now = time.time()
+        v.update(m, mtype, linknum, now)
+        return v
+
+    def get(self, sysid, compid=None):
+        '''return a vehicle, or None if it hasn't been seen. With no
+        compid the first component seen for the system is returned'''
+        if compid is None:
+            components = self.systems.get(sysid, None)
+            if not components:
+                return None
+            return components[0]
+        return self.vehicles.get(vehicle_key(sysid, compid), None)
+
+    def vehicle_for(self, m):
+        '''return the vehicle that sent a message, adding it if needed'''
+        sysid = m.get_srcSystem()
+        compid = m.get_srcComponent()
+        v = self.vehicles.get(vehicle_key(sysid, compid), None)
+        if v is None:
+            v = self.add(sysid, compid)
+        return v
+
+    def message(self, sysid, compid, mtype, default=None):
+        '''return the last message of a type from a vehicle'''
+        v = self.get(sysid, compid)
+        if v is None:
+            return default
+        return v.msgs.get(mtype, default)
+
+    def remove(self, sysid, compid):
+        '''forget a vehicle'''
+        v = self.vehicles.pop(vehicle_key(sysid, compid), None)
+        if v is not None:
+            self.systems[sysid].remove(v)
+            if not self.systems[sysid]:
+                del self.systems[sysid]
+
+    def clear(self):
+        '''forget all vehicles'''
+        self.vehicles = {}
+        self.systems = {}
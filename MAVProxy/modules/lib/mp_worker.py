@@ -0,0 +1,515 @@
+#!/usr/bin/env python
+'''
+hosting of modules in worker processes
+
+"module worker NAME" loads a module in its own process. The main
+process keeps a WorkerModule in its module list, which copies the raw
+MAVLink frames of the types the module wants into a SharedRing. The
+worker decodes them and calls the module as usual. Commands, console
+output and messages the module sends come back over a pipe the main
+loop waits on, so a slow module no longer holds up link handling.
+
+A worker starts with a copy of the settings, parameters and status of
+the main process. Changes made later in the main process are not seen
+by the worker, except that parameters and heartbeats are always passed
+to it. Other modules can't find a module in a worker with module()
+'''
+
+import copy, multiprocessing, signal, time, traceback
+
+from pymavlink import mavutil, mavparm
+from MAVProxy.modules.lib import mp_module
+from MAVProxy.modules.lib import mp_ring
+from MAVProxy.modules.lib import mp_telemetry
+from MAVProxy.modules.lib import mp_scheduler
+from MAVProxy.modules.lib import mp_select
+from MAVProxy.modules.lib import mp_settings
+from MAVProxy.modules.lib import mp_vehicles
+from MAVProxy.modules.lib import mp_perf
+from MAVProxy.modules.lib import mp_rates
+
+# message types always passed to a worker, to keep its copy of the
+# parameters and vehicle state current
+worker_core_types = frozenset(['HEARTBEAT', 'PARAM_VALUE'])
+
+# types of status values copied to a new worker
+plain_types = (int, long, float, str, unicode, bool, type(None))
+
+# how often a worker checks the ring when it is idle
+POLL_INTERVAL = 0.01
+
+# most frames a worker takes from the ring before running its timers
+MAX_BATCH = 500
+
+# how long to wait for a worker to load its module
+LOAD_TIMEOUT = 10
+
+def worker_snapshot(mpstate):
+    '''the state of the main process copied to a new worker'''
+    status = {}
+    for (k, v) in mpstate.status.__dict__.items():
+        if isinstance(v, plain_types):
+            status[k] = v
+    settings = [copy.copy(mpstate.settings.get_setting(k)) for k in mpstate.settings.list()]
+    return {
+        'status' : status,
+        'settings' : settings,
+        'mav_param' : dict(mpstate.mav_param),
+        'vehicle_type' : mpstate.vehicle_type,
+        'vehicle_name' : mpstate.vehicle_name,
+        'continue_mode' : mpstate.continue_mode,
+        'dialect' : mavutil.current_dialect,
+        }
+
+class WorkerModule(mp_module.MPModule):
+    '''
+    stands in for a module running in a worker process
+    '''
+    def __init__(self, mpstate, name, ring_size=1<<20):
+        super(WorkerModule, self).__init__(mpstate, name, "%s in a worker process" % name)
+        self.ring = mp_ring.SharedRing(ring_size)
+        (self.pipe, child_pipe) = multiprocessing.Pipe()
+        # the worker tells us which types it wants once the module is loaded
+        self.wants_packets = False
+        self.commands = []
+        self.overruns = 0
+        self.process = multiprocessing.Process(target=worker_main,
+                                               args=(name, worker_snapshot(mpstate), self.ring, child_pipe))
+        self.process.daemon = True
+        self.process.start()
+        child_pipe.close()
+        self.description = "%s in worker process %u" % (name, self.process.pid)
+        # set to None if the module loaded, otherwise the reason it didn't
+        self.load_error = self.wait_loaded()
+        if self.load_error is None:
+            self.mpstate.select_extra[self.pipe.fileno()] = (self.read_pipe, None)
+
+    def wait_loaded(self):
+        '''wait for the worker to load the module, handling the commands it
+        adds. Returns None on success or the reason for failure'''
+        end = time.time() + LOAD_TIMEOUT
+        try:
+            while self.pipe.poll(max(end - time.time(), 0)):
+                msg = self.pipe.recv()
+                if msg[0] == 'loaded':
+                    return msg[1]
+                self.handle(msg)
+        except (IOError, EOFError):
+            return "worker exited"
+        return "timed out"
+
+    def mavlink_packet(self, m):
+        '''pass a message to the worker'''
+        self.ring.write(m.get_msgbuf())
+
+    def wants_mavlink_type(self, mtype):
+        '''return True if the worker wants messages of type mtype'''
+        if mtype in worker_core_types:
+            return True
+        if not self.wants_packets:
+            return False
+        return self.mavlink_types is None or mtype in self.mavlink_types
+
+    def forward_command(self, name):
+        '''return a command callback that runs the command in the worker'''
+        def cmd(args):
+            self.send(('command', name, args))
+        return cmd
+
+    def send(self, msg):
+        '''send a message to the worker'''
+        try:
+            self.pipe.send(msg)
+        except (IOError, EOFError):
+            pass
+
+    def read_pipe(self, args):
+        '''handle messages from the worker'''
+        for i in range(100):
+            try:
+                if not self.pipe.poll():
+                    return
+                msg = self.pipe.recv()
+            except (IOError, EOFError):
+                self.worker_exited()
+                return
+            self.handle(msg)
+
+    def handle(self, msg):
+        '''handle one message from the worker'''
+        kind = msg[0]
+        if kind == 'console':
+            (method, args, kwargs) = msg[1:]
+            getattr(self.console, method)(*args, **kwargs)
+        elif kind == 'send':
+            master = self.master
+            m = master.mav.decode(bytearray(msg[1]))
+            master.mav.send(m)
+        elif kind == 'types':
+            (self.wants_packets, types) = msg[1:]
+            if types is None:
+                self.mavlink_types = None
+            else:
+                self.mavlink_types = set(types)
+            self.mpstate.mavlink_dispatch.clear()
+        elif kind == 'command':
+            (name, description) = msg[1:]
+            self.mpstate.command_map[name] = (self.forward_command(name), description)
+            if not name in self.commands:
+                self.commands.append(name)
+        elif kind == 'completions':
+            (name, completions) = msg[1:]
+            self.mpstate.completions[name] = completions
+        elif kind == 'remove_command':
+            self.mpstate.command_map.pop(msg[1], None)
+        elif kind == 'input':
+            self.mpstate.functions.process_stdin(msg[1])
+        elif kind == 'say':
+            self.mpstate.functions.say(msg[1], msg[2])
+        elif kind == 'param_set':
+            (name, value, retries) = msg[1:]
+            self.mpstate.functions.param_set(name, value, retries)
+        elif kind == 'overruns':
+            self.overruns = msg[1]
+            self.console.error("Module %s worker fell behind, %u ring overruns" % (self.name, self.overruns))
+
+    def remove(self):
+        '''stop listening to the worker and remove its commands'''
+        self.mpstate.select_extra.pop(self.pipe.fileno(), None)
+        for name in self.commands:
+            self.mpstate.command_map.pop(name, None)
+            self.mpstate.completions.pop(name, None)
+        self.commands = []
+
+    def worker_exited(self):
+        '''the worker has gone away, unload the module'''
+        self.console.error("Module %s worker exited" % self.name)
+        self.remove()
+        for (m, pm) in self.mpstate.modules:
+            if m is self:
+                self.mpstate.modules.remove((m, pm))
+                self.mpstate.mavlink_dispatch.clear()
+                break
+
+    def unload(self):
+        '''stop the worker'''
+        self.send(('unload',))
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+        # show any output from the last commands
+        try:
+            while self.pipe.poll():
+                msg = self.pipe.recv()
+                if msg[0] in ['console', 'say']:
+                    self.handle(msg)
+        except (IOError, EOFError):
+            pass
+        self.remove()
+        self.pipe.close()
+
+#
+# the worker process
+#
+
+class WorkerConsole(object):
+    '''a console passing its output to the main process'''
+    def __init__(self, pipe):
+        self.pipe = pipe
+
+    def send(self, method, args, kwargs):
+        self.pipe.send(('console', method, args, kwargs))
+
+    def write(self, text, fg='black', bg='white'):
+        self.send('write', (str(text),), {'fg' : fg, 'bg' : bg})
+
+    def writeln(self, text, fg='black', bg='white'):
+        self.send('writeln', (str(text),), {'fg' : fg, 'bg' : bg})
+
+    def set_status(self, name, text='', row=0, fg='black', bg='white'):
+        self.send('set_status', (name, text), {'row' : row, 'fg' : fg, 'bg' : bg})
+
+    def error(self, text, fg='red', bg='white'):
+        self.send('error', (str(text),), {'fg' : fg, 'bg' : bg})
+
+    def close(self):
+        pass
+
+    def is_alive(self):
+        return True
+
+class WorkerLink(mavutil.mavfile):
+    '''the master link as seen by a worker. Data written to it is sent
+    by the main process to its current master'''
+    def __init__(self, pipe):
+        mavutil.mavfile.__init__(self, None, 'worker')
+        self.pipe = pipe
+        self.linknum = 0
+        self.linkerror = False
+        self.link_delayed = False
+
+    def write(self, buf):
+        self.pipe.send(('send', str(buf)))
+
+    def recv(self, n=None):
+        return ''
+
+    def close(self):
+        pass
+
+class WorkerCommandMap(dict):
+    '''commands of the worker, which are also added in the main process'''
+    def __init__(self, pipe, kind):
+        dict.__init__(self)
+        self.pipe = pipe
+        self.kind = kind
+
+    def __setitem__(self, name, value):
+        dict.__setitem__(self, name, value)
+        if self.kind == 'command':
+            self.pipe.send(('command', name, value[1]))
+        else:
+            self.pipe.send(('completions', name, value))
+
+    def __delitem__(self, name):
+        dict.__delitem__(self, name)
+        if self.kind == 'command':
+            self.pipe.send(('remove_command', name))
+
+    def pop(self, name, *default):
+        if name in self and self.kind == 'command':
+            self.pipe.send(('remove_command', name))
+        return dict.pop(self, name, *default)
+
+class WorkerStatus(object):
+    '''the status of a worker, started from a copy of the main process status'''
+    def __init__(self, values):
+        self.__dict__.update(values)
+        self.msgs = {}
+        self.msg_count = {}
+        # rates of the messages as they reach the worker, all on link 0
+        self.rates = mp_rates.RateTracker()
+
+class WorkerFunctions(object):
+    '''core functions for modules in a worker'''
+    def __init__(self, state):
+        self.state = state
+
+    def process_stdin(self, line, immediate=False):
+        self.state.pipe.send(('input', line))
+
+    def param_set(self, name, value, retries=3):
+        self.state.pipe.send(('param_set', name, value, retries))
+
+    def get_mav_param(self, param, default=None):
+        return self.state.mav_param.get(param, default)
+
+    def say(self, text, priority='important'):
+        self.state.pipe.send(('say', text, priority))
+
+class WorkerState(object):
+    '''the mpstate seen by a module in a worker'''
+    def __init__(self, snapshot, pipe):
+        self.pipe = pipe
+        self.console = WorkerConsole(pipe)
+        self.status = WorkerStatus(snapshot['status'])
+        self.settings = mp_settings.MPSettings(snapshot['settings'])
+        self.mav_param = mavparm.MAVParmDict()
+        self.mav_param.update(snapshot['mav_param'])
+        self.vehicle_type = snapshot['vehicle_type']
+        self.vehicle_name = snapshot['vehicle_name']
+        self.continue_mode = snapshot['continue_mode']
+        self.link = WorkerLink(pipe)
+        self.mav_master = [self.link]
+        self.mav_outputs = []
+        self.sitl_output = None
+        self.map = None
+        self.map_functions = {}
+        self.modules = []
+        self.public_modules = {}
+        self.command_map = WorkerCommandMap(pipe, 'command')
+        self.completions = WorkerCommandMap(pipe, 'completions')
+        self.completion_functions = {}
+        self.aliases = {}
+        self.mavlink_dispatch = {}
+        self.functions = WorkerFunctions(self)
+        self.vehicles = mp_vehicles.VehicleRegistry()
+        self.perf = mp_perf.PerfRecorder()
+        self.scheduler = mp_scheduler.MPScheduler(self.callback_exception, perf=self.perf)
+        self.selector = mp_select.MPSelect()
+        self.select_extra = mp_select.MPSelectDict(self.selector, self.process_select_extra)
+        self.event_loop = None
+        self.telemetry = None
+        self.input_count = 0
+        self.exit = False
+
+    def master(self):
+        '''the master link'''
+        return self.link
+
+    def telemetry_ring(self):
+        '''return the ring of received messages for GUI child processes of
+        the worker. Once it exists the worker is sent every message'''
+        if self.telemetry is None:
+            self.telemetry = mp_telemetry.create_ring()
+        return self.telemetry
+
+    def module(self, name):
+        '''Find a public module in this worker'''
+        return self.public_modules.get(name, None)
+
+    def callback_exception(self, e):
+        '''report an exception from a module callback'''
+        if self.settings.moddebug == 1:
+            print(e)
+        elif self.settings.moddebug > 1:
+            traceback.print_exc()
+
+    def process_select_extra(self, fd):
+        '''call the read function a module registered for fd'''
+        try:
+            (fn, args) = self.select_extra[fd]
+            fn(args)
+        except Exception as e:
+            self.callback_exception(e)
+            self.select_extra.pop(fd, None)
+
+def import_module(modname):
+    '''import a module the way load_module() does'''
+    ex = None
+    for modpath in ['MAVProxy.modules.mavproxy_%s' % modname, modname]:
+        try:
+            m = __import__(modpath)
+            for comp in modpath.split('.')[1:]:
+                m = getattr(m, comp)
+            return m
+        except ImportError as msg:
+            ex = msg
+    raise ex
+
+class WorkerHost(object):
+    '''runs a module in a worker process'''
+    def __init__(self, name, snapshot, ring, pipe):
+        self.state = WorkerState(snapshot, pipe)
+        self.pipe = pipe
+        self.reader = ring.reader()
+        self.reported_overruns = 0
+        self.sent_types = None
+        pm = import_module(name)
+        self.module = pm.init(self.state)
+        if not isinstance(self.module, mp_module.MPModule):
+            raise ImportError("%s.init did not return a MPModule instance" % name)
+        self.state.modules.append((self.module, pm))
+        self.polls_idle = self.module.idle_task.__func__ is not mp_module.MPModule.idle_task.__func__
+        self.send_types()
+
+    def send_types(self):
+        '''tell the main process which message types the module wants'''
+        module = self.module
+        wants = module.mavlink_packet.__func__ is not mp_module.MPModule.mavlink_packet.__func__
+        types = module.mavlink_types
+        if types is not None:
+            types = sorted(types)
+        if self.state.telemetry is not None:
+            (wants, types) = (True, None)
+        if (wants, types) != self.sent_types:
+            self.sent_types = (wants, types)
+            self.pipe.send(('types', wants, types))
+
+    def process_frame(self, buf):
+        '''decode a frame from the ring and pass it to the module'''
+        state = self.state
+        try:
+            m = state.link.mav.decode(bytearray(buf))
+        except mavutil.mavlink.MAVError:
+            return
+        mtype = m.get_type()
+        state.link.post_message(m)
+        state.status.msgs[mtype] = m
+        state.status.msg_count[mtype] = state.status.msg_count.get(mtype, 0) + 1
+        state.status.rates.update(0, m.get_srcSystem(), mtype, time.time())
+        state.vehicles.update(m, mtype, 0)
+        if state.telemetry is not None:
+            state.telemetry.write(buf)
+        if mtype == 'PARAM_VALUE':
+            state.mav_param[str(m.param_id)] = m.param_value
+        elif mtype == 'HEARTBEAT':
+            state.status.flightmode = state.link.flightmode
+        if self.module.wants_mavlink_type(mtype):
+            try:
+                self.module.mavlink_packet(m)
+            except Exception as e:
+                state.callback_exception(e)
+
+    def handle(self, msg):
+        '''handle a message from the main process'''
+        kind = msg[0]
+        if kind == 'command':
+            (name, args) = msg[1:]
+            if name in self.state.command_map:
+                try:
+                    self.state.command_map[name][0](args)
+                except Exception as e:
+                    self.state.console.error("%s failed: %s" % (name, e))
+        elif kind == 'unload':
+            self.state.exit = True
+
+    def wait(self, timeout):
+        '''wait for a message from the main process or a module fd'''
+        if len(self.state.select_extra) == 0:
+            if self.pipe.poll(timeout):
+                self.handle(self.pipe.recv())
+            return
+        (readable, writable) = self.state.selector.select(timeout)
+        for fd in readable:
+            handler = self.state.selector.handler(fd)
+            if handler is not None:
+                (fn, args) = handler
+                fn(args)
+        while self.pipe.poll():
+            self.handle(self.pipe.recv())
+
+    def run(self):
+        '''main loop of the worker'''
+        state = self.state
+        while not state.exit:
+            self.send_types()
+            frames = self.reader.read(max_frames=MAX_BATCH)
+            for buf in frames:
+                self.process_frame(buf)
+            if self.reader.overruns != self.reported_overruns:
+                self.reported_overruns = self.reader.overruns
+                self.pipe.send(('overruns', self.reader.overruns))
+            state.scheduler.run_due()
+            if self.polls_idle and self.module.idle_rate is None:
+                try:
+                    self.module.idle_task()
+                except Exception as e:
+                    state.callback_exception(e)
+            if frames:
+                timeout = 0
+            else:
+                timeout = POLL_INTERVAL
+                deadline = state.scheduler.next_deadline()
+                if deadline is not None:
+                    timeout = max(min(timeout, deadline - time.time()), 0)
+            self.wait(timeout)
+        self.module.unload()
+
+def worker_main(name, snapshot, ring, pipe):
+    '''entry point of a worker process'''
+    # ctrl-c is for the main process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if mavutil.current_dialect != snapshot['dialect']:
+        mavutil.set_dialect(snapshot['dialect'])
+    try:
+        host = WorkerHost(name, snapshot, ring, pipe)
+    except Exception as e:
+        pipe.send(('loaded', str(e)))
+        return
+    pipe.send(('loaded', None))
+    try:
+        host.run()
+    except (IOError, EOFError):
+        # the main process has gone
+        pass
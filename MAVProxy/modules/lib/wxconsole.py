@@ -6,6 +6,9 @@
 import textconsole, wx, sys
 import mp_menu
 
+# how often queued text and status changes are sent to the child
+FLUSH_INTERVAL = 0.1
+
 class Text():
     '''text to write to console'''
     def __init__(self, text, fg='black', bg='white'):
@@ -25,21 +28,35 @@ class Value():
 class MessageConsole(textconsole.SimpleConsole):
     '''
     a message console for MAVProxy
+
+    text and status changes are queued and sent to the child as one
+    list every FLUSH_INTERVAL. Status values that haven't changed since
+    they were last sent are dropped
     '''
     def __init__(self,
                  title='MAVProxy: console'):
         textconsole.SimpleConsole.__init__(self)
-        import multiprocessing, threading
+        import multiprocessing, threading, collections
         self.title  = title
         self.menu_callback = None
         self.parent_pipe,self.child_pipe = multiprocessing.Pipe()
         self.close_event = multiprocessing.Event()
         self.close_event.clear()
+        self.lock = threading.Lock()
+        # name -> Value, in the order the values were first set so new
+        # fields are created in the same order
+        self.pending_values = collections.OrderedDict()
+        self.pending_text = []
+        # name -> (text, row, fg, bg) last sent to the child
+        self.sent_values = {}
         self.child = multiprocessing.Process(target=self.child_task)
         self.child.start()
         t = threading.Thread(target=self.watch_thread)
         t.daemon = True
         t.start()
+        t = threading.Thread(target=self.flush_thread)
+        t.daemon = True
+        t.start()
 
     def child_task(self):
         '''child process - this holds all the GUI elements'''
@@ -57,23 +74,54 @@ class MessageConsole(textconsole.SimpleConsole):
             if self.menu_callback is not None:
                 self.menu_callback(msg)
 
+    def flush_thread(self):
+        '''send queued text and status changes to the child'''
+        import time
+        while not self.close_event.is_set():
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        '''send the queued text and status changes as one message'''
+        with self.lock:
+            batch = []
+            for v in self.pending_values.values():
+                key = (v.text, v.row, v.fg, v.bg)
+                if self.sent_values.get(v.name, None) != key:
+                    self.sent_values[v.name] = key
+                    batch.append(v)
+            batch.extend(self.pending_text)
+            self.pending_values.clear()
+            self.pending_text = []
+            if batch and self.child.is_alive():
+                self.parent_pipe.send(batch)
+
     def write(self, text, fg='black', bg='white'):
         '''write to the console'''
-        if self.child.is_alive():
-            self.parent_pipe.send(Text(text, fg, bg))
+        with self.lock:
+            last = self.pending_text[-1] if self.pending_text else None
+            if last is not None and last.fg == fg and last.bg == bg:
+                last.text += text
+            else:
+                self.pending_text.append(Text(text, fg, bg))
 
     def set_status(self, name, text='', row=0, fg='black', bg='white'):
         '''set a status value'''
-        if self.child.is_alive():
-            self.parent_pipe.send(Value(name, text, row, fg, bg))
+        if self.sent_values.get(name, None) == (text, row, fg, bg) and name not in self.pending_values:
+            # unchanged
+            return
+        with self.lock:
+            self.pending_values[name] = Value(name, text, row, fg, bg)
 
     def set_menu(self, menu, callback):
         if self.child.is_alive():
-            self.parent_pipe.send(menu)
+            with self.lock:
+                self.parent_pipe.send(menu)
             self.menu_callback = callback
 
     def close(self):
         '''close the console'''
+        self.flush()
         self.close_event.set()
         if self.is_alive():
             self.child.join(2)
@@ -139,43 +187,57 @@ class ConsoleFrame(wx.Frame):
             return
         while state.child_pipe.poll():
             obj = state.child_pipe.recv()
-            if isinstance(obj, Value):
-                # request to set a status field
-                if not obj.name in self.values:
-                    # create a new status field
-                    value = wx.StaticText(self.panel, -1, obj.text)
-                    # possibly add more status rows
-                    for i in range(len(self.status), obj.row+1):
-                        self.status.append(wx.BoxSizer(wx.HORIZONTAL))
-                        self.vbox.Insert(len(self.status)-1, self.status[i], 0, flag=wx.ALIGN_LEFT | wx.TOP)
-                        self.vbox.Layout()
-                    self.status[obj.row].Add(value, border=5)
-                    self.status[obj.row].AddSpacer(20)
-                    self.values[obj.name] = value
-                value = self.values[obj.name]
-                value.SetForegroundColour(obj.fg)
-                value.SetBackgroundColour(obj.bg)
-                value.SetLabel(obj.text)
+            if not isinstance(obj, list):
+                obj = [obj]
+            # a batch of text and status changes
+            relayout = False
+            for o in obj:
+                if self.handle_update(o):
+                    relayout = True
+            if relayout:
                 self.panel.Layout()
-            elif isinstance(obj, Text):
-                '''request to add text to the console'''
-                self.pending.append(obj)
-                for p in self.pending:
-                    # we're scrolled at the bottom
-                    oldstyle = self.control.GetDefaultStyle()
-                    style = wx.TextAttr()
-                    style.SetTextColour(p.fg)
-                    style.SetBackgroundColour(p.bg)
-                    self.control.SetDefaultStyle(style)
-                    self.control.AppendText(p.text)
-                    self.control.SetDefaultStyle(oldstyle)
-                self.pending = []
-            elif isinstance(obj, mp_menu.MPMenuTop):
-                self.menu = obj
-                self.SetMenuBar(self.menu.wx_menu())
-                self.Bind(wx.EVT_MENU, self.on_menu)
-                self.Refresh()
-                self.Update()
+
+    def handle_update(self, obj):
+        '''handle a text, status or menu update from the parent, returning
+        True if the status bar needs laying out again'''
+        if isinstance(obj, Value):
+            # request to set a status field
+            if not obj.name in self.values:
+                # create a new status field
+                value = wx.StaticText(self.panel, -1, obj.text)
+                # possibly add more status rows
+                for i in range(len(self.status), obj.row+1):
+                    self.status.append(wx.BoxSizer(wx.HORIZONTAL))
+                    self.vbox.Insert(len(self.status)-1, self.status[i], 0, flag=wx.ALIGN_LEFT | wx.TOP)
+                    self.vbox.Layout()
+                self.status[obj.row].Add(value, border=5)
+                self.status[obj.row].AddSpacer(20)
+                self.values[obj.name] = value
+            value = self.values[obj.name]
+            value.SetForegroundColour(obj.fg)
+            value.SetBackgroundColour(obj.bg)
+            value.SetLabel(obj.text)
+            return True
+        elif isinstance(obj, Text):
+            '''request to add text to the console'''
+            self.pending.append(obj)
+            for p in self.pending:
+                # we're scrolled at the bottom
+                oldstyle = self.control.GetDefaultStyle()
+                style = wx.TextAttr()
+                style.SetTextColour(p.fg)
+                style.SetBackgroundColour(p.bg)
+                self.control.SetDefaultStyle(style)
+                self.control.AppendText(p.text)
+                self.control.SetDefaultStyle(oldstyle)
+            self.pending = []
+        elif isinstance(obj, mp_menu.MPMenuTop):
+            self.menu = obj
+            self.SetMenuBar(self.menu.wx_menu())
+            self.Bind(wx.EVT_MENU, self.on_menu)
+            self.Refresh()
+            self.Update()
+        return False
 
 if __name__ == "__main__":
     # test the console
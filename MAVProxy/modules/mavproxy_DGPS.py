@@ -16,9 +16,15 @@ class DGPSModule(mp_module.MPModule):
         self.port.bind(("127.0.0.1", self.portnum))
         mavutil.set_close_on_exec(self.port.fileno())
         self.port.setblocking(0)
+        self.mpstate.select_extra[self.port.fileno()] = (self.read_dgps, None)
 
-    def idle_task(self):
-        '''called in idle time'''
+    def unload(self):
+        '''unload module'''
+        self.mpstate.select_extra.pop(self.port.fileno(), None)
+        self.port.close()
+
+    def read_dgps(self, args):
+        '''called from the main loop when DGPS data is waiting'''
         try:
             data = self.port.recv(200)
         except socket.error as e:
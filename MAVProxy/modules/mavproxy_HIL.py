@@ -15,6 +15,7 @@ from pymavlink import mavutil
 class HILModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(HILModule, self).__init__(mpstate, "HIL", "HIL simulation")
+        self.add_mavlink_types(['RC_CHANNELS_SCALED'])
         self.last_sim_send_time = time.time()
         self.last_apm_send_time = time.time()
         self.rc_channels_scaled = mavutil.mavlink.MAVLink_rc_channels_scaled_message(0, 0, 0, 0, -10000, 0, 0, 0, 0, 0, 0)
@@ -30,12 +31,14 @@ class HILModule(mp_module.MPModule):
         self.sim_out.connect(sim_out_address)
         self.sim_out.setblocking(0)
 
-        # HIL needs very fast idle loop calls
-        if self.mpstate.select_timeout > 0.001:
-            self.mpstate.select_timeout = 0.001
+        # FDM packets are read as they arrive, and servos and HIL_STATE
+        # are sent at 50Hz
+        self.mpstate.select_extra[self.sim_in.fileno()] = (self.read_sim_in, None)
+        self.set_idle_rate(50)
 
     def unload(self):
         '''unload module'''
+        self.mpstate.select_extra.pop(self.sim_in.fileno(), None)
         self.sim_in.close()
         self.sim_out.close()
 
@@ -46,10 +49,13 @@ class HILModule(mp_module.MPModule):
 
     def idle_task(self):
         '''called from main loop'''
-        self.check_sim_in()
         self.check_sim_out()
         self.check_apm_out()
 
+    def read_sim_in(self, args):
+        '''called when the FDM socket is readable'''
+        self.check_sim_in()
+
     def check_sim_in(self):
         '''check for FDM packets from runsim'''
         try:
@@ -94,10 +100,9 @@ class HILModule(mp_module.MPModule):
 
     def check_sim_out(self):
         '''check if we should send new servos to flightgear'''
-        now = time.time()
-        if now - self.last_sim_send_time < 0.02 or self.rc_channels_scaled is None:
+        if self.rc_channels_scaled is None:
             return
-        self.last_sim_send_time = now
+        self.last_sim_send_time = time.time()
 
         servos = []
         for ch in range(1,9):
@@ -114,10 +119,7 @@ class HILModule(mp_module.MPModule):
 
     def check_apm_out(self):
         '''check if we should send new data to the APM'''
-        now = time.time()
-        if now - self.last_apm_send_time < 0.02:
-            return
-        self.last_apm_send_time = now
+        self.last_apm_send_time = time.time()
         if self.hil_state_msg is not None:
             self.master.mav.send(self.hil_state_msg)
 
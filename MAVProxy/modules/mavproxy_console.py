@@ -18,6 +18,10 @@ from MAVProxy.modules.lib.mp_menu import *
 class ConsoleModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(ConsoleModule, self).__init__(mpstate, "console", "GUI console", public=True)
+        self.add_mavlink_types(['GPS_RAW', 'GPS_RAW_INT', 'VFR_HUD', 'ATTITUDE', 'SYS_STATUS',
+                                'WIND', 'HWSTATUS', 'POWER_STATUS', 'RADIO', 'RADIO_STATUS',
+                                'HEARTBEAT', 'WAYPOINT_CURRENT', 'MISSION_CURRENT',
+                                'NAV_CONTROLLER_OUTPUT'])
         self.in_air = False
         self.start_time = 0.0
         self.total_time = 0.0
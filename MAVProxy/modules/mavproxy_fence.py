@@ -5,12 +5,12 @@ import os, time, platform
 from pymavlink import mavwp, mavutil
 from MAVProxy.modules.lib import mp_util
 from MAVProxy.modules.lib import mp_module
-if mp_util.has_wxpython:
-    from MAVProxy.modules.lib.mp_menu import *
 
 class FenceModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(FenceModule, self).__init__(mpstate, "fence", "geo-fence management", public = True)
+        self.add_mavlink_types(['FENCE_STATUS', 'SYS_STATUS'])
+        self.set_idle_rate(1)
         self.fenceloader = mavwp.MAVFenceLoader()
         self.last_fence_breach = 0
         self.last_fence_status = 0
@@ -31,30 +31,39 @@ class FenceModule(mp_module.MPModule):
                 self.have_list = True
                 print("Loaded fence from %s" % fencetxt)
 
-        if mp_util.has_wxpython:
-            self.menu_added_console = False
-            self.menu_added_map = False
-            self.menu = MPMenuSubMenu('Fence',
-                                  items=[MPMenuItem('Clear', 'Clear', '# fence clear'),
-                                         MPMenuItem('List', 'List', '# fence list'),
-                                         MPMenuItem('Load', 'Load', '# fence load ',
-                                                    handler=MPMenuCallFileDialog(flags=wx.FD_OPEN,
-                                                                                 title='Fence Load',
-                                                                                 wildcard='*.fen')),
-                                         MPMenuItem('Save', 'Save', '# fence save ',
-                                                    handler=MPMenuCallFileDialog(flags=wx.FD_SAVE|wx.FD_OVERWRITE_PROMPT,
-                                                                                 title='Fence Save',
-                                                                                 wildcard='*.fen')),
-                                         MPMenuItem('Draw', 'Draw', '# fence draw')])
+        self.menu_added_console = False
+        self.menu_added_map = False
+        self.menu = None
+
+    def create_menu(self):
+        '''create the Fence menu the first time a console or map needs it, so
+        wx is only imported when there is a GUI'''
+        if self.menu is not None:
+            return self.menu
+        import wx
+        from MAVProxy.modules.lib.mp_menu import MPMenuSubMenu, MPMenuItem, MPMenuCallFileDialog
+        self.menu = MPMenuSubMenu('Fence',
+                              items=[MPMenuItem('Clear', 'Clear', '# fence clear'),
+                                     MPMenuItem('List', 'List', '# fence list'),
+                                     MPMenuItem('Load', 'Load', '# fence load ',
+                                                handler=MPMenuCallFileDialog(flags=wx.FD_OPEN,
+                                                                             title='Fence Load',
+                                                                             wildcard='*.fen')),
+                                     MPMenuItem('Save', 'Save', '# fence save ',
+                                                handler=MPMenuCallFileDialog(flags=wx.FD_SAVE|wx.FD_OVERWRITE_PROMPT,
+                                                                             title='Fence Save',
+                                                                             wildcard='*.fen')),
+                                     MPMenuItem('Draw', 'Draw', '# fence draw')])
+        return self.menu
 
     def idle_task(self):
         '''called on idle'''
         if self.module('console') is not None and not self.menu_added_console:
             self.menu_added_console = True
-            self.module('console').add_menu(self.menu)
+            self.module('console').add_menu(self.create_menu())
         if self.module('map') is not None and not self.menu_added_map:
             self.menu_added_map = True
-            self.module('map').add_menu(self.menu)
+            self.module('map').add_menu(self.create_menu())
 
     def mavlink_packet(self, m):
         '''handle and incoming mavlink packet'''
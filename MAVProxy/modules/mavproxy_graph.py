@@ -17,6 +17,7 @@ class GraphModule(mp_module.MPModule):
         self.timespan = 20
         self.tickresolution = 0.2
         self.graphs = []
+        self.set_idle_rate(1)
         self.add_command('graph', self.cmd_graph, "[expression...] add a live graph",
                          ['(VARIABLE) (VARIABLE) (VARIABLE) (VARIABLE) (VARIABLE) (VARIABLE)'])
 
@@ -50,19 +51,13 @@ class GraphModule(mp_module.MPModule):
             g.close()
         self.graphs = []
 
-    def mavlink_packet(self, msg):
-        '''handle an incoming mavlink packet'''
-
-        # check for any closed graphs
+    def idle_task(self):
+        '''check for any closed graphs'''
         for i in range(len(self.graphs) - 1, -1, -1):
             if not self.graphs[i].is_alive():
                 self.graphs[i].close()
                 self.graphs.pop(i)
 
-        # add data to the rest
-        for g in self.graphs:
-            g.add_mavlink_packet(msg)
-
 
 def init(mpstate):
     '''initialise module'''
@@ -72,22 +67,15 @@ class Graph():
     '''a graph instance'''
     def __init__(self, state, fields):
         self.fields = fields[:]
-        self.field_types = []
-        self.msg_types = set()
         self.state = state
-
-        re_caps = re.compile('[A-Z_][A-Z0-9_]+')
-        for f in self.fields:
-            caps = set(re.findall(re_caps, f))
-            self.msg_types = self.msg_types.union(caps)
-            self.field_types.append(caps)
         print("Adding graph: %s" % self.fields)
 
-        self.values = [None] * len(self.fields)
+        # the graph reads the telemetry itself at its tick rate
         self.livegraph = live_graph.LiveGraph(self.fields,
                                               timespan=state.timespan,
                                               tickresolution=state.tickresolution,
-                                              title=self.fields[0])
+                                              title=self.fields[0],
+                                              telemetry=state.telemetry_ring())
 
     def is_alive(self):
         '''check if this graph is still alive'''
@@ -100,16 +88,3 @@ class Graph():
         if self.livegraph:
             self.livegraph.close()
         self.livegraph = None
-
-    def add_mavlink_packet(self, msg):
-        '''add data to the graph'''
-        mtype = msg.get_type()
-        if mtype not in self.msg_types:
-            return
-        for i in range(len(self.fields)):
-            if mtype not in self.field_types[i]:
-                continue
-            f = self.fields[i]
-            self.values[i] = mavutil.evaluate_expression(f, self.state.master.messages)
-        if self.livegraph is not None:
-            self.livegraph.add_values(self.values)
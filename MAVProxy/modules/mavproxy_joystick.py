@@ -109,7 +109,8 @@ class JSModule(mp_module.MPModule):
                 override[i] = v
             if override != self.module('rc').override:
                 self.module('rc').override = override
-                self.module('rc').override_period.force()
+                # send the new override on the next pass of the main loop
+                self.module('rc').idle_timer.set_deadline(0)
 
 def init(mpstate):
     '''initialise module'''
@@ -8,11 +8,12 @@ June 2012
 import sys, os, math
 import functools
 import time
-from MAVProxy.modules.mavproxy_map import mp_slipmap
 from MAVProxy.modules.lib import mp_util
 from MAVProxy.modules.lib import mp_settings
 from MAVProxy.modules.lib import mp_module
-from MAVProxy.modules.lib.mp_menu import *
+
+# the GUI modules mp_slipmap and mp_menu are imported by init(), as
+# modules without a map import this package for mp_elevation
 
 class MapModule(mp_module.MPModule):
     def __init__(self, mpstate):
@@ -47,7 +48,8 @@ class MapModule(mp_module.MPModule):
         if 'MAP_SERVICE' in os.environ:
             service = os.environ['MAP_SERVICE']
         import platform
-        mpstate.map = mp_slipmap.MPSlipMap(service=service, elevation=True, title='Map')
+        mpstate.map = mp_slipmap.MPSlipMap(service=service, elevation=True, title='Map',
+                                           telemetry=self.telemetry_ring())
         mpstate.map_functions = { 'draw_lines' : self.draw_lines }
     
         mpstate.map.add_callback(functools.partial(self.map_callback))
@@ -55,10 +57,10 @@ class MapModule(mp_module.MPModule):
                                       'set (MAPSETTING)'])
         self.add_completion_function('(MAPSETTING)', self.map_settings.completion)
 
-        self.default_popup = MPMenuSubMenu('Popup', items=[])
-        self.add_menu(MPMenuItem('Fly To', 'Fly To', '# guided ',
-                                 handler=MPMenuCallTextDialog(title='Altitude (m)', default=100)))
-        self.add_menu(MPMenuItem('Terrain Check', 'Terrain Check', '# terrain check'))
+        self.default_popup = mp_menu.MPMenuSubMenu('Popup', items=[])
+        self.add_menu(mp_menu.MPMenuItem('Fly To', 'Fly To', '# guided ',
+                                         handler=mp_menu.MPMenuCallTextDialog(title='Altitude (m)', default=100)))
+        self.add_menu(mp_menu.MPMenuItem('Terrain Check', 'Terrain Check', '# terrain check'))
 
     def add_menu(self, menu):
         '''add to the default popup menu'''
@@ -95,10 +97,10 @@ class MapModule(mp_module.MPModule):
         for i in range(len(polygons)):
             p = polygons[i]
             if len(p) > 1:
-                popup = MPMenuSubMenu('Popup',
-                                      items=[MPMenuItem('Set', returnkey='popupMissionSet'),
-                                             MPMenuItem('WP Remove', returnkey='popupMissionRemove'),
-                                             MPMenuItem('WP Move', returnkey='popupMissionMove')])
+                popup = mp_menu.MPMenuSubMenu('Popup',
+                                              items=[mp_menu.MPMenuItem('Set', returnkey='popupMissionSet'),
+                                                     mp_menu.MPMenuItem('WP Remove', returnkey='popupMissionRemove'),
+                                                     mp_menu.MPMenuItem('WP Move', returnkey='popupMissionMove')])
                 self.mpstate.map.add_object(mp_slipmap.SlipPolygon('mission %u' % i, p,
                                                                    layer='Mission', linewidth=2, colour=(255,255,255),
                                                                    popup_menu=popup))
@@ -119,9 +121,9 @@ class MapModule(mp_module.MPModule):
         points = self.module('fence').fenceloader.polygon()
         self.mpstate.map.add_object(mp_slipmap.SlipClearLayer('Fence'))
         if len(points) > 1:
-            popup = MPMenuSubMenu('Popup',
-                                  items=[MPMenuItem('FencePoint Remove', returnkey='popupFenceRemove'),
-                                         MPMenuItem('FencePoint Move', returnkey='popupFenceMove')])
+            popup = mp_menu.MPMenuSubMenu('Popup',
+                                          items=[mp_menu.MPMenuItem('FencePoint Remove', returnkey='popupFenceRemove'),
+                                                 mp_menu.MPMenuItem('FencePoint Move', returnkey='popupFenceMove')])
             self.mpstate.map.add_object(mp_slipmap.SlipPolygon('Fence', points, layer=1,
                                                                linewidth=2, colour=(0,255,0), popup_menu=popup))
 
@@ -299,6 +301,14 @@ class MapModule(mp_module.MPModule):
         icon = self.mpstate.map.icon(colour + vehicle_type + '.png')
         self.mpstate.map.add_object(mp_slipmap.SlipIcon(name, (0,0), icon, layer=3, rotation=0, follow=follow,
                                                    trail=mp_slipmap.SlipTrail()))
+
+    def track_vehicle_icon(self, name, colour, m, follow=False):
+        '''add a vehicle to the map that the map moves itself with the
+        telemetry of the type and system of m'''
+        track = name not in self.have_vehicle
+        self.create_vehicle_icon(name, colour, follow=follow)
+        if track:
+            self.mpstate.map.track_position(name, m.get_type(), m.get_srcSystem())
     
     def drawing_update(self):
         '''update line drawing'''
@@ -346,33 +356,28 @@ class MapModule(mp_module.MPModule):
     
         # this is the beginnings of allowing support for multiple vehicles
         # in the air at the same time
-        vehicle = 'Vehicle%u' % m.get_srcSystem()
+        vehicle = self.vehicles.vehicle_for(m).name
     
         if m.get_type() == "SIMSTATE" and self.map_settings.showsimpos:
-            self.create_vehicle_icon('Sim' + vehicle, 'green')
-            self.mpstate.map.set_position('Sim' + vehicle, (m.lat*1.0e-7, m.lng*1.0e-7), rotation=math.degrees(m.yaw))
+            if m.lat != 0 or m.lng != 0:
+                self.track_vehicle_icon('Sim' + vehicle, 'green', m)
     
         if m.get_type() == "AHRS2" and self.map_settings.showahrs2pos:
-            self.create_vehicle_icon('AHRS2' + vehicle, 'blue')
-            self.mpstate.map.set_position('AHRS2' + vehicle, (m.lat*1.0e-7, m.lng*1.0e-7), rotation=math.degrees(m.yaw))
+            if m.lat != 0 or m.lng != 0:
+                self.track_vehicle_icon('AHRS2' + vehicle, 'blue', m)
     
         if m.get_type() == "GPS_RAW_INT" and self.map_settings.showgpspos:
-            (lat, lon) = (m.lat*1.0e-7, m.lon*1.0e-7)
-            if lat != 0 or lon != 0:
-                self.create_vehicle_icon('GPS' + vehicle, 'blue')
-                self.mpstate.map.set_position('GPS' + vehicle, (lat, lon), rotation=m.cog*0.01)
+            if m.lat != 0 or m.lon != 0:
+                self.track_vehicle_icon('GPS' + vehicle, 'blue', m)
     
         if m.get_type() == "GPS2_RAW" and self.map_settings.showgps2pos:
-            (lat, lon) = (m.lat*1.0e-7, m.lon*1.0e-7)
-            if lat != 0 or lon != 0:
-                self.create_vehicle_icon('GPS2' + vehicle, 'green')
-                self.mpstate.map.set_position('GPS2' + vehicle, (lat, lon), rotation=m.cog*0.01)
+            if m.lat != 0 or m.lon != 0:
+                self.track_vehicle_icon('GPS2' + vehicle, 'green', m)
     
         if m.get_type() == 'GLOBAL_POSITION_INT':
             (self.lat, self.lon, self.heading) = (m.lat*1.0e-7, m.lon*1.0e-7, m.hdg*0.01)
             if self.lat != 0 or self.lon != 0:
-                self.create_vehicle_icon('Pos' + vehicle, 'red', follow=True)
-                self.mpstate.map.set_position('Pos' + vehicle, (self.lat, self.lon), rotation=self.heading)
+                self.track_vehicle_icon('Pos' + vehicle, 'red', m, follow=True)
     
         if m.get_type() == "NAV_CONTROLLER_OUTPUT":
             if self.master.flightmode in [ "AUTO", "GUIDED", "LOITER", "RTL" ]:
@@ -404,9 +409,9 @@ class MapModule(mp_module.MPModule):
             self.mpstate.map.add_object(mp_slipmap.SlipClearLayer('RallyPoints'))
             for i in range(self.module('rally').rallyloader.rally_count()):
                 rp = self.module('rally').rallyloader.rally_point(i)
-                popup = MPMenuSubMenu('Popup',
-                                      items=[MPMenuItem('Rally Remove', returnkey='popupRallyRemove'),
-                                             MPMenuItem('Rally Move', returnkey='popupRallyMove')])
+                popup = mp_menu.MPMenuSubMenu('Popup',
+                                              items=[mp_menu.MPMenuItem('Rally Remove', returnkey='popupRallyRemove'),
+                                                     mp_menu.MPMenuItem('Rally Move', returnkey='popupRallyMove')])
                 self.mpstate.map.add_object(mp_slipmap.SlipIcon('Rally %u' % (i+1), (rp.lat*1.0e-7, rp.lng*1.0e-7), icon,
                                                                 layer='RallyPoints', rotation=0, follow=False,
                                                                 popup_menu=popup))
@@ -450,4 +455,7 @@ class MapModule(mp_module.MPModule):
     
 def init(mpstate):
     '''initialise module'''
+    global mp_slipmap, mp_menu
+    from MAVProxy.modules.mavproxy_map import mp_slipmap
+    from MAVProxy.modules.lib import mp_menu
     return MapModule(mpstate)
@@ -5,13 +5,11 @@ It will grab the altitude of a long,lat pair from the SRTM database
 Created by Stephen Dade (stephen_dade@hotmail.com)
 '''
 
+import math
 import os
 import sys
 import time
 
-import numpy
-
-from MAVProxy.modules.mavproxy_map import GAreader
 from MAVProxy.modules.mavproxy_map import srtm
 
 
@@ -29,22 +27,24 @@ class ElevationModel():
 
         '''Use the Geoscience Australia database instead - watch for the correct database path'''
         if self.database == 'geoscience':
+            # GAreader needs numpy, only import it when it is used
+            from MAVProxy.modules.mavproxy_map import GAreader
             self.mappy = GAreader.ERMap()
             self.mappy.read_ermapper(os.path.join(os.environ['HOME'], './Documents/Elevation/Canberra/GSNSW_P756demg'))
 
     def GetElevation(self, latitude, longitude, timeout=0):
         '''Returns the altitude (m ASL) of a given lat/long pair, or None if unknown'''
         if self.database == 'srtm':
-            TileID = (numpy.floor(latitude), numpy.floor(longitude))
+            TileID = (math.floor(latitude), math.floor(longitude))
             if TileID in self.tileDict:
                 alt = self.tileDict[TileID].getAltitudeFromLatLon(latitude, longitude)
             else:
-                tile = self.downloader.getTile(numpy.floor(latitude), numpy.floor(longitude))
+                tile = self.downloader.getTile(math.floor(latitude), math.floor(longitude))
                 if tile == 0:
                     if timeout > 0:
                         t0 = time.time()
                         while time.time() < t0+timeout and tile == 0:
-                            tile = self.downloader.getTile(numpy.floor(latitude), numpy.floor(longitude))
+                            tile = self.downloader.getTile(math.floor(latitude), math.floor(longitude))
                             if tile == 0:
                                 time.sleep(0.1)
                 if tile == 0:
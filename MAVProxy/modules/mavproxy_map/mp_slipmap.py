@@ -401,6 +401,34 @@ class SlipPosition:
         self.latlon = latlon
         self.rotation = rotation
 
+class SlipTrack:
+    '''an object to move an existing object on the map to the position in
+    the newest telemetry message of a type from a system'''
+    def __init__(self, key, mtype, sysid, layer=None):
+        self.key = key
+        self.mtype = mtype
+        self.sysid = sysid
+        self.layer = layer
+        self.last = None
+
+# message types that can be tracked, with the position, heading and
+# heading scale fields
+track_fields = {
+    'GLOBAL_POSITION_INT' : ('lat', 'lon', 'hdg', 0.01),
+    'GPS_RAW_INT'         : ('lat', 'lon', 'cog', 0.01),
+    'GPS2_RAW'            : ('lat', 'lon', 'cog', 0.01),
+    'SIMSTATE'            : ('lat', 'lng', 'yaw', math.degrees(1)),
+    'AHRS2'               : ('lat', 'lng', 'yaw', math.degrees(1)),
+    }
+
+def track_position(m):
+    '''return the (latlon, rotation) in a message, or None if it has no position yet'''
+    (latname, lonname, hdgname, scale) = track_fields[m.get_type()]
+    (lat, lon) = (getattr(m, latname)*1.0e-7, getattr(m, lonname)*1.0e-7)
+    if lat == 0 and lon == 0:
+        return None
+    return ((lat, lon), getattr(m, hdgname)*scale)
+
 class SlipCenter:
     '''an object to move the view center'''
     def __init__(self, latlon):
@@ -569,7 +597,8 @@ class MPSlipMap():
                  debug=False,
                  brightness=1.0,
                  elevation=False,
-                 download=True):
+                 download=True,
+                 telemetry=None):
         import multiprocessing
 
         self.lat = lat
@@ -585,6 +614,8 @@ class MPSlipMap():
         self.elevation = elevation
         self.oldtext = None
         self.brightness = brightness
+        # ring of received messages for SlipTrack objects
+        self.telemetry = telemetry
 
         self.drag_step = 10
 
@@ -610,6 +641,11 @@ class MPSlipMap():
                                  max_zoom=self.max_zoom)
         state.layers = {}
         state.info = {}
+        state.tracks = {}
+        state.view = None
+        if self.telemetry is not None:
+            from MAVProxy.modules.lib import mp_telemetry
+            state.view = mp_telemetry.TelemetryView(self.telemetry)
         state.need_redraw = True
 
         self.app = wx.PySimpleApp()
@@ -645,6 +681,11 @@ class MPSlipMap():
         '''move an object on the map'''
         self.object_queue.put(SlipPosition(key, latlon, layer, rotation))
 
+    def track_position(self, key, mtype, sysid, layer=None):
+        '''move an object on the map with the newest mtype message from
+        sysid. The map must have been given a telemetry ring'''
+        self.object_queue.put(SlipTrack(key, mtype, sysid, layer))
+
     def event_count(self):
         '''return number of events waiting to be processed'''
         return self.event_queue.qsize()
@@ -790,8 +831,36 @@ class MPSlipMapFrame(wx.Frame):
         state = self.state
         for layer in state.layers:
             state.layers[layer].pop(key, None)
+        state.tracks.pop(key, None)
         state.need_redraw = True
 
+    def update_tracks(self):
+        '''move tracked objects to their newest telemetry positions,
+        returning True if any moved'''
+        state = self.state
+        if state.view.update() == 0:
+            return False
+        moved = False
+        for track in state.tracks.values():
+            m = state.view.message(track.mtype, track.sysid)
+            if m is None or m is track.last:
+                continue
+            track.last = m
+            pos = track_position(m)
+            if pos is None:
+                continue
+            object = self.find_object(track.key, track.layer)
+            if object is None:
+                continue
+            (latlon, rotation) = pos
+            object.update_position(SlipPosition(track.key, latlon, track.layer, rotation))
+            if getattr(object, 'follow', False):
+                self.follow(object)
+            moved = True
+        if moved:
+            state.need_redraw = True
+        return moved
+
     def on_idle(self, event):
         '''prevent the main loop spinning too fast'''
         state = self.state
@@ -814,6 +883,10 @@ class MPSlipMapFrame(wx.Frame):
                         self.follow(object)
                     state.need_redraw = True
 
+            if isinstance(obj, SlipTrack):
+                # move an object with the telemetry from now on
+                state.tracks[obj.key] = obj
+
             if isinstance(obj, SlipDefaultPopup):
                 state.default_popup = obj
 
@@ -849,6 +922,7 @@ class MPSlipMapFrame(wx.Frame):
                 for layer in state.layers:
                     if obj.key in state.layers[layer]:
                         state.layers[layer].pop(obj.key)
+                state.tracks.pop(obj.key, None)
                 state.need_redraw = True
 
             if isinstance(obj, SlipHideObject):
@@ -857,8 +931,12 @@ class MPSlipMapFrame(wx.Frame):
                     if obj.key in state.layers[layer]:
                         state.layers[layer][obj.key].set_hidden(obj.hide)
                 state.need_redraw = True
-        
-        if obj is None:
+
+        moved = False
+        if state.view is not None and state.tracks:
+            moved = self.update_tracks()
+
+        if obj is None and not moved:
             time.sleep(0.05)
 
 
@@ -2,7 +2,11 @@
 '''enable run-time addition and removal of UDP clients , just like --out on the cnd line'''
 ''' TO USE: 
     output add 10.11.12.13:14550
+    output add 10.11.12.13:14550 allow=HEARTBEAT,GLOBAL_POSITION_INT,SYS_STATUS rate=GLOBAL_POSITION_INT:1
     output list
+    output set 3 deny=RC_CHANNELS*   # to stop sending RC_CHANNELS messages to the 3rd output
+    output set 3 clear   # to send everything to the 3rd output
+    output set 3 queue=4096 policy=drop_priority   # send buffer size and overflow policy
     output remove 3      # to remove 3rd output
 '''    
 
@@ -10,20 +14,21 @@ from pymavlink import mavutil
 
 
 from MAVProxy.modules.lib import mp_module
+from MAVProxy.modules.lib import mp_output
 
 class OutputModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(OutputModule, self).__init__(mpstate, "output", "output control", public=True)
         self.add_command('output', self.cmd_output, "output control",
-                         ["<list|add|remove>"])
+                         ["<list|add|remove|set>"])
 
     def cmd_output(self, args):
         '''handle output commands'''
         if len(args) < 1 or args[0] == "list":
             self.cmd_output_list()
         elif args[0] == "add":
-            if len(args) != 2:
-                print("Usage: output add OUTPUT")
+            if len(args) < 2:
+                print("Usage: output add OUTPUT [allow=TYPES] [deny=TYPES] [rate=TYPE:HZ,...] [queue=BYTES] [policy=POLICY]")
                 return
             self.cmd_output_add(args[1:])
         elif args[0] == "remove":
@@ -31,26 +36,115 @@ class OutputModule(mp_module.MPModule):
                 print("Usage: output remove OUTPUT")
                 return
             self.cmd_output_remove(args[1:])
+        elif args[0] == "set":
+            if len(args) < 3:
+                print("Usage: output set OUTPUT <clear|allow=TYPES|deny=TYPES|rate=TYPE:HZ,...|queue=BYTES|policy=POLICY>")
+                return
+            self.cmd_output_set(args[1:])
         else:
-            print("usage: output <list|add|remove>")
+            print("usage: output <list|add|remove|set>")
 
     def cmd_output_list(self):
         '''list outputs'''
         print("%u outputs" % len(self.mpstate.mav_outputs))
         for i in range(len(self.mpstate.mav_outputs)):
             conn = self.mpstate.mav_outputs[i]
-            print("%u: %s" % (i, conn.address))
+            print("%u: %s %s" % (i, conn.address, conn.filter))
+            print("   %s" % conn.sendq)
+
+    def find_output(self, device):
+        '''find an output by number or address'''
+        for i in range(len(self.mpstate.mav_outputs)):
+            conn = self.mpstate.mav_outputs[i]
+            if str(i) == device or conn.address == device:
+                return conn
+        return None
+
+    def parse_options(self, args):
+        '''check filter and queue options, returning a list of (name, value),
+        or None on a bad option'''
+        ret = []
+        for a in args:
+            if a == 'clear':
+                ret.append(('clear', None))
+                continue
+            if a.find('=') == -1:
+                print("Bad output option %s" % a)
+                return None
+            (name, value) = a.split('=', 1)
+            if name == 'allow':
+                if value in ['', '*']:
+                    ret.append(('allow', None))
+                else:
+                    ret.append(('allow', value.split(',')))
+            elif name == 'deny':
+                ret.append(('deny', [t for t in value.split(',') if t]))
+            elif name == 'rate':
+                for r in value.split(','):
+                    try:
+                        (mtype, rate) = r.split(':')
+                        ret.append(('rate', (mtype, float(rate))))
+                    except ValueError:
+                        print("Bad rate %s - use TYPE:HZ" % r)
+                        return None
+            elif name == 'queue':
+                try:
+                    ret.append(('queue', int(value)))
+                except ValueError:
+                    print("Bad queue size %s" % value)
+                    return None
+            elif name == 'policy':
+                if not value in mp_output.overflow_policies:
+                    print("policy must be one of %s" % ','.join(mp_output.overflow_policies))
+                    return None
+                ret.append(('policy', value))
+            else:
+                print("Bad output option %s" % a)
+                return None
+        return ret
+
+    def apply_options(self, conn, options):
+        '''apply options from parse_options() to an output'''
+        for (name, value) in options:
+            if name == 'clear':
+                conn.filter.clear()
+            elif name == 'allow':
+                conn.filter.set_allow(value)
+            elif name == 'deny':
+                conn.filter.set_deny(value)
+            elif name == 'rate':
+                conn.filter.set_rate(value[0], value[1])
+            elif name == 'queue':
+                conn.sendq.max_bytes = value
+            elif name == 'policy':
+                conn.sendq.set_policy(value)
 
     def cmd_output_add(self, args):
         '''add new output'''
         device = args[0]
+        options = self.parse_options(args[1:])
+        if options is None:
+            return
         print("Adding output %s" % device)
         try:
             conn = mavutil.mavlink_connection(device, input=False)
         except Exception:
             print("Failed to connect to %s" % device)
             return
-        self.mpstate.mav_outputs.append(conn)
+        self.mpstate.add_output(conn)
+        self.apply_options(conn, options)
+
+    def cmd_output_set(self, args):
+        '''change the filtering on an output'''
+        conn = self.find_output(args[0])
+        if conn is None:
+            print("Unknown output %s" % args[0])
+            return
+        options = self.parse_options(args[1:])
+        if options is None:
+            return
+        self.apply_options(conn, options)
+        print("%s: %s %s" % (conn.address, conn.filter, conn.sendq))
 
     def cmd_output_remove(self, args):
         '''remove an output'''
@@ -59,7 +153,7 @@ class OutputModule(mp_module.MPModule):
             conn = self.mpstate.mav_outputs[i]
             if str(i) == device or conn.address == device:
                 print("Removing output %s" % conn.address)
-                self.mpstate.mav_outputs.pop(i)
+                self.mpstate.remove_output(conn)
                 return
         
 def init(mpstate):
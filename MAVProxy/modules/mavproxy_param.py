@@ -213,6 +213,8 @@ class ParamState:
 class ParamModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(ParamModule, self).__init__(mpstate, "param", "parameter handling", public = True)
+        self.add_mavlink_types(['PARAM_VALUE'])
+        self.set_idle_rate(2)
         self.pstate = ParamState(self.mav_param, self.logdir, self.vehicle_name, 'mav.parm')
         self.add_command('param', self.cmd_param, "parameter handling",
                          ["<download>",
@@ -8,12 +8,12 @@ import time, os, platform
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import mp_util
 
-if mp_util.has_wxpython:
-    from MAVProxy.modules.lib.mp_menu import *
 
 class RallyModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(RallyModule, self).__init__(mpstate, "rally", "rally point control", public = True)
+        self.add_mavlink_types(['COMMAND_ACK'])
+        self.set_idle_rate(4)
         self.rallyloader = mavwp.MAVRallyLoader(mpstate.status.target_system, mpstate.status.target_component)
         self.add_command('rally', self.cmd_rally, "rally point control", ["<add|clear|land|list|move|remove|>",
                                     "<load|save> (FILENAME)"])
@@ -23,33 +23,42 @@ class RallyModule(mp_module.MPModule):
         self.abort_previous_send_time = 0
         self.abort_ack_received = True
 
-        if mp_util.has_wxpython:
-            self.menu_added_console = False
-            self.menu_added_map = False
-            self.menu = MPMenuSubMenu('Rally',
-                                  items=[MPMenuItem('Clear', 'Clear', '# rally clear'),
-                                         MPMenuItem('List', 'List', '# rally list'),
-                                         MPMenuItem('Load', 'Load', '# rally load ',
-                                                    handler=MPMenuCallFileDialog(flags=wx.FD_OPEN,
-                                                                                 title='Rally Load',
-                                                                                 wildcard='*.rally')),
-                                         MPMenuItem('Save', 'Save', '# rally save ',
-                                                    handler=MPMenuCallFileDialog(flags=wx.FD_SAVE|wx.FD_OVERWRITE_PROMPT,
-                                                                                 title='Rally Save',
-                                                                                 wildcard='*.rally')),
-                                         MPMenuItem('Add', 'Add', '# rally add ',
-                                                    handler=MPMenuCallTextDialog(title='Rally Altitude (m)',
-                                                                                 default=100))])
-
+        self.menu_added_console = False
+        self.menu_added_map = False
+        self.menu = None
+
+
+    def create_menu(self):
+        '''create the Rally menu the first time a console or map needs it, so
+        wx is only imported when there is a GUI'''
+        if self.menu is not None:
+            return self.menu
+        import wx
+        from MAVProxy.modules.lib.mp_menu import MPMenuSubMenu, MPMenuItem, MPMenuCallFileDialog, MPMenuCallTextDialog
+        self.menu = MPMenuSubMenu('Rally',
+                              items=[MPMenuItem('Clear', 'Clear', '# rally clear'),
+                                     MPMenuItem('List', 'List', '# rally list'),
+                                     MPMenuItem('Load', 'Load', '# rally load ',
+                                                handler=MPMenuCallFileDialog(flags=wx.FD_OPEN,
+                                                                             title='Rally Load',
+                                                                             wildcard='*.rally')),
+                                     MPMenuItem('Save', 'Save', '# rally save ',
+                                                handler=MPMenuCallFileDialog(flags=wx.FD_SAVE|wx.FD_OVERWRITE_PROMPT,
+                                                                             title='Rally Save',
+                                                                             wildcard='*.rally')),
+                                     MPMenuItem('Add', 'Add', '# rally add ',
+                                                handler=MPMenuCallTextDialog(title='Rally Altitude (m)',
+                                                                             default=100))])
+        return self.menu
 
     def idle_task(self):
         '''called on idle'''
         if self.module('console') is not None and not self.menu_added_console:
             self.menu_added_console = True
-            self.module('console').add_menu(self.menu)
+            self.module('console').add_menu(self.create_menu())
         if self.module('map') is not None and not self.menu_added_map:
             self.menu_added_map = True
-            self.module('map').add_menu(self.menu)
+            self.module('map').add_menu(self.create_menu())
 
         '''handle abort command; it is critical that the AP to receive it'''
         if self.abort_ack_received is False:
@@ -2,7 +2,6 @@
 '''rc command handling'''
 
 import time, os, struct
-from pymavlink import mavutil
 from MAVProxy.modules.lib import mp_module
 
 class RCModule(mp_module.MPModule):
@@ -14,19 +13,18 @@ class RCModule(mp_module.MPModule):
         self.add_command('rc', self.cmd_rc, "RC input control", ['<1|2|3|4|5|6|7|8|all>'])
         self.add_command('switch', self.cmd_switch, "flight mode switch control", ['<0|1|2|3|4|5|6>'])
         if self.sitl_output:
-            self.override_period = mavutil.periodic_event(20)
+            self.set_idle_rate(20)
         else:
-            self.override_period = mavutil.periodic_event(1)
+            self.set_idle_rate(1)
 
     def idle_task(self):
-        if self.override_period.trigger():
-            if (self.override != [ 0 ] * 8 or
-                self.override != self.last_override or
-                self.override_counter > 0):
-                self.last_override = self.override[:]
-                self.send_rc_override()
-                if self.override_counter > 0:
-                    self.override_counter -= 1
+        if (self.override != [ 0 ] * 8 or
+            self.override != self.last_override or
+            self.override_counter > 0):
+            self.last_override = self.override[:]
+            self.send_rc_override()
+            if self.override_counter > 0:
+                self.override_counter -= 1
 
     def send_rc_override(self):
         '''send RC override packet'''
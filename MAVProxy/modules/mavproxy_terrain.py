@@ -12,6 +12,8 @@ from MAVProxy.modules.lib import mp_settings
 class TerrainModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(TerrainModule, self).__init__(mpstate, "terrain", "terrain handling", public=False)
+        self.add_mavlink_types(['TERRAIN_REQUEST', 'TERRAIN_REPORT'])
+        self.set_idle_rate(10)
 
         self.ElevationModel = mp_elevation.ElevationModel()
         self.current_request = None
@@ -5,19 +5,21 @@ import time, os, fnmatch, copy, platform
 from pymavlink import mavutil, mavwp
 from MAVProxy.modules.lib import mp_module
 from MAVProxy.modules.lib import mp_util
-if mp_util.has_wxpython:
-    from MAVProxy.modules.lib.mp_menu import *
 
 class WPModule(mp_module.MPModule):
     def __init__(self, mpstate):
         super(WPModule, self).__init__(mpstate, "wp", "waypoint handling", public = True)
+        self.add_mavlink_types(['WAYPOINT_COUNT', 'MISSION_COUNT', 'WAYPOINT', 'MISSION_ITEM',
+                                'WAYPOINT_REQUEST', 'MISSION_REQUEST',
+                                'WAYPOINT_CURRENT', 'MISSION_CURRENT'])
         self.wp_op = None
         self.wp_save_filename = None
         self.wploader = mavwp.MAVWPLoader()
         self.loading_waypoints = False
         self.loading_waypoint_lasttime = time.time()
         self.last_waypoint = 0
-        self.wp_period = mavutil.periodic_event(0.5)
+        self.add_timer(0.5, self.check_missing_waypoints)
+        self.set_idle_rate(2)
         self.undo_wp = None
         self.undo_type = None
         self.undo_wp_idx = -1
@@ -31,25 +33,9 @@ class WPModule(mp_module.MPModule):
                 self.wploader.load(waytxt)
                 print("Loaded waypoints from %s" % waytxt)
 
-        if mp_util.has_wxpython:
-            self.menu_added_console = False
-            self.menu_added_map = False
-            self.menu = MPMenuSubMenu('Mission',
-                                  items=[MPMenuItem('Clear', 'Clear', '# wp clear'),
-                                         MPMenuItem('List', 'List', '# wp list'),
-                                         MPMenuItem('Load', 'Load', '# wp load ',
-                                                    handler=MPMenuCallFileDialog(flags=wx.FD_OPEN,
-                                                                                 title='Mission Load',
-                                                                                 wildcard='*.txt')),
-                                         MPMenuItem('Save', 'Save', '# wp save ',
-                                                    handler=MPMenuCallFileDialog(flags=wx.FD_SAVE|wx.FD_OVERWRITE_PROMPT,
-                                                                                 title='Mission Save',
-                                                                                 wildcard='*.txt')),
-                                         MPMenuItem('Draw', 'Draw', '# wp draw ',
-                                                    handler=MPMenuCallTextDialog(title='Mission Altitude (m)',
-                                                                                 default=100)),
-                                         MPMenuItem('Undo', 'Undo', '# wp undo'),
-                                         MPMenuItem('Loop', 'Loop', '# wp loop')])
+        self.menu_added_console = False
+        self.menu_added_map = False
+        self.menu = None
 
 
     def mavlink_packet(self, m):
@@ -102,20 +88,46 @@ class WPModule(mp_module.MPModule):
                     self.say("waypoint %u" % m.seq,priority='message')
 
 
+    def create_menu(self):
+        '''create the Mission menu the first time a console or map needs it, so
+        wx is only imported when there is a GUI'''
+        if self.menu is not None:
+            return self.menu
+        import wx
+        from MAVProxy.modules.lib.mp_menu import MPMenuSubMenu, MPMenuItem, MPMenuCallFileDialog, MPMenuCallTextDialog
+        self.menu = MPMenuSubMenu('Mission',
+                              items=[MPMenuItem('Clear', 'Clear', '# wp clear'),
+                                     MPMenuItem('List', 'List', '# wp list'),
+                                     MPMenuItem('Load', 'Load', '# wp load ',
+                                                handler=MPMenuCallFileDialog(flags=wx.FD_OPEN,
+                                                                             title='Mission Load',
+                                                                             wildcard='*.txt')),
+                                     MPMenuItem('Save', 'Save', '# wp save ',
+                                                handler=MPMenuCallFileDialog(flags=wx.FD_SAVE|wx.FD_OVERWRITE_PROMPT,
+                                                                             title='Mission Save',
+                                                                             wildcard='*.txt')),
+                                     MPMenuItem('Draw', 'Draw', '# wp draw ',
+                                                handler=MPMenuCallTextDialog(title='Mission Altitude (m)',
+                                                                             default=100)),
+                                     MPMenuItem('Undo', 'Undo', '# wp undo'),
+                                     MPMenuItem('Loop', 'Loop', '# wp loop')])
+        return self.menu
+
+    def check_missing_waypoints(self):
+        '''cope with packet loss fetching mission'''
+        if self.master.time_since('MISSION_ITEM') >= 2 and self.wploader.count() < getattr(self.wploader,'expected_count',0):
+            seq = self.wploader.count()
+            print("re-requesting WP %u" % seq)
+            self.master.waypoint_request_send(seq)
+
     def idle_task(self):
-        '''handle missing waypoints'''
-        if self.wp_period.trigger():
-            # cope with packet loss fetching mission
-            if self.master.time_since('MISSION_ITEM') >= 2 and self.wploader.count() < getattr(self.wploader,'expected_count',0):
-                seq = self.wploader.count()
-                print("re-requesting WP %u" % seq)
-                self.master.waypoint_request_send(seq)
+        '''add the mission menus'''
         if self.module('console') is not None and not self.menu_added_console:
             self.menu_added_console = True
-            self.module('console').add_menu(self.menu)
+            self.module('console').add_menu(self.create_menu())
         if self.module('map') is not None and not self.menu_added_map:
             self.menu_added_map = True
-            self.module('map').add_menu(self.menu)
+            self.module('map').add_menu(self.create_menu())
 
     def process_waypoint_request(self, m, master):
         '''process a waypoint request from the master'''
@@ -0,0 +1,526 @@
+#!/usr/bin/env python
+
+'''
+benchmark the MAVProxy packet path by feeding it recorded tlogs
+
+each log is pushed through a fake master connection into
+process_master(), so it takes the same path as live data: decode,
+master_callback(), the modules and the outputs. This runs as fast as
+possible with no GUI, for each of a set of module configurations:
+
+  core      no modules
+  standard  the modules mavproxy.py loads by default
+  gui       standard plus map and console, with their GUIs replaced
+            by headless stubs
+
+in all configurations the terrain elevation model is a stub, so no
+SRTM tiles are downloaded or read and the results don't depend on the
+network or the tile cache.
+
+each configuration runs in its own process, so the peak memory is
+per configuration. Run it against two versions of MAVProxy to compare.
+With no logs given, a set of reference logs is generated, and these
+are the same each time. Use --json to save machine readable results.
+'''
+
+import sys, os, time, json, subprocess, tempfile, types, math, random, struct, shutil, StringIO
+
+from optparse import OptionParser
+parser = OptionParser("mavbench.py [options] <LOGFILE...>")
+parser.add_option("--repeat", type='int', default=5, help="number of passes over each log")
+parser.add_option("--watch", default=None, help="watch pattern to set while benchmarking")
+parser.add_option("--dialect", default="ardupilotmega", help="MAVLink dialect")
+parser.add_option("--config", default="core,standard,gui", help="comma separated list of module configurations")
+parser.add_option("--chunk", type='int', default=16*1024, help="bytes passed to each recv() of the fake master")
+parser.add_option("--json", default=None, help="write results as JSON to this file")
+parser.add_option("--make-logs", default=None, help="write the reference logs to this directory and exit")
+parser.add_option("--single", action='store_true', default=False, help="run one configuration on one log, printing JSON")
+
+(opts, args) = parser.parse_args()
+
+from pymavlink import mavutil, mavparm
+mavutil.set_dialect(opts.dialect)
+
+configs = {
+    'core'     : [],
+    'standard' : ['log', 'wp', 'rally', 'fence', 'param', 'relay',
+                  'tuneopt', 'arm', 'mode', 'calibration', 'rc', 'auxopt', 'misc', 'cmdlong',
+                  'battery', 'terrain', 'output'],
+    }
+configs['gui'] = configs['standard'] + ['console', 'map']
+
+#
+# reference logs
+#
+
+def write_message(f, mav, m, t):
+    '''write a message to a tlog at time t, as received on link 1'''
+    buf = m.pack(mav)
+    mav.seq = (mav.seq + 1) % 256
+    f.write(struct.pack('>Q', int(t*1.0e6) & ~3) + buf)
+
+def make_telemetry_log(filename, nvehicles, duration, rates):
+    '''write a log of vehicles flying circles, with the given message rates'''
+    mavlink = mavutil.mavlink
+    rand = random.Random(nvehicles)
+    f = open(filename, 'wb')
+    t0 = 1400000000.0
+    mavs = [mavlink.MAVLink(None, srcSystem=i+1, srcComponent=1) for i in range(nvehicles)]
+    events = []
+    for i in range(nvehicles):
+        for (name, rate) in rates:
+            events.append((rand.random() / rate, i, name, 1.0/rate))
+    text_count = 0
+    while events:
+        events.sort()
+        (t, i, name, period) = events.pop(0)
+        if t >= duration:
+            continue
+        events.append((t + period, i, name, period))
+        mav = mavs[i]
+        angle = t * 0.1 + i
+        lat = int((-35.363 + 0.001 * math.cos(angle)) * 1.0e7)
+        lon = int((149.165 + 0.001 * math.sin(angle)) * 1.0e7)
+        ms = int(t*1000)
+        if name == 'HEARTBEAT':
+            m = mav.heartbeat_encode(mavlink.MAV_TYPE_QUADROTOR, mavlink.MAV_AUTOPILOT_ARDUPILOTMEGA,
+                                     mavlink.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED, 3, mavlink.MAV_STATE_ACTIVE)
+        elif name == 'SYS_STATUS':
+            m = mav.sys_status_encode(0, 0, 0, 300, 12000 - int(t), 1500, 80, 0, 0, 0, 0, 0, 0)
+        elif name == 'GPS_RAW_INT':
+            m = mav.gps_raw_int_encode(ms*1000, 3, lat, lon, 600000, 120, 150, 500, 9000, 11)
+        elif name == 'GLOBAL_POSITION_INT':
+            m = mav.global_position_int_encode(ms, lat, lon, 650000, 50000, 100, 100, 0,
+                                               int(math.degrees(angle) * 100) % 36000)
+        elif name == 'ATTITUDE':
+            m = mav.attitude_encode(ms, 0.1*math.sin(t), 0.1*math.cos(t), angle % (2*math.pi), 0, 0, 0.1)
+        elif name == 'VFR_HUD':
+            m = mav.vfr_hud_encode(12, 12, int(math.degrees(angle)) % 360, 40, 50, 0.2)
+        elif name == 'RAW_IMU':
+            m = mav.raw_imu_encode(ms*1000, rand.randint(-50, 50), rand.randint(-50, 50), 1000,
+                                   0, 0, 0, 200, 100, -300)
+        elif name == 'RC_CHANNELS_RAW':
+            m = mav.rc_channels_raw_encode(ms, 0, 1500, 1500, 1400, 1500, 1000, 1000, 1000, 1000, 255)
+        elif name == 'SERVO_OUTPUT_RAW':
+            m = mav.servo_output_raw_encode(ms*1000, 0, 1500, 1500, 1400, 1500, 1000, 1000, 1000, 1000)
+        elif name == 'NAV_CONTROLLER_OUTPUT':
+            m = mav.nav_controller_output_encode(0, 0, 90, 90, 120, 0, 0, 0)
+        elif name == 'MISSION_CURRENT':
+            m = mav.mission_current_encode(1 + int(t) // 30)
+        else:
+            text_count += 1
+            m = mav.statustext_encode(6, 'benchmark %u' % text_count)
+        write_message(f, mav, m, t0 + t)
+    f.close()
+
+def make_param_log(filename, nparams=800, nitems=200):
+    '''write a log of a parameter and mission download'''
+    mavlink = mavutil.mavlink
+    f = open(filename, 'wb')
+    mav = mavlink.MAVLink(None, srcSystem=1, srcComponent=1)
+    t = 1400000000.0
+    for i in range(nparams):
+        m = mav.param_value_encode('PARAM_%04u' % i, i * 0.5, mavlink.MAV_PARAM_TYPE_REAL32, nparams, i)
+        write_message(f, mav, m, t)
+        t += 0.002
+        if i % 100 == 0:
+            write_message(f, mav, mav.heartbeat_encode(2, 3, 0, 0, 0), t)
+    write_message(f, mav, mav.mission_count_encode(255, 0, nitems), t)
+    for i in range(nitems):
+        m = mav.mission_item_encode(255, 0, i, 3, 16, 0, 1, 0, 0, 0, 0,
+                                    -35.36 + i*1.0e-4, 149.16 + i*1.0e-4, 100)
+        write_message(f, mav, m, t)
+        t += 0.01
+    f.close()
+
+reference_logs = [
+    ('copter.tlog', lambda f: make_telemetry_log(f, 1, 120,
+                                                [('HEARTBEAT', 1), ('SYS_STATUS', 2), ('GPS_RAW_INT', 5),
+                                                 ('GLOBAL_POSITION_INT', 10), ('ATTITUDE', 25), ('VFR_HUD', 10),
+                                                 ('RAW_IMU', 10), ('RC_CHANNELS_RAW', 5), ('SERVO_OUTPUT_RAW', 5),
+                                                 ('NAV_CONTROLLER_OUTPUT', 5), ('MISSION_CURRENT', 1),
+                                                 ('STATUSTEXT', 0.2)])),
+    ('swarm.tlog', lambda f: make_telemetry_log(f, 25, 20,
+                                               [('HEARTBEAT', 1), ('SYS_STATUS', 1), ('GLOBAL_POSITION_INT', 5),
+                                                ('ATTITUDE', 10), ('VFR_HUD', 5)])),
+    ('params.tlog', make_param_log),
+    ]
+
+def make_logs(directory):
+    '''write the reference logs, returning their paths'''
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    ret = []
+    for (name, fn) in reference_logs:
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            fn(path)
+        ret.append(path)
+    return ret
+
+#
+# headless stand-ins for the console and map GUIs
+#
+
+class HeadlessObject(object):
+    '''accepts any construction and method call'''
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return self
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+def install_headless_stubs():
+    '''replace the GUI parts of the console and map with headless stubs'''
+    from MAVProxy.modules.lib import textconsole
+
+    class MessageConsole(textconsole.SimpleConsole):
+        def __init__(self, title='MAVProxy: console'):
+            textconsole.SimpleConsole.__init__(self)
+        def write(self, text, fg='black', bg='white'):
+            pass
+        def set_status(self, name, text='', row=0, fg='black', bg='white'):
+            pass
+        def set_menu(self, menu, callback):
+            pass
+        def close(self):
+            pass
+        def is_alive(self):
+            return True
+
+    class MPSlipMap(HeadlessObject):
+        def check_events(self):
+            return []
+        def is_alive(self):
+            return True
+
+    stubs = {
+        'MAVProxy.modules.lib.wxconsole' : { 'MessageConsole' : MessageConsole },
+        'MAVProxy.modules.lib.wxsettings' : { 'WXSettings' : HeadlessObject },
+        'MAVProxy.modules.mavproxy_map.mp_slipmap' : { 'MPSlipMap' : MPSlipMap },
+        'MAVProxy.modules.lib.mp_menu' : {},
+        }
+    for name in ['MPMenuSeparator', 'MPMenuItem', 'MPMenuCheckbox', 'MPMenuRadio', 'MPMenuSubMenu',
+                 'MPMenuTop', 'MPMenuCallFileDialog', 'MPMenuCallTextDialog']:
+        stubs['MAVProxy.modules.lib.mp_menu'][name] = HeadlessObject
+    for name in ['SlipObject', 'SlipLabel', 'SlipCircle', 'SlipPolygon', 'SlipGrid', 'SlipThumbnail',
+                 'SlipIcon', 'SlipClearLayer', 'SlipRemoveObject', 'SlipInformation', 'SlipBrightness',
+                 'SlipDefaultPopup', 'SlipCenter', 'SlipFollow', 'SlipHideObject']:
+        stubs['MAVProxy.modules.mavproxy_map.mp_slipmap'][name] = HeadlessObject
+    sys.meta_path.insert(0, HeadlessImporter(stubs))
+
+def install_offline_stubs():
+    '''replace the elevation model, which downloads SRTM tiles, with a stub'''
+    class ElevationModel(HeadlessObject):
+        def GetElevation(self, latitude, longitude, timeout=0):
+            return 0
+
+    stubs = {
+        'MAVProxy.modules.mavproxy_map.mp_elevation' : { 'ElevationModel' : ElevationModel },
+        }
+    sys.meta_path.insert(0, HeadlessImporter(stubs))
+
+class HeadlessImporter(object):
+    '''an import hook returning stub modules in place of GUI modules'''
+    def __init__(self, stubs):
+        self.stubs = stubs
+
+    def find_module(self, fullname, path=None):
+        if fullname in self.stubs:
+            return self
+        return None
+
+    def load_module(self, fullname):
+        if fullname in sys.modules:
+            return sys.modules[fullname]
+        mod = types.ModuleType(fullname)
+        mod.__loader__ = self
+        for (k, v) in self.stubs[fullname].items():
+            setattr(mod, k, v)
+        sys.modules[fullname] = mod
+        (parent, name) = fullname.rsplit('.', 1)
+        if parent in sys.modules:
+            setattr(sys.modules[parent], name, mod)
+        return mod
+
+#
+# the benchmark
+#
+
+from MAVProxy import mavproxy
+from MAVProxy.modules.lib import textconsole
+from MAVProxy.modules.lib import rline
+from MAVProxy.modules.lib import mp_output
+from MAVProxy.modules.lib import mp_tlog
+
+class QuietConsole(textconsole.SimpleConsole):
+    '''a console that discards all output'''
+    def write(self, text, fg='black', bg='white'):
+        pass
+
+class BenchOptions(object):
+    '''the command line options used by the packet path'''
+    def __init__(self):
+        self.setup = False
+        self.auto_protocol = False
+        self.show_errors = False
+        self.aircraft = None
+        self.mission = None
+        self.speech = False
+
+class NullOutput(object):
+    '''an output that counts what is written to it'''
+    def __init__(self):
+        self.address = 'bench'
+        self.fd = None
+        self.bytes = 0
+        self.writes = 0
+
+    def write(self, buf):
+        self.bytes += len(buf)
+        self.writes += 1
+
+class FakeMaster(object):
+    '''feeds a log's raw data to process_master() in chunks'''
+    def __init__(self, mlog, data, chunk):
+        self.mlog = mlog
+        self.data = data
+        self.chunk = chunk
+        self.ofs = 0
+        mlog.recv = self.recv
+
+    def recv(self, n=None):
+        if n is None:
+            n = self.chunk
+        n = min(n, self.chunk)
+        ret = self.data[self.ofs:self.ofs+n]
+        self.ofs += n
+        return ret
+
+    def run(self):
+        '''pass all the data through process_master()'''
+        self.ofs = 0
+        while self.ofs < len(self.data):
+            mavproxy.process_master(self.mlog)
+
+def setup_mpstate(mlog):
+    '''create a mavproxy state with the log as its only master'''
+    mavproxy.opts = BenchOptions()
+    mavproxy.mavutil = mavutil
+    mavproxy.mavparm = mavparm
+    mpstate = mavproxy.MPState()
+    mavproxy.mpstate = mpstate
+    mpstate.console = QuietConsole()
+    mpstate.command_map = mavproxy.command_map
+    mpstate.rl = rline.rline("MAV> ", mpstate)
+    mpstate.logwriter = None
+    mpstate.logwriter_raw = None
+    mpstate.status.logdir = tempfile.mkdtemp(prefix='mavbench')
+    mlog.linknum = 0
+    mlog.linkerror = False
+    mlog.link_delayed = False
+    mlog.last_heartbeat = 0
+    mlog.last_message = 0
+    mlog.highest_msec = 0
+    mlog.mav.set_callback(mavproxy.master_callback, mlog)
+    mpstate.mav_master = [mlog]
+    mpstate.status.counters['MasterIn'].append(0)
+    if opts.watch is not None:
+        mavproxy.cmd_watch([opts.watch])
+    return mpstate
+
+def add_null_output(mpstate):
+    '''add an output to measure forwarding'''
+    conn = NullOutput()
+    conn.filter = mp_output.OutputFilter()
+    conn.sendq = mp_output.SendQueue(conn, mpstate.selector)
+    mpstate.mav_outputs.append(conn)
+    return conn
+
+def load_messages(filename):
+    '''decode all messages in a log, returning the log and the messages'''
+    mlog = mp_tlog.mavlink_log(filename)
+    msgs = []
+    while True:
+        m = mlog.recv_msg()
+        if m is None:
+            break
+        if m.get_type() == 'BAD_DATA':
+            continue
+        msgs.append(m)
+    return (mlog, msgs)
+
+def peak_rss():
+    '''peak resident memory of this process in bytes'''
+    try:
+        import resource
+    except ImportError:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss
+    return rss * 1024
+
+def best_time(fn):
+    '''the fastest of opts.repeat calls of fn'''
+    best = None
+    for i in range(opts.repeat):
+        t0 = time.time()
+        fn()
+        elapsed = time.time() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def bench_single(config, filename):
+    '''benchmark one configuration on one log, returning a dictionary of results'''
+    install_offline_stubs()
+    if config == 'gui':
+        install_headless_stubs()
+    (mlog, msgs) = load_messages(filename)
+    if len(msgs) == 0:
+        return None
+    data = ''.join([str(m.get_msgbuf()) for m in msgs])
+    mpstate = setup_mpstate(mlog)
+    load_output = StringIO.StringIO()
+    stdout = sys.stdout
+    sys.stdout = load_output
+    try:
+        for modname in configs[config]:
+            mavproxy.load_module(modname, quiet=True)
+        loaded = [m.name for (m, pm) in mpstate.modules]
+        missing = [m for m in configs[config] if not m in loaded]
+        if missing:
+            # the numbers would not be those of the configuration
+            return { 'log' : os.path.basename(filename), 'config' : config,
+                     'error' : 'failed to load: %s' % ' '.join(missing),
+                     'load_output' : load_output.getvalue() }
+        sys.stdout = open(os.devnull, 'w')
+        out = add_null_output(mpstate)
+        master = FakeMaster(mlog, data, opts.chunk)
+
+        # decode only
+        def decode():
+            mav = mavutil.mavlink.MAVLink(None)
+            for i in range(0, len(data), opts.chunk):
+                mav.parse_buffer(data[i:i+opts.chunk])
+        t_decode = best_time(decode)
+
+        # the full path
+        t_total = best_time(master.run)
+
+        # again, with module and output timing
+        mpstate.perf.enabled = True
+        forward_time = [0.0]
+        forward_message = mavproxy.forward_message
+        def timed_forward(m, mtype):
+            t0 = time.time()
+            forward_message(m, mtype)
+            forward_time[0] += time.time() - t0
+        mavproxy.forward_message = timed_forward
+        # raw passthrough would hide the output cost in process_master
+        passthrough = mpstate.settings.passthrough
+        mpstate.settings.passthrough = False
+        t0 = time.time()
+        master.run()
+        t_timed = time.time() - t0
+        mavproxy.forward_message = forward_message
+        mpstate.settings.passthrough = passthrough
+        mpstate.perf.enabled = False
+        t_modules = sum([s.total for s in mpstate.perf.by_module().values()])
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(mpstate.status.logdir, ignore_errors=True)
+
+    n = len(msgs)
+    return {
+        'log' : os.path.basename(filename),
+        'config' : config,
+        'modules' : loaded,
+        'messages' : n,
+        'bytes' : len(data),
+        'msgs_per_sec' : n / t_total,
+        'usec_per_msg' : {
+            'decode' : 1.0e6 * t_decode / n,
+            'core' : 1.0e6 * max(0, t_timed - t_decode - t_modules - forward_time[0]) / n,
+            'modules' : 1.0e6 * t_modules / n,
+            'outputs' : 1.0e6 * forward_time[0] / n,
+            'total' : 1.0e6 * t_total / n,
+            },
+        'module_usec_per_msg' : dict([(k, 1.0e6 * v.total / n) for (k, v) in mpstate.perf.by_module().items()]),
+        'output_bytes' : out.bytes,
+        'peak_rss' : peak_rss(),
+        'repeat' : opts.repeat,
+        }
+
+def run_single(config, filename):
+    '''run one benchmark in a child process, returning its results'''
+    cmd = [sys.executable, os.path.realpath(__file__), '--single', '--config', config,
+           '--repeat', str(opts.repeat), '--dialect', opts.dialect, '--chunk', str(opts.chunk)]
+    if opts.watch is not None:
+        cmd.extend(['--watch', opts.watch])
+    cmd.append(filename)
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    (out, err) = p.communicate()
+    try:
+        return json.loads(out.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        return { 'log' : os.path.basename(filename), 'config' : config,
+                 'error' : 'exit status %d' % p.returncode }
+
+def show_result(r):
+    '''print one result'''
+    if 'error' in r:
+        print("%-12s %-9s ERROR %s" % (r['log'], r['config'], r['error']))
+        for line in r.get('load_output', '').splitlines():
+            print("%-12s %-9s   %s" % ('', '', line))
+        return
+    u = r['usec_per_msg']
+    print("%-12s %-9s %8u msgs %9.0f msgs/s  decode %5.1f core %5.1f modules %5.1f outputs %5.1f us/msg  %6.1f MB" % (
+        r['log'], r['config'], r['messages'], r['msgs_per_sec'],
+        u['decode'], u['core'], u['modules'], u['outputs'], r['peak_rss'] / (1024.0*1024.0)))
+
+if __name__ == "__main__":
+    if opts.make_logs is not None:
+        for f in make_logs(opts.make_logs):
+            print(f)
+        sys.exit(0)
+
+    if opts.single:
+        if len(args) != 1 or not opts.config in configs:
+            print("--single needs one configuration and one log")
+            sys.exit(1)
+        r = bench_single(opts.config, args[0])
+        if r is None:
+            print("%s: no messages" % args[0])
+            sys.exit(1)
+        print(json.dumps(r))
+        if 'error' in r:
+            sys.exit(1)
+        sys.exit(0)
+
+    if len(args) == 0:
+        args = make_logs(os.path.join(tempfile.gettempdir(), 'mavbench-logs'))
+
+    results = []
+    for config in opts.config.split(','):
+        if not config in configs:
+            print("Unknown configuration %s, must be one of %s" % (config, ','.join(sorted(configs.keys()))))
+            sys.exit(1)
+        for f in args:
+            r = run_single(config, f)
+            show_result(r)
+            results.append(r)
+
+    if opts.json is not None:
+        f = open(opts.json, 'w')
+        json.dump({ 'python' : sys.version.split()[0],
+                    'time' : time.time(),
+                    'results' : results }, f, indent=2, sort_keys=True)
+        f.close()
+
+    if [r for r in results if 'error' in r]:
+        sys.exit(1)
@@ -9,6 +9,7 @@ import sys, time, os
 from pymavlink import mavutil, mavwp, mavextra
 from MAVProxy.modules.mavproxy_map import mp_slipmap, mp_tile
 from MAVProxy.modules.lib import mp_util
+from MAVProxy.modules.lib import mp_tlog
 import functools
 
 try:
@@ -84,7 +85,7 @@ colourmap = {
 
 def mavflightview(filename):
     print("Loading %s ..." % filename)
-    mlog = mavutil.mavlink_connection(filename)
+    mlog = mp_tlog.mavlink_log(filename)
     wp = mavwp.MAVWPLoader()
     if opts.mission is not None:
         wp.load(opts.mission)
@@ -104,13 +105,26 @@ def mavflightview(filename):
     if len(types) == 1:
         types.extend(['GPS','GLOBAL_POSITION_INT'])
     print("Looking for types %s" % str(types))
+    messages = None
+    if opts.condition is None:
+        # read just the records needed, and HEARTBEAT for the flight mode
+        index_types = types + ['HEARTBEAT']
+        index = mp_tlog.load_index(filename, mp_tlog.type_msgids(index_types))
+        if index is not None:
+            print("Using index of %u records" % index.records())
+            messages = mp_tlog.recv_indexed(mlog, index, index_types)
     while True:
         try:
-            m = mlog.recv_match(type=types)
+            if messages is not None:
+                m = next(messages, None)
+            else:
+                m = mlog.recv_match(type=types)
             if m is None:
                 break
         except Exception:
             break
+        if m.get_type() == 'HEARTBEAT':
+            continue
         if m.get_type() == 'MISSION_ITEM':
             wp.set(m, m.seq)            
             continue
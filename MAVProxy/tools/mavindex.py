@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+'''
+write or show the sidecar index of telemetry logs
+
+MAVProxy indexes the logs it writes. This indexes older logs, or logs
+whose index was lost, so mavflightview and other readers can go
+straight to the records they want. Compressed logs are indexed by
+their decompressed offsets.
+
+  mavindex.py logs/*/flight*/flight*.tlog*
+'''
+
+import sys, os, time
+
+from optparse import OptionParser
+parser = OptionParser("mavindex.py [options] <LOGFILE...>")
+parser.add_option("--force", action='store_true', default=False, help="rewrite existing indexes")
+parser.add_option("--show", action='store_true', default=False, help="show the index instead of writing it")
+
+(opts, args) = parser.parse_args()
+
+from pymavlink import mavutil
+from MAVProxy.modules.lib import mp_tlog
+
+def show_index(filename):
+    '''print a summary of the index of a log'''
+    index = mp_tlog.load_index(filename)
+    if index is None:
+        print("%s: no index" % filename)
+        return
+    print("%s: %u records in %u chunks, %u bytes indexed" % (
+        filename, index.records(), len(index.chunks), index.end))
+    if index.chunks:
+        print("  %.1f seconds from %s" % (
+            (index.chunks[-1][0] - index.chunks[0][0]) * 1.0e-6,
+            time.ctime(index.chunks[0][0] * 1.0e-6)))
+    for msgid in sorted(index.offsets.keys()):
+        name = 'ID_%u' % msgid
+        if msgid in mavutil.mavlink.mavlink_map:
+            name = mavutil.mavlink.mavlink_map[msgid].name
+        print("  %-30s %u" % (name, len(index.offsets[msgid])))
+
+def write_index(filename):
+    '''index a log, unless it already has a complete index'''
+    if not opts.force:
+        index = mp_tlog.load_index(filename, msgids=set())
+        if index is not None and index.end > 0:
+            f = open(filename, 'rb')
+            compressed = mp_tlog.compression(f) is not None
+            f.close()
+            if compressed or index.end == os.path.getsize(filename):
+                print("%s: already indexed" % filename)
+                return
+    t0 = time.time()
+    count = mp_tlog.index_log(filename)
+    print("%s: indexed %u records in %.1fs" % (filename, count, time.time() - t0))
+
+if len(args) < 1:
+    print("Usage: mavindex.py [options] <LOGFILE...>")
+    sys.exit(1)
+
+for filename in args:
+    if filename.endswith(mp_tlog.INDEX_SUFFIX):
+        continue
+    if opts.show:
+        show_index(filename)
+    else:
+        write_index(filename)
@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+
+'''
+load test MAVProxy with a swarm of synthetic vehicles
+
+starts mavproxy.py with its standard modules, feeds it telemetry from
+N simulated vehicles over UDP or a pty, and listens on a UDP output to
+measure throughput, loss and forwarding latency. CPU and RSS of the
+mavproxy process are read from /proc. Everything runs on localhost.
+
+  mavswarm.py --vehicles 1,10,50,100 --duration 20
+'''
+
+import sys, os, time, socket, select, heapq, math, subprocess, tempfile, shutil, tty
+
+from optparse import OptionParser
+parser = OptionParser("mavswarm.py [options]")
+parser.add_option("--vehicles", default="1,10,50", help="comma separated list of vehicle counts to test")
+parser.add_option("--rate", type='float', default=10, help="rate in Hz of the fast streams (position, attitude, VFR_HUD)")
+parser.add_option("--duration", type='float', default=10, help="seconds to measure each vehicle count")
+parser.add_option("--warmup", type='float', default=3, help="seconds to run before measuring")
+parser.add_option("--transport", default='udp', help="link to mavproxy, udp or pty")
+parser.add_option("--port", type='int', default=14650, help="base UDP port")
+parser.add_option("--mavproxy", default=None, help="path to mavproxy.py")
+parser.add_option("--mavproxy-args", default="", help="extra mavproxy arguments")
+parser.add_option("--dialect", default="ardupilotmega", help="MAVLink dialect")
+parser.add_option("--debug", action='store_true', default=False, help="show mavproxy output")
+
+(opts, args) = parser.parse_args()
+
+from pymavlink import mavutil
+mavutil.set_dialect(opts.dialect)
+mavlink = mavutil.mavlink
+
+# message streams sent by each vehicle, as (name, rate). A rate of
+# None uses --rate
+streams = [ ('HEARTBEAT', 1),
+            ('SYS_STATUS', 2),
+            ('GPS_RAW_INT', 5),
+            ('GLOBAL_POSITION_INT', None),
+            ('ATTITUDE', None),
+            ('VFR_HUD', None) ]
+
+class SwarmVehicle(object):
+    '''a synthetic vehicle flying a circle'''
+    def __init__(self, sysid):
+        self.sysid = sysid
+        self.mav = mavlink.MAVLink(None, srcSystem=sysid, srcComponent=1)
+        self.t0 = time.time()
+        # spread the vehicles around a common centre
+        self.radius = 50 + 10*sysid
+        self.phase = sysid * 0.7
+
+    def position(self, now):
+        '''return lat, lon, heading in degrees'''
+        angle = self.phase + (now - self.t0) * 15.0 / self.radius
+        lat = -35.363 + self.radius * math.cos(angle) / 111319.5
+        lon = 149.165 + self.radius * math.sin(angle) / (111319.5 * math.cos(math.radians(35.363)))
+        heading = (math.degrees(angle) + 90) % 360
+        return (lat, lon, heading)
+
+    def message(self, name, now):
+        '''encode a message, returning the packed buffer and the message'''
+        mav = self.mav
+        boot_ms = int((now - self.t0) * 1000) & 0xFFFFFFFF
+        (lat, lon, heading) = self.position(now)
+        if name == 'HEARTBEAT':
+            m = mav.heartbeat_encode(mavlink.MAV_TYPE_QUADROTOR, mavlink.MAV_AUTOPILOT_ARDUPILOTMEGA,
+                                     mavlink.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED | mavlink.MAV_MODE_FLAG_SAFETY_ARMED,
+                                     3, mavlink.MAV_STATE_ACTIVE)
+        elif name == 'SYS_STATUS':
+            m = mav.sys_status_encode(0, 0, 0, 250, 12400, 1500, 75, 0, 0, 0, 0, 0, 0)
+        elif name == 'GPS_RAW_INT':
+            m = mav.gps_raw_int_encode(boot_ms*1000, 3, int(lat*1.0e7), int(lon*1.0e7), 600000,
+                                       120, 150, 1500, int(heading*100), 12)
+        elif name == 'GLOBAL_POSITION_INT':
+            m = mav.global_position_int_encode(boot_ms, int(lat*1.0e7), int(lon*1.0e7), 650000, 50000,
+                                               0, 0, 0, int(heading*100))
+        elif name == 'ATTITUDE':
+            m = mav.attitude_encode(boot_ms, 0.05, -0.02, math.radians(heading), 0.01, 0.01, 0.2)
+        else:
+            m = mav.vfr_hud_encode(15, 15, int(heading), 45, 50, 0.1)
+        return (m.pack(mav), m)
+
+class Link(object):
+    '''the vehicles' side of the connection to mavproxy'''
+    def __init__(self, transport, nvehicles, port):
+        self.transport = transport
+        self.socks = []
+        self.fds = []
+        self.sock_by_fd = {}
+        if transport == 'udp':
+            self.master = 'udpin:127.0.0.1:%u' % port
+            self.dest = ('127.0.0.1', port)
+            for i in range(nvehicles):
+                s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                s.setblocking(0)
+                s.bind(('127.0.0.1', 0))
+                self.socks.append(s)
+                self.fds.append(s.fileno())
+                self.sock_by_fd[s.fileno()] = s
+        elif transport == 'pty':
+            (self.pty_master, pty_slave) = os.openpty()
+            self.master = os.ttyname(pty_slave)
+            tty.setraw(pty_slave)
+            # keep the slave open so writes don't fail before mavproxy opens it
+            self.pty_slave = pty_slave
+            self.fds.append(self.pty_master)
+        else:
+            raise ValueError("unknown transport %s" % transport)
+
+    def send(self, idx, buf):
+        '''send a buffer from vehicle idx, returning False if it was not sent'''
+        try:
+            if self.transport == 'udp':
+                self.socks[idx].sendto(buf, self.dest)
+            else:
+                os.write(self.pty_master, buf)
+        except (socket.error, OSError):
+            return False
+        return True
+
+    def drain(self, fd):
+        '''discard data sent by mavproxy to the vehicles'''
+        try:
+            if self.transport == 'udp':
+                s = self.sock_by_fd[fd]
+                while True:
+                    s.recv(65536)
+            else:
+                os.read(fd, 65536)
+        except (socket.error, OSError):
+            pass
+
+    def close(self):
+        for s in self.socks:
+            s.close()
+        if self.transport == 'pty':
+            os.close(self.pty_master)
+            os.close(self.pty_slave)
+
+def proc_stats(pid):
+    '''return (cpu seconds, rss bytes) of a process from /proc'''
+    try:
+        f = open('/proc/%u/stat' % pid)
+        fields = f.read().rsplit(')', 1)[1].split()
+        f.close()
+        cpu = (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK'))
+        rss = int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, IndexError, ValueError):
+        return (0, 0)
+    return (cpu, rss)
+
+def percentile(values, p):
+    '''return the p'th percentile of a sorted list'''
+    if len(values) == 0:
+        return 0
+    idx = min(len(values)-1, int(len(values) * p / 100.0))
+    return values[idx]
+
+def start_mavproxy(master, outport, logdir):
+    '''start mavproxy.py, returning the process'''
+    mavproxy = opts.mavproxy
+    if mavproxy is None:
+        mavproxy = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'mavproxy.py')
+    cmd = [sys.executable, mavproxy, '--master=%s' % master,
+           '--out=udpout:127.0.0.1:%u' % outport, '--nowait']
+    cmd.extend(opts.mavproxy_args.split())
+    if opts.debug:
+        output = None
+    else:
+        output = open(os.devnull, 'w')
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.realpath(os.path.join(os.path.dirname(mavproxy), '..')) + os.pathsep + env.get('PYTHONPATH', '')
+    # stdin is kept open so the input thread doesn't see EOF
+    return subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=output, stderr=output,
+                            cwd=logdir, env=env)
+
+def run_swarm(nvehicles):
+    '''run one test, returning a dictionary of results'''
+    port = opts.port
+    outport = opts.port + 1
+    link = Link(opts.transport, nvehicles, port)
+
+    listen = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    listen.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4*1024*1024)
+    listen.bind(('127.0.0.1', outport))
+    listen.setblocking(0)
+    parser = mavlink.MAVLink(None)
+    parser.robust_parsing = True
+
+    logdir = tempfile.mkdtemp(prefix='mavswarm')
+    proc = start_mavproxy(link.master, outport, logdir)
+
+    vehicles = [SwarmVehicle(i+1) for i in range(nvehicles)]
+    now = time.time()
+    schedule = []
+    for i in range(nvehicles):
+        for (name, rate) in streams:
+            if rate is None:
+                rate = opts.rate
+            # stagger the first send so vehicles don't all send at once
+            when = now + 0.5 + (i * 0.013 + len(name) * 0.001) % (1.0/rate)
+            schedule.append((when, i, name, 1.0/rate))
+    heapq.heapify(schedule)
+
+    # send time of each message, for latency
+    sent_time = {}
+    latencies = []
+    sent = 0
+    send_fail = 0
+    received = 0
+    measuring = False
+    start_time = now + opts.warmup
+    end_time = start_time + opts.duration
+    cpu_start = None
+    rss_max = 0
+
+    poll_fds = [listen.fileno()] + link.fds
+    while True:
+        now = time.time()
+        if proc.poll() is not None:
+            print("mavproxy exited with status %s" % proc.returncode)
+            break
+        if not measuring and now >= start_time:
+            measuring = True
+            cpu_start = proc_stats(proc.pid)[0]
+            sent = received = send_fail = 0
+            latencies = []
+            sent_time = {}
+        if now >= end_time:
+            break
+
+        # send everything that is due
+        while schedule and schedule[0][0] <= now:
+            (when, idx, name, period) = heapq.heappop(schedule)
+            (buf, m) = vehicles[idx].message(name, now)
+            if link.send(idx, buf):
+                sent += 1
+                sent_time[(idx+1, m.get_msgId(), m.get_seq())] = time.time()
+            else:
+                send_fail += 1
+            next_when = when + period
+            if next_when < now:
+                # we are falling behind, don't try to catch up
+                next_when = now + period
+            heapq.heappush(schedule, (next_when, idx, name, period))
+
+        timeout = 0.1
+        if schedule:
+            timeout = max(0, min(timeout, schedule[0][0] - time.time()))
+        (rin, win, xin) = select.select(poll_fds, [], [], timeout)
+        for fd in rin:
+            if fd != listen.fileno():
+                link.drain(fd)
+                continue
+            while True:
+                try:
+                    data = listen.recv(65536)
+                except socket.error:
+                    break
+                tnow = time.time()
+                msgs = parser.parse_buffer(data)
+                if msgs is None:
+                    continue
+                for m in msgs:
+                    if m.get_type() == 'BAD_DATA':
+                        continue
+                    key = (m.get_srcSystem(), m.get_msgId(), m.get_seq())
+                    t = sent_time.pop(key, None)
+                    if t is None:
+                        # mavproxy's own messages, or sent before the warmup finished
+                        continue
+                    received += 1
+                    latencies.append(tnow - t)
+        if measuring:
+            rss_max = max(rss_max, proc_stats(proc.pid)[1])
+
+    (cpu_end, rss) = proc_stats(proc.pid)
+    proc.terminate()
+    proc.wait()
+    link.close()
+    listen.close()
+    shutil.rmtree(logdir, ignore_errors=True)
+
+    latencies.sort()
+    elapsed = opts.duration
+    return {
+        'vehicles' : nvehicles,
+        'sent' : sent,
+        'received' : received,
+        'send_fail' : send_fail,
+        'rate' : sent / elapsed,
+        'loss' : 100.0 * (sent - received) / max(sent, 1),
+        'cpu' : 100.0 * (cpu_end - (cpu_start or cpu_end)) / elapsed,
+        'rss' : rss_max / (1024.0*1024.0),
+        'p50' : percentile(latencies, 50) * 1000,
+        'p95' : percentile(latencies, 95) * 1000,
+        'p99' : percentile(latencies, 99) * 1000,
+        'max' : (latencies[-1] if latencies else 0) * 1000,
+        }
+
+def show_results(results):
+    '''print a table of results'''
+    print("%8s %9s %7s %6s %7s %8s %8s %8s %8s" % ('vehicles', 'msgs/s', 'loss%', 'cpu%', 'rssMB',
+                                                 'p50ms', 'p95ms', 'p99ms', 'maxms'))
+    for r in results:
+        print("%8u %9.0f %7.2f %6.1f %7.1f %8.2f %8.2f %8.2f %8.2f" % (
+            r['vehicles'], r['rate'], r['loss'], r['cpu'], r['rss'],
+            r['p50'], r['p95'], r['p99'], r['max']))
+
+if __name__ == "__main__":
+    results = []
+    for n in opts.vehicles.split(','):
+        n = int(n)
+        print("Testing %u vehicles over %s" % (n, opts.transport))
+        r = run_swarm(n)
+        results.append(r)
+        show_results([r])
+        # give the ports time to be released
+        time.sleep(1)
+    print("")
+    show_results(results)